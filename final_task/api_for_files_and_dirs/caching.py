@@ -0,0 +1,233 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache, wraps
+from typing import Callable, List, Optional, Tuple
+
+from api_for_files_and_dirs.executors import run_database
+from background_parser.generation import (bump_generation, get_generation,
+                                          peek_generation)
+from background_parser.metrics import CACHE_REQUESTS, REGISTRY
+from background_parser.parser import get_word_statistic_cache
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Content, status and headers of the response.
+CachedResponse = Tuple[bytes, int, List[Tuple[str, str]]]
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of rendered responses of one scan generation. All
+    responses are dropped when the generation changes.
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.generation: Optional[int] = None
+        self.size = 0
+        self.hits = self.misses = 0
+        self.__responses: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, generation: int, key: str) -> Optional[CachedResponse]:
+        with self.__lock:
+            self.__check_generation(generation)
+            response = self.__responses.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.__responses.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, generation: int, key: str, response: CachedResponse):
+        size = len(response[0])
+        if size > self.max_size:
+            return
+        with self.__lock:
+            self.__check_generation(generation)
+            if key in self.__responses:
+                self.size -= len(self.__responses.pop(key)[0])
+            self.__responses[key] = response
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.__responses.popitem(last=False)
+                self.size -= len(evicted[0])
+
+    def statistic(self) -> dict:
+        return {
+            "generation": self.generation,
+            "responses": len(self.__responses),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __check_generation(self, generation: int):
+        if generation != self.generation:
+            self.__responses.clear()
+            self.size = 0
+            self.generation = generation
+
+
+@lru_cache(maxsize=None)
+def get_response_cache() -> ResponseCache:
+    """
+    Returns response cache shared by the whole process.
+    """
+    return ResponseCache(getattr(settings, 'RESPONSE_CACHE_SIZE',
+                                 64 * 1024 ** 2))
+
+
+def collect_cache_metrics():
+    """
+    Updates metrics of the caches of the API process.
+    """
+    response_cache = get_response_cache()
+    words = get_word_statistic_cache().cache_info()
+    for cache, hits, misses in (
+            ("response", response_cache.hits, response_cache.misses),
+            ("word_statistic", words.hits, words.misses)):
+        CACHE_REQUESTS.set(hits, cache=cache, result="hit")
+        CACHE_REQUESTS.set(misses, cache=cache, result="miss")
+
+
+REGISTRY.add_collector(collect_cache_metrics)
+
+
+def get_validators(request, generation: int,
+                   updated: datetime) -> Tuple[str, str, int]:
+    """
+    Returns key of the response in the cache, its ETag and time of its last
+    modification.
+    :rtype: tuple
+    """
+    # Representation depends on the query and the requested format.
+    key = f"{request.get_full_path()}\n" \
+          f"{request.META.get('HTTP_ACCEPT', '')}"
+    etag = '"{}-{}"'.format(generation, hashlib.blake2b(
+        key.encode("utf-8"), digest_size=8).hexdigest())
+    return key, etag, int(updated.timestamp())
+
+
+def to_cached(response) -> Optional[CachedResponse]:
+    """
+    Renders the response and returns it in the form kept by the cache,
+    None if the response should not be cached.
+    """
+    if hasattr(response, "render"):
+        response.render()
+    if response.streaming or response.status_code != 200 or \
+            not response.get("Content-Type", "").startswith(
+                "application/json"):
+        return None
+    return response.content, response.status_code, list(response.items())
+
+
+def from_cached(cached: CachedResponse, etag: str,
+                last_modified: int) -> HttpResponse:
+    """
+    Returns response from the cache with the validators.
+    """
+    content, status, headers = cached
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    return add_validators(response, etag, last_modified)
+
+
+def add_validators(response, etag: str, last_modified: int):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def cached_by_generation(view: Callable) -> Callable:
+    """
+    Decorates read-only view: its responses get ETag and Last-Modified
+    headers of the scan generation, conditional requests are answered
+    with 304 and JSON responses are kept in the response cache until
+    the next scan.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return view(request, *args, **kwargs)
+
+        generation, updated = get_generation()
+        key, etag, last_modified = get_validators(request, generation,
+                                                  updated)
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is not None:
+            return add_validators(response, etag, last_modified)
+
+        cache = get_response_cache()
+        cached = cache.get(generation, key)
+        if cached is None:
+            response = view(request, *args, **kwargs)
+            cached = to_cached(response)
+            if cached is None:
+                return response
+            cache.put(generation, key, cached)
+        return from_cached(cached, etag, last_modified)
+
+    return wrapper
+
+
+def async_cached_by_generation(view: Callable) -> Callable:
+    """
+    cached_by_generation for async views, the generation is read in
+    the database threads when it is not trusted anymore.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return await view(request, *args, **kwargs)
+
+        generation, updated = peek_generation() or \
+            await run_database(get_generation)
+        key, etag, last_modified = get_validators(request, generation,
+                                                  updated)
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is not None:
+            return add_validators(response, etag, last_modified)
+
+        cache = get_response_cache()
+        cached = cache.get(generation, key)
+        if cached is None:
+            response = await view(request, *args, **kwargs)
+            cached = to_cached(response)
+            if cached is None:
+                return response
+            cache.put(generation, key, cached)
+        return from_cached(cached, etag, last_modified)
+
+    return wrapper
+
+
+class GenerationCacheMixin:
+    """
+    Caches responses of the viewset by scan generation, see
+    cached_by_generation. Changes made through the viewset increase
+    the generation.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        return cached_by_generation(super().dispatch)(
+            request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        bump_generation()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        bump_generation()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_generation()
@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial, wraps
+from typing import Callable
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+@lru_cache(maxsize=None)
+def get_database_executor() -> ThreadPoolExecutor:
+    """
+    Returns threads which run database queries of async views. Every
+    thread keeps its own connection, so the number of connections of
+    the process is bounded by API_DATABASE_THREADS.
+    """
+    return ThreadPoolExecutor(
+        max_workers=getattr(settings, 'API_DATABASE_THREADS', 16),
+        thread_name_prefix="api-database")
+
+
+@lru_cache(maxsize=None)
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """
+    Returns threads which calculate statistic of words for async views,
+    so the event loop is not blocked by the calculation.
+    """
+    return ThreadPoolExecutor(
+        max_workers=getattr(settings, 'API_CPU_THREADS', 4),
+        thread_name_prefix="api-cpu")
+
+
+def with_database_connection(function: Callable) -> Callable:
+    """
+    Closes connection of the thread after the function if it is broken or
+    older than CONN_MAX_AGE, as Django does after every request.
+    """
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return wrapper
+
+
+async def run_database(function: Callable, *args, **kwargs):
+    """
+    Runs function which queries the database in the database threads.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_database_executor(),
+        partial(with_database_connection(function), *args, **kwargs))
+
+
+async def run_cpu(function: Callable, *args, **kwargs):
+    """
+    Runs CPU bound function in the calculation threads.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        get_cpu_executor(), partial(function, *args, **kwargs))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PathCursorPagination(CursorPagination):
+    """
+    Keyset pagination ordered by path: every page is found by the index
+    of the path, so late pages are as fast as the first one.
+    Size of the page is given by `limit` query parameter.
+    """
+    ordering = "path"
+    page_size_query_param = "limit"
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+        self.max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+
+class FileCursorPagination(PathCursorPagination):
+    ordering = "file"
+
+
+class DirectoryCursorPagination(PathCursorPagination):
+    ordering = "directory_name"
@@ -1,18 +1,46 @@
-from background_parser.models import DirectoryStatistic, FileStatistic
+from background_parser.models import (DirectoryStatistic, FileStatistic,
+                                      PathNode)
+from background_parser.tree_index import get_files_and_dirs
 from rest_framework import serializers
 
 
-class FileSerializer(serializers.HyperlinkedModelSerializer):
+class SparseFieldsMixin:
+    """
+    Serializer which returns only the fields given by `fields` argument.
+    """
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class FileSerializer(SparseFieldsMixin,
+                     serializers.HyperlinkedModelSerializer):
     class Meta:
         model = FileStatistic
         fields = ['file', 'slug', 'most_recent_word', 'least_recent_word',
-                  'average_word_length', 'vowels', 'consonants']
+                  'average_word_length', 'vowels', 'consonants',
+                  'extraction_outcome']
 
 
-class DirectorySerializer(serializers.HyperlinkedModelSerializer):
+class DirectorySerializer(SparseFieldsMixin,
+                          serializers.HyperlinkedModelSerializer):
+    files_and_dirs = serializers.SerializerMethodField()
+
     class Meta:
         model = DirectoryStatistic
         fields = ['directory_name', 'slug', 'files_and_dirs',
                   'number_of_files',
                   'most_recent_word', 'least_recent_word',
-                  'average_word_length', 'vowels', 'consonants']
+                  'average_word_length', 'vowels', 'consonants',
+                  'word_frequency_mode', 'word_frequency_bounds']
+
+    def get_files_and_dirs(self, obj):
+        return get_files_and_dirs(obj.directory_name)
+
+
+class PathNodeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PathNode
+        fields = ['id', 'path', 'parent', 'is_dir']
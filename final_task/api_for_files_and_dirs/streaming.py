@@ -0,0 +1,52 @@
+from itertools import islice
+from typing import Callable, Iterator, List
+
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def stream_json_array(queryset: QuerySet,
+                      serialize: Callable[[List], List[dict]],
+                      batch_size: int) -> Iterator[bytes]:
+    """
+    Serializes rows of the queryset into JSON array batch by batch, so
+    only one batch is kept in memory.
+    :param queryset: Rows to serialize.
+    :param serialize: Function which serializes list of rows.
+    :param int batch_size: Number of rows loaded and serialized at once.
+    :return: parts of the JSON array.
+    :rtype: iterator
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    rows = queryset.iterator(chunk_size=batch_size)
+    separator = ""
+    yield b"["
+    for batch in iter(lambda: list(islice(rows, batch_size)), []):
+        encoded = [encoder.encode(row) for row in serialize(batch)]
+        yield (separator + ",".join(encoded)).encode("utf-8")
+        separator = ","
+    yield b"]"
+
+
+def streaming_json_response(
+        queryset: QuerySet,
+        serialize: Callable[[List], List[dict]],
+        asgi: bool = False) -> StreamingHttpResponse:
+    """
+    Returns all rows of the queryset as JSON array which is serialized
+    while it is sent.
+    :param queryset: Rows to return.
+    :param serialize: Function which serializes list of rows.
+    :param bool asgi: Whether the request is served by ASGI handler.
+    Django 3.2 iterates streaming responses of ASGI requests in the event
+    loop, where the database can not be queried, so the array is
+    serialized before the response is returned, in the thread of the view.
+    :rtype: StreamingHttpResponse
+    """
+    chunks = stream_json_array(
+        queryset, serialize, getattr(settings, 'API_STREAM_BATCH_SIZE', 500))
+    if asgi:
+        chunks = list(chunks)
+    return StreamingHttpResponse(chunks, content_type="application/json")
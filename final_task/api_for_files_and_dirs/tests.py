@@ -0,0 +1,70 @@
+import json
+
+from asgiref.sync import async_to_sync
+from background_parser.models import DirectoryStatistic, FileStatistic
+from django.core.handlers.asgi import ASGIHandler
+from django.test import TransactionTestCase
+
+
+def request_asgi(path: str, query: str = ""):
+    """
+    Sends GET request through the ASGI handler, as uvicorn does, and
+    returns status and body of the response.
+    """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "root_path": "",
+        "query_string": query.encode("utf-8"),
+        "headers": [(b"host", b"testserver")],
+        "server": ("testserver", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async_to_sync(ASGIHandler())(scope, receive, send)
+    body = b"".join(message.get("body", b"") for message in messages
+                    if message["type"] == "http.response.body")
+    return messages[0]["status"], body
+
+
+class StreamUnderAsgiTest(TransactionTestCase):
+    def setUp(self):
+        for number in range(5):
+            FileStatistic.objects.create(
+                slug=f"file-{number}", file=f"./folder/file_{number}.txt",
+                most_recent_word="мир", least_recent_word="hello",
+                average_word_length=3.5, vowels={}, consonants={})
+            DirectoryStatistic.objects.create(
+                slug=f"folder-{number}", directory_name=f"./folder_{number}",
+                number_of_files=1, most_recent_word="мир",
+                least_recent_word="hello", average_word_length=3.5,
+                vowels={}, consonants={})
+
+    def test_files_are_streamed(self):
+        status, body = request_asgi("/api/file/",
+                                    "stream=true&fields=file")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), [
+            {"file": f"./folder/file_{number}.txt"} for number in range(5)])
+
+    def test_directories_are_streamed(self):
+        status, body = request_asgi("/api/directory/",
+                                    "stream=true&prefix=./folder_3")
+        self.assertEqual(status, 200)
+        rows = json.loads(body)
+        self.assertEqual([row["directory_name"] for row in rows],
+                         ["./folder_3"])
+        self.assertEqual(rows[0]["most_recent_word"], "мир")
+
+    def test_files_are_streamed_lazily_under_wsgi(self):
+        response = self.client.get("/api/file/",
+                                   {"stream": "true", "fields": "file"})
+        self.assertTrue(response.streaming)
+        self.assertFalse(isinstance(response.streaming_content, list))
+        body = b"".join(response.streaming_content)
+        self.assertEqual(len(json.loads(body)), 5)
@@ -9,22 +9,42 @@ router.register(r'directory', views.DirectoryViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('directory/<slug:pk>',
-         views.DirectoryViewSet.as_view({'get': 'retrieve'}),
+         views.show_directory,
          name="number_of_files"),
 
     path('file/<slug:pk>',
-         views.FileViewSet.as_view({'get': 'retrieve'}),
+         views.show_file,
          name="number_of_files"),
 
     path('word/<str:word>',
-         views.get_word_statistic,
+         views.show_word_statistic,
          name='word_statistic'),
 
+    path('words',
+         views.show_words_statistic,
+         name='words_statistic'),
+
     path('supported_extensions',
          views.show_acceptable_extensions,
          name='supported_extension'),
 
     path('start',
          views.choose_extensions_to_analyze,
-         name='start_analyze')
+         name='start_analyze'),
+
+    path('search',
+         views.search_words,
+         name='search'),
+
+    path('metrics',
+         views.show_metrics,
+         name='metrics'),
+
+    path('jobs/<int:job_id>',
+         views.show_scan_job,
+         name='scan_job'),
+
+    path('jobs/<int:job_id>/cancel',
+         views.cancel_scan_job,
+         name='cancel_scan_job')
 ]
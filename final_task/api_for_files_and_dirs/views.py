@@ -1,57 +1,401 @@
 import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from api_for_files_and_dirs.caching import (GenerationCacheMixin,
+                                            async_cached_by_generation)
+from api_for_files_and_dirs.executors import run_cpu, run_database
+from api_for_files_and_dirs.pagination import (DirectoryCursorPagination,
+                                               FileCursorPagination,
+                                               PathCursorPagination)
 from api_for_files_and_dirs.serializers import (DirectorySerializer,
-                                                FileSerializer)
-from background_parser.models import DirectoryStatistic, FileStatistic
-from background_parser.parser import WordStatistic
+                                                FileSerializer,
+                                                PathNodeSerializer)
+from api_for_files_and_dirs.streaming import streaming_json_response
+from background_parser.aggregators import WORD_FREQUENCY_MODES
+from background_parser.jobs import (cancel_job, describe_job,
+                                    find_or_create_job, get_task_name)
+from background_parser.metrics import PROMETHEUS_CONTENT_TYPE, render_metrics
+from background_parser.models import DirectoryStatistic, FileStatistic, ScanJob
+from background_parser.opener import get_supported_extensions
+from background_parser.parser import WordStatistic, get_word_statistic
 from background_parser.services import analyze_folder_and_save_results
-from django.http import JsonResponse
+from background_parser.tree_index import get_listing
+from background_parser.word_index import search_files
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
-class FileViewSet(viewsets.ModelViewSet):
+def parse_fields(value: Optional[str], available: List[str],
+                 default: List[str]) -> List[str]:
+    """
+    Returns fields requested by comma separated `fields` parameter.
+    :param value: Value of the parameter.
+    :param available: Fields of the serializer.
+    :param default: Fields returned when the parameter is not given.
+    :raises ValidationError: if unknown field is requested.
+    """
+    if not value:
+        return default
+    fields = [field for field in value.split(",") if field]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ValidationError(
+            {"fields": f"Unknown fields: {', '.join(unknown)}"})
+    return fields
+
+
+def get_columns(model, path_field: str, fields: List[str],
+                computed_fields: Dict[str, List[str]]) -> Set[str]:
+    """
+    Returns columns of the model needed to serialize the fields.
+    """
+    columns = {field.name for field in model._meta.concrete_fields}
+    only = {model._meta.pk.name, path_field}
+    for field in fields:
+        if field in columns:
+            only.add(field)
+        only.update(computed_fields.get(field, []))
+    return only
+
+
+class SparseFieldsViewSetMixin:
+    """
+    Lists rows page by page in the order of their paths, optionally
+    filtered by `prefix` of the path. `fields` query parameter selects
+    comma separated fields of the rows, only their columns are loaded from
+    the database. `stream=true` returns all rows as JSON array which is
+    serialized while it is sent instead of the page, under ASGI it is
+    serialized before it is sent, see streaming_json_response.
+    """
+    # Field with the path of the row.
+    path_field = ""
+    # Fields returned by list when `fields` is not given.
+    default_list_fields: Optional[List[str]] = None
+    # Columns needed by computed fields of the serializer.
+    computed_fields: Dict[str, List[str]] = {}
+
+    def get_requested_fields(self) -> List[str]:
+        """
+        Returns fields of the serializer requested by `fields` parameter.
+        :raises ValidationError: if unknown field is requested.
+        """
+        available = self.get_serializer_class().Meta.fields
+        default = available
+        if self.action == "list" and self.default_list_fields:
+            default = self.default_list_fields
+        return parse_fields(self.request.query_params.get("fields"),
+                            available, default)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method != "GET":
+            return queryset
+        prefix = self.request.query_params.get("prefix")
+        if prefix:
+            queryset = queryset.filter(
+                **{f"{self.path_field}__startswith": prefix})
+
+        return queryset.only(*get_columns(
+            queryset.model, self.path_field, self.get_requested_fields(),
+            self.computed_fields))
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == "GET":
+            kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get("stream") == "true":
+            queryset = self.get_queryset().order_by(self.path_field)
+            return streaming_json_response(
+                queryset,
+                lambda rows: self.get_serializer(rows, many=True).data,
+                asgi=isinstance(request._request, ASGIRequest))
+        return super().list(request, *args, **kwargs)
+
+
+class FileViewSet(GenerationCacheMixin, SparseFieldsViewSetMixin,
+                  viewsets.ModelViewSet):
     queryset = FileStatistic.objects.all()
     serializer_class = FileSerializer
+    pagination_class = FileCursorPagination
+    path_field = "file"
 
 
-class DirectoryViewSet(viewsets.ModelViewSet):
+class DirectoryViewSet(GenerationCacheMixin, SparseFieldsViewSetMixin,
+                       viewsets.ModelViewSet):
     queryset = DirectoryStatistic.objects.all()
     serializer_class = DirectorySerializer
+    pagination_class = DirectoryCursorPagination
+    path_field = "directory_name"
+    # Recursive listing of every folder is too large for the list, it is
+    # returned by retrieve, by listing or when requested explicitly.
+    default_list_fields = [
+        field for field in DirectorySerializer.Meta.fields
+        if field != "files_and_dirs"]
+    computed_fields = {"files_and_dirs": ["directory_name"]}
+
+    @action(detail=True)
+    def listing(self, request, pk=None):
+        """
+        Returns page of files and folders inside the folder.
+        Pass `recursive=false` to list only direct children of the folder.
+        """
+        directory = self.get_object()
+        nodes = get_listing(
+            directory.directory_name,
+            recursive=request.query_params.get("recursive") != "false")
+
+        paginator = PathCursorPagination()
+        page = paginator.paginate_queryset(nodes, request, view=self)
+        return paginator.get_paginated_response(
+            PathNodeSerializer(page, many=True).data)
 
 
-def get_word_statistic(request, word):
+def async_csrf_exempt(view: Callable) -> Callable:
+    """
+    csrf_exempt for async views, csrf_exempt of Django 3.2 wraps them
+    into sync function.
+    """
+    view.csrf_exempt = True
+    return view
+
+
+def get_row_data(viewset_class, pk: str,
+                 fields: Optional[str]) -> Optional[dict]:
+    """
+    Returns serialized row of the viewset with the requested fields,
+    None if there is no such row.
+    :param viewset_class: FileViewSet or DirectoryViewSet.
+    :param str pk: Slug of the row.
+    :param fields: Value of `fields` parameter.
+    :raises ValidationError: if unknown field is requested.
+    """
+    serializer_class = viewset_class.serializer_class
+    fields = parse_fields(fields, serializer_class.Meta.fields,
+                          serializer_class.Meta.fields)
+    model = viewset_class.queryset.model
+    row = model.objects.only(*get_columns(
+        model, viewset_class.path_field, fields,
+        viewset_class.computed_fields)).filter(pk=pk).first()
+    if row is None:
+        return None
+    return serializer_class(row, fields=fields).data
+
+
+async def show_row(viewset_class, request, pk: str) -> JsonResponse:
+    """
+    Returns row of the viewset, the database is queried in the database
+    threads.
+    """
+    try:
+        data = await run_database(get_row_data, viewset_class, pk,
+                                  request.GET.get("fields"))
+    except ValidationError as error:
+        return JsonResponse(error.detail, status=400)
+    if data is None:
+        return JsonResponse({"detail": "Not found."}, status=404)
+    return JsonResponse(data, json_dumps_params={"ensure_ascii": False})
+
+
+@async_cached_by_generation
+async def show_file(request, pk):
+    return await show_row(FileViewSet, request, pk)
+
+
+@async_cached_by_generation
+async def show_directory(request, pk):
+    return await show_row(DirectoryViewSet, request, pk)
+
+
+async def show_word_statistic(request, word):
 
     if WordStatistic.validate_word(word) is None:
         return JsonResponse({
             word: "Word is not valid"
         })
     else:
-        word_init = WordStatistic(word)
-        stat = word_init.return_all_statistic_for_word()
-        return JsonResponse(stat)
+        return JsonResponse(await run_cpu(get_word_statistic, word))
+
+
+def calculate_words_statistic(words: List[str]) -> List[dict]:
+    """
+    Returns statistic of every word, invalid words get an error instead.
+    """
+    return [
+        get_word_statistic(word)
+        if WordStatistic.validate_word(word) is not None
+        else {"word": word, "error": "Word is not valid"}
+        for word in words]
+
+
+@async_csrf_exempt
+async def show_words_statistic(request):
+    """
+    Returns statistic of every word of `words` list from the body of POST
+    request, in the same order. Invalid words get an error instead.
+    """
+    if request.method != "POST":
+        return JsonResponse({
+            "error": "Method is not allowed!"
+        })
+    try:
+        words = json.loads(request.body)["words"]
+    except (ValueError, KeyError, TypeError):
+        words = None
+    if not isinstance(words, list) or \
+            not all(isinstance(word, str) for word in words):
+        return JsonResponse({"error": "Body should be "
+                                      "{\"words\": [\"word\", ...]}"},
+                            status=400)
+    max_words = getattr(settings, 'WORD_BATCH_MAX_SIZE', 10000)
+    if len(words) > max_words:
+        return JsonResponse({"error": f"At most {max_words} words "
+                                      f"can be sent at once"},
+                            status=400)
+
+    started = time.perf_counter()
+    statistic = await run_cpu(calculate_words_statistic, words)
+    seconds = time.perf_counter() - started
+    logging.getLogger(__name__).info(
+        "Word statistic: %s words, %.0f words per second", len(words),
+        len(words) / seconds if seconds else 0)
+    return JsonResponse({"words": statistic})
 
 
 def show_acceptable_extensions(request):
-    return JsonResponse({"extensions": [".txt", ".py", ".csv",
-                                        ".doc", ".docx", ".eml",
-                                        ".epub", ".json", ".html",
-                                        ".odt", ".pdf", ".xlsx",
-                                        ".xls", ".rtf"]})
+    return JsonResponse({"extensions": get_supported_extensions()})
 
 
-@csrf_exempt
-def choose_extensions_to_analyze(request):
+def submit_scan(directory: str, extensions: List[str],
+                mode: str) -> Tuple[ScanJob, bool]:
+    """
+    Enqueues scan of the folder unless the identical scan is queued or
+    running, see find_or_create_job.
+    :return: job of the scan and whether it was created.
+    :rtype: tuple
+    """
+    job, created = find_or_create_job(directory, extensions, mode)
+    if created:
+        analyze_folder_and_save_results(
+            job.directory, job.extensions, job.mode, job.id,
+            verbose_name=get_task_name(job.id))
+    return job, created
+
+
+@async_csrf_exempt
+async def choose_extensions_to_analyze(request):
     if request.method == "POST":
+        payload = json.loads(request.body)
+        mode = payload.get("mode", "exact")
+        if mode not in WORD_FREQUENCY_MODES:
+            return JsonResponse({
+                "error": f"Mode should be one of "
+                         f"{', '.join(WORD_FREQUENCY_MODES)}"
+            })
 
-        analyze_folder_and_save_results(
-            json.loads(request.body)["directory"],
-            json.loads(request.body)["extensions"],
-            repeat=10)
+        job, created = await run_database(
+            submit_scan, payload["directory"], payload["extensions"], mode)
 
         return JsonResponse({
-            "result": "started calculation"
+            "result": "started calculation" if created
+            else "joined running calculation",
+            "job": job.id
         })
     return JsonResponse({
             "error": "Method is not allowed!"
         })
+
+
+def parse_page(request) -> Tuple[int, int]:
+    """
+    Returns `offset` and `limit` query parameters, the limit is bounded by
+    API_MAX_PAGE_SIZE.
+    :raises ValueError: if the parameters are not non-negative integers.
+    """
+    offset = int(request.GET.get("offset", 0))
+    limit = int(request.GET.get("limit",
+                                getattr(settings, 'API_PAGE_SIZE', 100)))
+    if offset < 0 or limit < 1:
+        raise ValueError("offset is negative or limit is not positive")
+    return offset, min(limit, getattr(settings, 'API_MAX_PAGE_SIZE', 1000))
+
+
+@async_cached_by_generation
+async def search_words(request):
+    """
+    Returns files which contain the `word` or words starting with
+    the `prefix`, the files with most occurrences first, paginated by
+    `offset` and `limit`.
+    """
+    word = request.GET.get("word")
+    prefix = request.GET.get("prefix")
+    if (word is None) == (prefix is None):
+        return JsonResponse({"error": "Either word or prefix should be "
+                                      "given"}, status=400)
+    query = (word or prefix or "").lower()
+    min_prefix = getattr(settings, 'SEARCH_MIN_PREFIX_LENGTH', 2)
+    if prefix is not None and len(query) < min_prefix:
+        return JsonResponse({"error": f"Prefix should have at least "
+                                      f"{min_prefix} letters"}, status=400)
+    if WordStatistic.validate_word(query) is None:
+        return JsonResponse({"error": "Word is not valid"}, status=400)
+    try:
+        offset, limit = parse_page(request)
+    except ValueError:
+        return JsonResponse({"error": "offset should be a non-negative and "
+                                      "limit a positive integer"},
+                            status=400)
+
+    count, results = await run_database(
+        search_files, word=query if word is not None else None,
+        prefix=query if prefix is not None else None,
+        offset=offset, limit=limit)
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, "offset", offset + limit) \
+        if offset + limit < count else None
+    if offset == 0:
+        previous_url = None
+    elif offset <= limit:
+        previous_url = remove_query_param(url, "offset")
+    else:
+        previous_url = replace_query_param(url, "offset", offset - limit)
+    return JsonResponse({"count": count, "next": next_url,
+                         "previous": previous_url, "results": results},
+                        json_dumps_params={"ensure_ascii": False})
+
+
+async def show_metrics(request):
+    """
+    Returns metrics of the scans and the API in Prometheus text format.
+    """
+    return HttpResponse(await run_database(render_metrics),
+                        content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def show_scan_job(request, job_id):
+    job = ScanJob.objects.filter(id=job_id).first()
+    if job is None:
+        return JsonResponse({"error": "Job is not found"}, status=404)
+    return JsonResponse(describe_job(job))
+
+
+@csrf_exempt
+def cancel_scan_job(request, job_id):
+    if request.method != "POST":
+        return JsonResponse({
+            "error": "Method is not allowed!"
+        })
+    job = ScanJob.objects.filter(id=job_id).first()
+    if job is None:
+        return JsonResponse({"error": "Job is not found"}, status=404)
+    cancel_job(job)
+    return JsonResponse(describe_job(job))
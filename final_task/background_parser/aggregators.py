@@ -1,19 +1,91 @@
+import json
+import os
+import zlib
 from collections import Counter
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from background_parser.file_analyzer import FileAnalyzer
+from background_parser.metrics import FILE_STAGE_SECONDS
 from background_parser.models import DirectoryStatistic
+from background_parser.sketches import WordFrequencySketch
+from background_parser.vocabulary import Vocabulary, WordCounts
+from background_parser.writers import BulkWriter
+
+# How word frequencies of folders are kept: 'exact' counts every word,
+# 'approximate' keeps sketches of constant size.
+WORD_FREQUENCY_MODES = {
+    "exact": WordCounts,
+    "approximate": WordFrequencySketch,
+}
+
+
+def count_words(word_frequency) -> int:
+    """
+    Returns number of words in Counter, WordCounts or WordFrequencySketch.
+    """
+    if isinstance(word_frequency, (WordCounts, WordFrequencySketch)):
+        return word_frequency.total()
+    return sum(word_frequency.values())
+
+
+def create_word_frequency(mode: str, vocabulary: Vocabulary,
+                          state: Optional[Dict] = None):
+    """
+    Returns empty word frequency of the mode, or restores it from its
+    state. Exact counts intern the words in the vocabulary of the scan.
+    """
+    word_frequency = WORD_FREQUENCY_MODES[mode]
+    if word_frequency is WordCounts:
+        return WordCounts(vocabulary) if state is None \
+            else WordCounts.from_state(state, vocabulary)
+    return word_frequency() if state is None \
+        else word_frequency.from_state(state)
+
+
+def get_word_frequency_bounds(stat: Dict, most_freq_word: str,
+                              most_freq_key: str, least_freq_word: str,
+                              least_freq_key: str) -> Dict:
+    """
+    Returns bounds of the counts of the most and least frequent words
+    found by sketches.
+    :param stat: Content statistic with sketches of word frequencies.
+    :return: lower and upper bounds of the counts of the words and
+    probability that upper bounds hold.
+    :rtype: dict
+    """
+    bounds = {}
+    for name, word, key in (("most_recent_word", most_freq_word,
+                             most_freq_key),
+                            ("least_recent_word", least_freq_word,
+                             least_freq_key)):
+        lower, upper = stat[key].bounds(word)
+        bounds[name] = {"word": word, "lower": lower, "upper": upper}
+    bounds["confidence"] = round(
+        1 - stat[most_freq_key].count_min.failure_probability, 4)
+    return bounds
 
 
 class ContentStatistic:
-    def __init__(self):
+    def __init__(self, mode: str = "exact",
+                 vocabulary: Optional[Vocabulary] = None):
+        """
+        :param str mode: Word frequency mode, see WORD_FREQUENCY_MODES.
+        :param vocabulary: Vocabulary of the scan, a new one by default.
+        """
+        self.vocabulary = vocabulary if vocabulary is not None \
+            else Vocabulary()
         self.__content_stat = Counter({
             "vowels": Counter(),
             "consonants": Counter(),
-            "en_word_freq": Counter(),
-            "ru_word_freq": Counter(),
             "syllables": Counter(),
         })
+        # Words are kept in arrays of interned words, which are much
+        # smaller and faster to merge than Counters of whole vocabulary,
+        # or in sketches in approximate mode.
+        self.__word_frequency = {
+            "en_word_freq": create_word_frequency(mode, self.vocabulary),
+            "ru_word_freq": create_word_frequency(mode, self.vocabulary),
+        }
         self.__average_content_stat = {
             "amount_of_words": 0,
             "average_word_length": 0.0,
@@ -28,8 +100,11 @@ class ContentStatistic:
                 if k in content_keys
             })
 
-        amount_of_words = (sum(stat["en_word_freq"].values()) +
-                           sum(stat["ru_word_freq"].values()))
+        for k, word_frequency in self.__word_frequency.items():
+            word_frequency.update(stat[k])
+
+        amount_of_words = (count_words(stat["en_word_freq"]) +
+                           count_words(stat["ru_word_freq"]))
         total = (self.__average_content_stat['amount_of_words'] +
                  amount_of_words)
 
@@ -44,35 +119,74 @@ class ContentStatistic:
         self.__average_content_stat['amount_of_words'] = total
 
     def get_statistic(self):
-        return {**self.__content_stat, **self.__average_content_stat}
+        return {**self.__content_stat, **self.__word_frequency,
+                **self.__average_content_stat}
+
+    def get_state(self) -> Dict:
+        """
+        Returns the statistic in JSON serializable form.
+        """
+        return {
+            **{k: dict(v) for k, v in self.__content_stat.items()},
+            **{k: v.get_state() for k, v in self.__word_frequency.items()},
+            **self.__average_content_stat,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict, mode: str = "exact",
+                   vocabulary: Optional[Vocabulary] = None) -> \
+            'ContentStatistic':
+        """
+        Restores the statistic from get_state.
+        """
+        statistic = cls(mode, vocabulary)
+        statistic.__content_stat = Counter({
+            k: Counter(state[k]) for k in statistic.__content_stat})
+        statistic.__word_frequency = {
+            k: create_word_frequency(mode, statistic.vocabulary, state[k])
+            for k in statistic.__word_frequency}
+        statistic.__average_content_stat = {
+            k: state[k] for k in statistic.__average_content_stat}
+        return statistic
 
 
 class FilesStatisticAggregator:
-    def __init__(self, files: List[FileAnalyzer]):
+    def __init__(self, files: List[FileAnalyzer],
+                 writer: Optional[BulkWriter] = None,
+                 mode: str = "exact",
+                 vocabulary: Optional[Vocabulary] = None):
         self.files = files
-        self.__content_statistic = ContentStatistic()
+        self.writer = writer
+        self.__content_statistic = ContentStatistic(mode, vocabulary)
 
     def calculate_and_aggregate_statistic(self):
         for file in self.files:
+            extension = os.path.splitext(file.filename)[-1]
             general_stat, word_frequency = file.calculate_stat()
-            file.save_stat()
+            if file.changed:
+                with FILE_STAGE_SECONDS.time(stage="save",
+                                             extension=extension):
+                    file.save_stat(self.writer)
             general_stat['ru_word_freq'] = word_frequency[0]
             general_stat['en_word_freq'] = word_frequency[1]
 
-            self.__content_statistic.merge_statistic(general_stat)
+            with FILE_STAGE_SECONDS.time(stage="merge", extension=extension):
+                self.__content_statistic.merge_statistic(general_stat)
 
         return self.__content_statistic.get_statistic()
 
 
 class FolderStatisticAggregator:
-    def __init__(self):
+    def __init__(self, mode: str = "exact",
+                 vocabulary: Optional[Vocabulary] = None):
+        self.mode = mode
+        # Paths of files and folders are not collected here, they are
+        # stored once in the tree index, see tree_index.py.
         self.__folder_statistic = {
             "number_of_files": 0,
-            "files": [],
-            "dirs": [],
         }
 
-        self.__content_statistic = ContentStatistic()
+        self.__content_statistic = ContentStatistic(mode, vocabulary)
 
     def add_files_statistic(self, stat: Dict):
         """
@@ -91,11 +205,11 @@ class FolderStatisticAggregator:
         self.__content_statistic.merge_statistic(
             sub_folders_stats.get_content_content_statistics())
 
-    def add_files_and_folders_info(self, files: List[str], dirs: List[str]):
-
-        self.__folder_statistic["files"] += files
-        self.__folder_statistic["number_of_files"] += len(files)
-        self.__folder_statistic["dirs"] += dirs
+    def add_number_of_files(self, number_of_files: int):
+        """
+        Adds number of files which are in the folder itself.
+        """
+        self.__folder_statistic["number_of_files"] += number_of_files
 
     def __merge_folder_statistic(self, stat: Dict):
         for k in self.__folder_statistic:
@@ -110,38 +224,102 @@ class FolderStatisticAggregator:
     def get_content_content_statistics(self):
         return self.__content_statistic.get_statistic()
 
-    def save_stat(self, dir_name):
+    def get_state(self) -> Dict:
+        """
+        Returns the statistic in JSON serializable form, so the folder can
+        be merged into its parent by another process.
+        """
+        return {**self.__folder_statistic,
+                "content": self.__content_statistic.get_state()}
+
+    @classmethod
+    def from_state(cls, state: Dict, mode: str = "exact",
+                   vocabulary: Optional[Vocabulary] = None) -> \
+            'FolderStatisticAggregator':
+        """
+        Restores the statistic from get_state.
+        :param vocabulary: Vocabulary of the scan the folder is merged in.
+        """
+        aggregator = cls(mode, vocabulary)
+        aggregator.__folder_statistic = {
+            k: state[k] for k in aggregator.__folder_statistic}
+        aggregator.__content_statistic = ContentStatistic.from_state(
+            state["content"], mode, vocabulary)
+        return aggregator
+
+    def get_partial_statistic(self) -> bytes:
+        """
+        Returns compressed state of the folder, which is stored with its
+        statistic, see from_partial_statistic.
+        :rtype: bytes
+        """
+        # States of the upper folders hold most of the words of the tree,
+        # they are compressed fast rather than small.
+        return zlib.compress(json.dumps(
+            self.get_state(), ensure_ascii=False).encode("utf-8"), 1)
+
+    @classmethod
+    def from_partial_statistic(cls, data: bytes, mode: str = "exact",
+                               vocabulary: Optional[Vocabulary] = None) -> \
+            'FolderStatisticAggregator':
+        """
+        Restores the statistic of the folder stored by the previous scan.
+        :param bytes data: Partial statistic from get_partial_statistic.
+        :param vocabulary: Vocabulary of the scan the folder is merged in.
+        """
+        return cls.from_state(json.loads(zlib.decompress(data).decode(
+            "utf-8")), mode, vocabulary)
+
+    def save_stat(self, dir_name, writer: Optional[BulkWriter] = None):
+        """
+        Saves statistic of the folder into database.
+        :param writer: Writer to add the row to, the row is saved
+        immediately if it is not given.
+        """
 
         most_freq_word = ""
         least_freq_word = ""
+        bounds = {}
         stat = self.__content_statistic.get_statistic()
 
         if stat['en_word_freq'] or stat['ru_word_freq']:
-            most_freq_word = max(
-                stat['en_word_freq'].most_common(1) +
-                stat['ru_word_freq'].most_common(1),
+            most_freq_word, _, most_freq_key = max(
+                [(*item, 'en_word_freq')
+                 for item in stat['en_word_freq'].most_common(1)] +
+                [(*item, 'ru_word_freq')
+                 for item in stat['ru_word_freq'].most_common(1)],
                 key=lambda x: x[1]
-            )[0]
+            )
 
-            least_freq_word = min(
-                stat['en_word_freq'].most_common()[-1:] +
-                stat['ru_word_freq'].most_common()[-1:],
+            least_freq_word, _, least_freq_key = min(
+                [(*item, 'en_word_freq')
+                 for item in stat['en_word_freq'].least_common(1)] +
+                [(*item, 'ru_word_freq')
+                 for item in stat['ru_word_freq'].least_common(1)],
                 key=lambda x: x[1]
-            )[0]
-
-        DirectoryStatistic.objects.update_or_create(
-            slug=dir_name[2:].replace(".", "-").replace("/", "-"),
-            defaults={
-                "directory_name": dir_name,
-                "files_and_dirs": {
-                    "files": self.__folder_statistic['files'],
-                    "dirs": self.__folder_statistic['dirs']
-                },
-                "number_of_files": self.__folder_statistic['number_of_files'],
-                "most_recent_word": most_freq_word,
-                "least_recent_word": least_freq_word,
-                "average_word_length": stat['average_word_length'],
-                "vowels": stat['vowels'],
-                "consonants": stat['consonants'],
-                "syllables": stat['syllables']
-            })
+            )
+
+            if self.mode == "approximate":
+                bounds = get_word_frequency_bounds(
+                    stat, most_freq_word, most_freq_key,
+                    least_freq_word, least_freq_key)
+
+        slug = dir_name[2:].replace(".", "-").replace("/", "-")
+        defaults = {
+            "directory_name": dir_name,
+            "number_of_files": self.__folder_statistic['number_of_files'],
+            "most_recent_word": most_freq_word,
+            "least_recent_word": least_freq_word,
+            "average_word_length": stat['average_word_length'],
+            "vowels": stat['vowels'],
+            "consonants": stat['consonants'],
+            "syllables": stat['syllables'],
+            "word_frequency_mode": self.mode,
+            "word_frequency_bounds": bounds,
+            "partial_statistic": self.get_partial_statistic(),
+        }
+        if writer is not None:
+            writer.add(DirectoryStatistic(slug=slug, **defaults))
+        else:
+            DirectoryStatistic.objects.update_or_create(slug=slug,
+                                                        defaults=defaults)
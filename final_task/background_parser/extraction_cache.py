@@ -0,0 +1,295 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Callable, Optional
+
+from background_parser.extraction_pool import ExtractionError
+from background_parser.manifest import get_content_hash
+from django.conf import settings
+
+COUNTERS = ("hits", "misses", "hashed", "evictions", "waits", "failures")
+
+# Seconds between checks whether other process has extracted the document.
+WAIT_INTERVAL = 0.1
+
+
+class ExtractionCache:
+    """
+    Cache of text extracted from documents, e.g. by textract. Texts are
+    stored on disk compressed and keyed by hash of the content of
+    the document, so the same document is extracted once even if it is
+    found in several folders. Hash of the document is calculated again
+    only if its size or modification time has changed. Least recently
+    used texts are evicted when their total size exceeds the limit.
+    Index of the cache is sqlite database in the directory of the cache,
+    it is shared by all processes. The document is extracted by one process
+    at a time, others wait for its text. Failed extraction is remembered
+    for a while, so the waiting processes and the next scans do not
+    extract the same document again meanwhile.
+    """
+    def __init__(self, directory: Optional[str], max_size: int,
+                 max_wait: float = 300, failure_ttl: float = 600):
+        """
+        :param directory: Directory of the cache, None disables it.
+        :param int max_size: Maximum total size of the compressed texts.
+        :param float max_wait: Seconds to wait for other process which
+        extracts the same document, after them the document is extracted
+        again.
+        :param float failure_ttl: Seconds failed extraction of the document
+        is remembered.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.failure_ttl = failure_ttl
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.__lock = threading.RLock()
+        self.__connection: Optional[sqlite3.Connection] = None
+        self.__connection_pid = None
+
+    def get_text(self, filename: str,
+                 extract: Callable[[str], bytes]) -> bytes:
+        """
+        Returns text extracted from the file, extracts it only if it is
+        not in the cache yet.
+        :param str filename: Path of the document.
+        :param extract: Function which extracts UTF-8 text from the file.
+        :return: UTF-8 text of the document.
+        :rtype: bytes
+        :raises ExtractionError: if the extraction has failed now or
+        recently.
+        """
+        if not self.directory:
+            return extract(filename)
+
+        # The lock is held only while the index is used, not while
+        # the document is hashed or extracted, so other threads use
+        # the cache meanwhile.
+        content_hash = self.__get_content_hash(filename)
+        waited = False
+        while True:
+            with self.__lock:
+                text = self.__read(content_hash)
+                if text is not None:
+                    self.__count("hits")
+                    return text
+                failure = self.__read_failure(content_hash)
+                if failure is not None:
+                    self.__count("failures")
+                    raise ExtractionError(*failure)
+                if self.__claim(content_hash):
+                    self.__count("misses")
+                    break
+                if not waited:
+                    self.__count("waits")
+                    waited = True
+            # Other process or thread is extracting the document.
+            time.sleep(WAIT_INTERVAL)
+
+        try:
+            text = extract(filename)
+            with self.__lock:
+                self.__write(content_hash, text)
+            return text
+        except ExtractionError as error:
+            with self.__lock:
+                self.__get_connection().execute(
+                    "INSERT OR REPLACE INTO failures "
+                    "(content_hash, outcome, message, failed) "
+                    "VALUES (?, ?, ?, ?)",
+                    (content_hash, error.outcome, str(error), time.time()))
+            raise
+        finally:
+            with self.__lock:
+                self.__get_connection().execute(
+                    "DELETE FROM extracting WHERE content_hash = ? "
+                    "AND owner = ?", (content_hash, self.__get_owner()))
+
+    def statistic(self) -> dict:
+        """
+        Returns usage statistic of the cache: counters of this process
+        and totals of all processes.
+        :rtype: dict
+        """
+        if not self.directory:
+            return {"enabled": False}
+        with self.__lock:
+            connection = self.__get_connection()
+            size, texts = connection.execute(
+                "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM texts"
+            ).fetchone()
+            return {
+                **self.counters,
+                "total": dict(connection.execute(
+                    "SELECT name, value FROM counters").fetchall()),
+                "texts": texts,
+                "size": size,
+                "max_size": self.max_size,
+            }
+
+    def close(self):
+        with self.__lock:
+            if self.__connection is not None and \
+                    self.__connection_pid == os.getpid():
+                self.__connection.close()
+            self.__connection = None
+
+    def __get_connection(self) -> sqlite3.Connection:
+        # Connection can not be shared with forked processes.
+        if self.__connection is None or self.__connection_pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self.__connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                timeout=30, check_same_thread=False, isolation_level=None)
+            self.__connection.executescript(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, modified REAL, "
+                "content_hash TEXT);"
+                "CREATE TABLE IF NOT EXISTS texts ("
+                "content_hash TEXT PRIMARY KEY, size INTEGER, "
+                "last_used REAL);"
+                "CREATE INDEX IF NOT EXISTS texts_last_used "
+                "ON texts (last_used);"
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "name TEXT PRIMARY KEY, value INTEGER);"
+                "CREATE TABLE IF NOT EXISTS extracting ("
+                "content_hash TEXT PRIMARY KEY, owner TEXT, started REAL);"
+                "CREATE TABLE IF NOT EXISTS failures ("
+                "content_hash TEXT PRIMARY KEY, outcome TEXT, message TEXT, "
+                "failed REAL);")
+            self.__connection_pid = os.getpid()
+        return self.__connection
+
+    def __get_owner(self) -> str:
+        return f"{os.getpid()}-{threading.get_ident()}"
+
+    def __claim(self, content_hash: str) -> bool:
+        """
+        Records that this thread extracts the document, returns False if
+        other thread or process is extracting it. Claims older than
+        max_wait, e.g. of a killed process, are taken over.
+        """
+        connection = self.__get_connection()
+        connection.execute(
+            "DELETE FROM extracting WHERE content_hash = ? AND started < ?",
+            (content_hash, time.time() - self.max_wait))
+        return connection.execute(
+            "INSERT OR IGNORE INTO extracting (content_hash, owner, started) "
+            "VALUES (?, ?, ?)",
+            (content_hash, self.__get_owner(), time.time())).rowcount == 1
+
+    def __count(self, name: str):
+        self.counters[name] += 1
+        self.__get_connection().execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + 1", (name,))
+
+    def __get_content_hash(self, filename: str) -> str:
+        file_stat = os.stat(filename)
+        key = (os.path.abspath(filename), file_stat.st_size,
+               file_stat.st_mtime)
+        with self.__lock:
+            row = self.__get_connection().execute(
+                "SELECT content_hash FROM files "
+                "WHERE path = ? AND size = ? AND modified = ?",
+                key).fetchone()
+        if row:
+            return row[0]
+
+        content_hash = get_content_hash(filename)
+        with self.__lock:
+            self.__count("hashed")
+            self.__get_connection().execute(
+                "INSERT OR REPLACE INTO files "
+                "(path, size, modified, content_hash) VALUES (?, ?, ?, ?)",
+                (*key, content_hash))
+        return content_hash
+
+    def __get_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, content_hash[:2],
+                            f"{content_hash}.zz")
+
+    def __read_failure(self, content_hash: str) -> Optional[tuple]:
+        """
+        Returns outcome and message of the recent failed extraction of
+        the document, None if there is no such failure.
+        """
+        connection = self.__get_connection()
+        connection.execute(
+            "DELETE FROM failures WHERE content_hash = ? AND failed < ?",
+            (content_hash, time.time() - self.failure_ttl))
+        return connection.execute(
+            "SELECT outcome, message FROM failures WHERE content_hash = ?",
+            (content_hash,)).fetchone()
+
+    def __read(self, content_hash: str) -> Optional[bytes]:
+        connection = self.__get_connection()
+        if not connection.execute(
+                "SELECT 1 FROM texts WHERE content_hash = ?",
+                (content_hash,)).fetchone():
+            return None
+        try:
+            with open(self.__get_path(content_hash), "rb") as file:
+                text = zlib.decompress(file.read())
+        except (OSError, zlib.error):
+            # Evicted by other process or damaged.
+            return None
+        connection.execute(
+            "UPDATE texts SET last_used = ? WHERE content_hash = ?",
+            (time.time(), content_hash))
+        return text
+
+    def __write(self, content_hash: str, text: bytes):
+        path = self.__get_path(content_hash)
+        data = zlib.compress(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Other processes never see partially written file.
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, path)
+
+        connection = self.__get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO texts (content_hash, size, last_used) "
+            "VALUES (?, ?, ?)", (content_hash, len(data), time.time()))
+        self.__evict()
+
+    def __evict(self):
+        connection = self.__get_connection()
+        total, = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()
+        if total <= self.max_size:
+            return
+
+        for content_hash, size in connection.execute(
+                "SELECT content_hash, size FROM texts "
+                "ORDER BY last_used").fetchall():
+            if total <= self.max_size:
+                break
+            connection.execute("DELETE FROM texts WHERE content_hash = ?",
+                               (content_hash,))
+            try:
+                os.remove(self.__get_path(content_hash))
+            except OSError:
+                pass
+            total -= size
+            self.__count("evictions")
+
+
+@lru_cache(maxsize=None)
+def get_extraction_cache() -> ExtractionCache:
+    """
+    Returns extraction cache shared by the whole process.
+    """
+    cache = ExtractionCache(
+        directory=getattr(settings, 'EXTRACTION_CACHE_DIR', None),
+        max_size=getattr(settings, 'EXTRACTION_CACHE_SIZE', 1024 ** 3),
+        max_wait=getattr(settings, 'EXTRACTION_CACHE_MAX_WAIT', 300),
+        failure_ttl=getattr(settings, 'EXTRACTION_CACHE_FAILURE_TTL', 600))
+    atexit.register(cache.close)
+    return cache
@@ -0,0 +1,249 @@
+import atexit
+import multiprocessing
+import os
+import signal
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+
+OK = "ok"
+TIMEOUT = "timeout"
+TOO_LARGE = "too-large"
+FAILED = "failed"
+
+DEFAULT_LIMITS = {
+    "timeout": 60,
+    "max_size": 50 * 1024 ** 2,
+    "memory": 1024 ** 3,
+    "concurrency": 2,
+}
+
+
+def get_fork_context() -> multiprocessing.context.BaseContext:
+    """
+    Returns multiprocessing context which forks processes. Scan workers
+    and extraction workers use settings, semaphores and modules of their
+    parent without django.setup(), so they can not be started by spawn
+    or forkserver, which is the default since Python 3.14.
+    :raises ValueError: if the platform can not fork.
+    """
+    return multiprocessing.get_context("fork")
+
+
+class ExtractionError(Exception):
+    """
+    Text of the file could not be extracted.
+    """
+    def __init__(self, outcome: str, message: str):
+        super().__init__(message)
+        self.outcome = outcome
+
+
+def get_limits_key(extension: str) -> str:
+    """
+    Returns key of the limits of the extension in EXTRACTION_LIMITS
+    setting, 'default' if the extension has no limits of its own.
+    """
+    limits = getattr(settings, 'EXTRACTION_LIMITS', {})
+    return extension if extension in limits else "default"
+
+
+def get_limits(extension: str) -> dict:
+    """
+    Returns limits of extraction of the files with the extension.
+    :param str extension: Extension of the files.
+    :return: timeout, max_size, memory and concurrency.
+    :rtype: dict
+    """
+    limits = getattr(settings, 'EXTRACTION_LIMITS', {})
+    return {**DEFAULT_LIMITS, **limits.get("default", {}),
+            **limits.get(extension, {})}
+
+
+def check_size(filename: str):
+    """
+    Raises ExtractionError if the file is larger than the limit of its
+    extension.
+    """
+    max_size = get_limits(os.path.splitext(filename)[-1])["max_size"]
+    size = os.path.getsize(filename)
+    if max_size and size > max_size:
+        raise ExtractionError(
+            TOO_LARGE, f"{filename} has {size} bytes, limit is {max_size}")
+
+
+def serve(connection, function: Callable[[str], bytes], memory: int):
+    """
+    Main function of the worker: extracts text of the files received from
+    the connection until None is received.
+    """
+    # Own process group, so programs started by the function are killed
+    # together with the worker.
+    os.setsid()
+    if memory:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    for filename in iter(connection.recv, None):
+        try:
+            connection.send((True, function(filename)))
+        except MemoryError:
+            connection.send((False, "out of memory"))
+        except Exception as error:
+            connection.send((False, f"{type(error).__name__}: {error}"))
+
+
+class ExtractionWorker:
+    """
+    Process which extracts text of files one by one. The worker is killed
+    together with programs it has started if the extraction takes longer
+    than the timeout, and it is replaced by a new one after max_jobs files
+    to contain leaks.
+    """
+    def __init__(self, function: Callable[[str], bytes], memory: int,
+                 max_jobs: int):
+        self.function = function
+        self.memory = memory
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        self.restarts = 0
+        self.__process: Optional[multiprocessing.Process] = None
+        self.__connection = None
+
+    def extract(self, filename: str, timeout: float) -> bytes:
+        """
+        Extracts text of the file in the worker process.
+        :param str filename: Path of the file.
+        :param float timeout: Seconds to wait for the text.
+        :return: UTF-8 text of the file.
+        :rtype: bytes
+        """
+        if self.__process is None or not self.__process.is_alive() or \
+                self.jobs >= self.max_jobs:
+            self.stop()
+            self.__start()
+
+        self.jobs += 1
+        self.__connection.send(filename)
+        if not self.__connection.poll(timeout):
+            self.kill()
+            raise ExtractionError(
+                TIMEOUT, f"{filename} was not extracted in {timeout} s")
+        try:
+            succeeded, result = self.__connection.recv()
+        except EOFError:
+            self.kill()
+            raise ExtractionError(FAILED, f"worker died on {filename}")
+        if not succeeded:
+            raise ExtractionError(FAILED, result)
+        return result
+
+    def stop(self):
+        """
+        Asks the worker to exit, kills it if it does not.
+        """
+        if self.__process is None:
+            return
+        try:
+            self.__connection.send(None)
+        except OSError:
+            pass
+        self.__process.join(1)
+        self.kill()
+
+    def kill(self):
+        """
+        Kills the worker with programs it has started.
+        """
+        if self.__process is None:
+            return
+        if self.__process.is_alive():
+            try:
+                os.killpg(self.__process.pid, signal.SIGKILL)
+            except OSError:
+                self.__process.kill()
+        self.__process.join()
+        self.__connection.close()
+        self.__process = self.__connection = None
+
+    def __start(self):
+        context = get_fork_context()
+        self.__connection, child_connection = context.Pipe()
+        self.__process = context.Process(
+            target=serve, daemon=True,
+            args=(child_connection, self.function, self.memory))
+        self.__process.start()
+        child_connection.close()
+        self.jobs = 0
+        self.restarts += 1
+
+
+# Limits extraction of every format for all scan workers, created
+# before the workers are forked, see prepare_semaphores.
+_semaphores: Dict = {}
+# Workers of this process by keys of the limits, forked processes do not
+# use workers of their parent.
+_workers: Dict[str, ExtractionWorker] = {}
+_workers_pid = os.getpid()
+
+
+def get_semaphore(key: str):
+    """
+    Returns semaphore which limits number of files of the format extracted
+    at once.
+    :param str key: Key of the limits of the format.
+    """
+    if key not in _semaphores:
+        _semaphores[key] = get_fork_context().BoundedSemaphore(
+            get_limits(key)["concurrency"])
+    return _semaphores[key]
+
+
+def prepare_semaphores():
+    """
+    Creates semaphores of all formats, so processes forked afterwards
+    share them.
+    """
+    get_semaphore("default")
+    for key in getattr(settings, 'EXTRACTION_LIMITS', {}):
+        get_semaphore(key)
+
+
+def extract_isolated(filename: str,
+                     function: Callable[[str], bytes]) -> bytes:
+    """
+    Extracts text of the file by the function in a worker process within
+    limits of the extension of the file.
+    :param str filename: Path of the file.
+    :param function: Function which extracts UTF-8 text from the file,
+    e.g. textract.process.
+    :return: UTF-8 text of the file.
+    :rtype: bytes
+    :raises ExtractionError: if the file is too large or the extraction
+    has failed or timed out.
+    """
+    global _workers, _workers_pid
+    check_size(filename)
+    extension = os.path.splitext(filename)[-1]
+    key = get_limits_key(extension)
+    limits = get_limits(extension)
+
+    if _workers_pid != os.getpid():
+        _workers, _workers_pid = {}, os.getpid()
+    if key not in _workers:
+        _workers[key] = ExtractionWorker(
+            function, limits["memory"],
+            getattr(settings, 'EXTRACTION_WORKER_MAX_JOBS', 100))
+    with get_semaphore(key):
+        return _workers[key].extract(filename, limits["timeout"])
+
+
+@atexit.register
+def stop_workers():
+    """
+    Stops workers of this process.
+    """
+    if _workers_pid == os.getpid():
+        for worker in _workers.values():
+            worker.stop()
+        _workers.clear()
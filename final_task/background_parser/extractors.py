@@ -0,0 +1,204 @@
+import codecs
+import posixpath
+import zipfile
+from html.parser import HTMLParser
+from typing import IO, Iterable, Iterator, List, Optional
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+# Size of the pieces zip members are read and parsed by.
+XML_CHUNK_SIZE = 64 * 1024
+
+WORD_NAMESPACE = ("{http://schemas.openxmlformats.org/"
+                  "wordprocessingml/2006/main}")
+ODF_TEXT_NAMESPACE = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+CONTAINER_NAMESPACE = "{urn:oasis:names:tc:opendocument:xmlns:container}"
+OPF_NAMESPACE = "{http://www.idpf.org/2007/opf}"
+
+
+class HTMLTextParser(HTMLParser):
+    """
+    Collects visible text of HTML page. Text of block elements is separated
+    by new lines, so words of neighbouring paragraphs are not glued.
+    """
+    HIDDEN_TAGS = {"head", "title", "script", "style", "template"}
+    BLOCK_TAGS = {
+        "address", "article", "aside", "blockquote", "br", "dd", "div",
+        "dl", "dt", "figcaption", "figure", "footer", "form", "h1", "h2",
+        "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol",
+        "p", "pre", "section", "table", "td", "th", "tr", "ul",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.__hidden_depth = 0
+        self.__parts: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            # Head is often left unclosed.
+            self.__hidden_depth = 0
+        elif tag in self.HIDDEN_TAGS:
+            self.__hidden_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.__parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.HIDDEN_TAGS:
+            self.__hidden_depth = max(self.__hidden_depth - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.__parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.__hidden_depth:
+            self.__parts.append(data)
+
+    def pop_text(self) -> str:
+        """
+        Returns text collected since the previous call.
+        """
+        text = "".join(self.__parts)
+        self.__parts = []
+        return text
+
+
+def iter_html_text(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Extracts visible text from HTML page piece by piece.
+    :param chunks: Decoded chunks of the page.
+    :return: iterator of the chunks of the text.
+    """
+    parser = HTMLTextParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        text = parser.pop_text()
+        if text:
+            yield text
+    parser.close()
+    text = parser.pop_text()
+    if text:
+        yield text
+
+
+def iter_xml_elements(stream: IO[bytes], tags: Iterable[str]) -> Iterator:
+    """
+    Parses XML incrementally and yields elements with the tags as soon as
+    they are parsed. Yielded elements are cleared afterwards, so
+    the whole document is never kept in memory.
+    :param stream: Binary stream with XML.
+    :param tags: Tags of the elements to yield.
+    """
+    tags = set(tags)
+    parser = ElementTree.XMLPullParser(events=("end",))
+    for block in iter(lambda: stream.read(XML_CHUNK_SIZE), b""):
+        parser.feed(block)
+        for _, element in parser.read_events():
+            if element.tag in tags:
+                yield element
+                # Tail is a text of the parent element.
+                tail = element.tail
+                element.clear()
+                element.tail = tail
+    parser.close()
+
+
+def get_paragraph_text(paragraph, text_tags: Optional[set],
+                       space_tags: set) -> str:
+    """
+    Returns text of XML paragraph in document order.
+    :param paragraph: Element of the paragraph.
+    :param text_tags: Tags of the elements which text is taken, None to
+    take text of every element.
+    :param space_tags: Tags of the elements which separate words,
+    e.g. tabs and line breaks.
+    """
+    parts = []
+
+    def walk(element):
+        if element.tag in space_tags:
+            parts.append(" ")
+        elif element.text and (text_tags is None or
+                               element.tag in text_tags):
+            parts.append(element.text)
+        for child in element:
+            walk(child)
+            if child.tail and text_tags is None:
+                parts.append(child.tail)
+
+    walk(paragraph)
+    return "".join(parts)
+
+
+def iter_docx_text(filename: str) -> Iterator[str]:
+    """
+    Extracts text of paragraphs from headers, body and footers of DOCX
+    document.
+    :param str filename: Path of the document.
+    :return: iterator of the texts of the paragraphs.
+    """
+    paragraph_tag = f"{WORD_NAMESPACE}p"
+    text_tags = {f"{WORD_NAMESPACE}t"}
+    space_tags = {f"{WORD_NAMESPACE}{tag}" for tag in ("tab", "br", "cr")}
+
+    with zipfile.ZipFile(filename) as document:
+        names = document.namelist()
+        parts = (
+            [n for n in names if n.startswith("word/header")] +
+            ["word/document.xml"] +
+            [n for n in names if n.startswith("word/footer")])
+        for name in parts:
+            with document.open(name) as stream:
+                for paragraph in iter_xml_elements(stream, {paragraph_tag}):
+                    yield get_paragraph_text(
+                        paragraph, text_tags, space_tags) + "\n"
+
+
+def iter_odt_text(filename: str) -> Iterator[str]:
+    """
+    Extracts text of paragraphs and headings of ODT document.
+    :param str filename: Path of the document.
+    :return: iterator of the texts of the paragraphs.
+    """
+    paragraph_tags = {f"{ODF_TEXT_NAMESPACE}p", f"{ODF_TEXT_NAMESPACE}h"}
+    space_tags = {f"{ODF_TEXT_NAMESPACE}{tag}"
+                  for tag in ("s", "tab", "line-break")}
+
+    with zipfile.ZipFile(filename) as document, \
+            document.open("content.xml") as stream:
+        for paragraph in iter_xml_elements(stream, paragraph_tags):
+            yield get_paragraph_text(paragraph, None, space_tags) + "\n"
+
+
+def get_epub_chapters(book: zipfile.ZipFile) -> List[str]:
+    """
+    Returns names of the zip members with chapters of EPUB book
+    in reading order.
+    :param book: Opened book.
+    """
+    container = ElementTree.fromstring(book.read("META-INF/container.xml"))
+    rootfile = container.find(f".//{CONTAINER_NAMESPACE}rootfile")
+    package_name = rootfile.get("full-path")
+    package = ElementTree.fromstring(book.read(package_name))
+
+    base = posixpath.dirname(package_name)
+    items = {
+        item.get("id"): posixpath.normpath(
+            posixpath.join(base, unquote(item.get("href"))))
+        for item in package.iter(f"{OPF_NAMESPACE}item")}
+    return [items[itemref.get("idref")]
+            for itemref in package.iter(f"{OPF_NAMESPACE}itemref")
+            if itemref.get("idref") in items]
+
+
+def iter_epub_text(filename: str) -> Iterator[str]:
+    """
+    Extracts visible text of the chapters of EPUB book.
+    :param str filename: Path of the book.
+    :return: iterator of the chunks of the text.
+    """
+    with zipfile.ZipFile(filename) as book:
+        for name in get_epub_chapters(book):
+            with book.open(name) as stream:
+                yield from iter_html_text(codecs.iterdecode(
+                    iter(lambda: stream.read(XML_CHUNK_SIZE), b""),
+                    "utf-8", errors="replace"))
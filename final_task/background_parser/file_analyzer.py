@@ -1,6 +1,14 @@
+import json
+import zlib
+from collections import Counter
+from typing import Optional
+
+from background_parser.extraction_pool import OK
+from background_parser.metrics import FileMeasurement
 from background_parser.models import FileStatistic
 from background_parser.opener import get_content
 from background_parser.parser import FileParser
+from background_parser.writers import BulkWriter
 
 
 class StatisticCalculator:
@@ -16,29 +24,108 @@ class FileAnalyzer(StatisticCalculator):
     Opens file by get_content, invokes parser
     and saves statistics of the file into database.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, changed=True):
         self.filename = filename
-        self.parser: FileParser = None
+        # Statistic of unchanged files is not saved again.
+        self.changed = changed
+        self.statistic: Optional[dict] = None
+        self.words_counter: Optional[list] = None
+        # 'ok', 'timeout', 'too-large' or 'failed', see opener.Content.
+        self.extraction_outcome = OK
+        # Costs of parsing of the file, see metrics.FileMeasurement.
+        self.metrics: Optional[dict] = None
 
     def calculate_stat(self):
         """
-        Invokes FileParser to calculate statistic.
+        Invokes FileParser to calculate statistic. The statistic is
+        calculated only once, so analyzers which were calculated
+        in a worker process are not parsed again.
         """
-        self.parser = FileParser(get_content(filename=self.filename))
-        return (self.parser.return_full_file_statistics(),
-                self.parser.return_all_words_counter())
+        if self.statistic is None:
+            measurement = FileMeasurement()
+            content = get_content(filename=self.filename)
+            parser = FileParser(content)
+            self.statistic = parser.return_full_file_statistics()
+            self.words_counter = parser.return_all_words_counter()
+            self.extraction_outcome = content.outcome
+            self.metrics = measurement.get_metrics(content, sum(
+                sum(words.values()) for words in self.words_counter))
+        return self.statistic, self.words_counter
 
-    def save_stat(self):
+    def save_stat(self, writer: Optional[BulkWriter] = None):
         """
         Saves statistic into database.
+        :param writer: Writer to add the row to, the row is saved
+        immediately if it is not given.
+        """
+        stat = self.statistic
+        slug = self.filename[2:].replace(".", "-").replace("/", "-")
+        defaults = {"file": self.filename,
+                    "most_recent_word": stat["most_recent_word"],
+                    "least_recent_word": stat["least_recent_word"],
+                    "average_word_length": stat['average_word_length'],
+                    "vowels": stat['vowels'],
+                    "consonants": stat['consonants'],
+                    "syllables": stat['syllables'],
+                    "extraction_outcome": self.extraction_outcome,
+                    "partial_statistic": self.get_partial_statistic()}
+        if writer is not None:
+            writer.add(FileStatistic(slug=slug, **defaults))
+        else:
+            FileStatistic.objects.update_or_create(slug=slug,
+                                                   defaults=defaults)
+
+    def get_partial_statistic(self) -> bytes:
+        """
+        Returns statistic of the file which can be merged into statistic
+        of the folders, compressed JSON.
+        :rtype: bytes
+        """
+        ru_words, en_words = self.words_counter
+        partial = {
+            "ru_word_freq": ru_words,
+            "en_word_freq": en_words,
+            "words": {"ru": sum(ru_words.values()),
+                      "en": sum(en_words.values())},
+            "letters": {
+                "ru": sum(len(w) * n for w, n in ru_words.items()),
+                "en": sum(len(w) * n for w, n in en_words.items())},
+            "vowels": self.statistic["vowels"],
+            "consonants": self.statistic["consonants"],
+            "syllables": self.statistic["syllables"],
+        }
+        return zlib.compress(
+            json.dumps(partial, ensure_ascii=False).encode("utf-8"))
+
+    @classmethod
+    def from_partial_statistic(cls, filename: str,
+                               data: bytes) -> 'FileAnalyzer':
         """
-        stat = self.parser.return_full_file_statistics()
-        FileStatistic.objects.update_or_create(
-            slug=self.filename[2:].replace(".", "-").replace("/", "-"),
-            defaults={"file": self.filename,
-                      "most_recent_word": stat["most_recent_word"],
-                      "least_recent_word": stat["least_recent_word"],
-                      "average_word_length": stat['average_word_length'],
-                      "vowels": stat['vowels'],
-                      "consonants": stat['consonants'],
-                      "syllables": stat['syllables']})
+        Restores analyzer of unchanged file from its partial statistic
+        without reading the file.
+        :param str filename: Path of the file.
+        :param bytes data: Partial statistic from get_partial_statistic.
+        """
+        partial = json.loads(zlib.decompress(data).decode("utf-8"))
+        words = sum(partial["words"].values())
+        letters = sum(partial["letters"].values())
+
+        analyzer = cls(filename, changed=False)
+        analyzer.statistic = {
+            "average_word_length": letters / words if words else 0,
+            "vowels": Counter(partial["vowels"]),
+            "consonants": Counter(partial["consonants"]),
+            "syllables": Counter(partial["syllables"]),
+        }
+        analyzer.words_counter = [Counter(partial["ru_word_freq"]),
+                                  Counter(partial["en_word_freq"])]
+        return analyzer
+
+
+def calculate_file_stat(analyzer: FileAnalyzer) -> FileAnalyzer:
+    """
+    Calculates statistic of the file. Used by worker processes,
+    analyzer is returned back with the statistic calculated.
+    """
+    analyzer.calculate_stat()
+    return analyzer
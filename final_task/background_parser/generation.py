@@ -0,0 +1,58 @@
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from background_parser.models import ScanGeneration
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone as django_timezone
+
+# Generation read last time by this process and when it was read.
+_generation: Optional[Tuple[int, datetime]] = None
+_checked = float("-inf")
+
+
+def bump_generation():
+    """
+    Increases scan generation after statistic was written.
+    """
+    global _generation
+    if not ScanGeneration.objects.filter(id=1).update(
+            value=F("value") + 1, updated=django_timezone.now()):
+        try:
+            with transaction.atomic():
+                ScanGeneration.objects.create(
+                    id=1, value=1, updated=django_timezone.now())
+        except IntegrityError:
+            # Created by other process at the same time.
+            bump_generation()
+            return
+    _generation = None
+
+
+def peek_generation() -> Optional[Tuple[int, datetime]]:
+    """
+    Returns scan generation read by this process if it is still trusted,
+    None if it has to be read from the database by get_generation.
+    """
+    if time.monotonic() - _checked >= getattr(
+            settings, 'SCAN_GENERATION_TTL', 1.0):
+        return None
+    return _generation
+
+
+def get_generation() -> Tuple[int, datetime]:
+    """
+    Returns scan generation and time when it was increased. It is read
+    from the database not more often than once per SCAN_GENERATION_TTL
+    seconds.
+    :rtype: tuple
+    """
+    global _generation, _checked
+    if peek_generation() is None:
+        _generation = ScanGeneration.objects.filter(id=1).values_list(
+            "value", "updated").first() or \
+            (0, datetime.fromtimestamp(0, timezone.utc))
+        _checked = time.monotonic()
+    return _generation
@@ -0,0 +1,167 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+import pyphen
+from django.conf import settings
+
+
+@lru_cache(maxsize=None)
+def get_hyphenator(language: str) -> pyphen.Pyphen:
+    """
+    Returns hyphenator for the language, it is created once per process.
+    :param str language: Language of the hyphenation dictionary.
+    """
+    return pyphen.Pyphen(lang=language)
+
+
+class HyphenationCache:
+    """
+    Bounded LRU cache of syllables of the words. Optionally keeps hyphenated
+    words in sqlite database on disk, so they survive restarts of
+    the worker and can be calculated in advance.
+    """
+    def __init__(self, maxsize: int, disk_path: Optional[str] = None,
+                 disk_batch_size: int = 500):
+        self.maxsize = maxsize
+        self.disk_path = disk_path
+        self.disk_batch_size = disk_batch_size
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        # Time spent on hyphenation by Pyphen.
+        self.seconds = 0.0
+        self.__syllables: 'OrderedDict[Tuple[str, str], Dict[str, int]]' = \
+            OrderedDict()
+        self.__pending_rows = []
+        self.__lock = threading.RLock()
+        self.__connection: Optional[sqlite3.Connection] = None
+        self.__connection_pid = None
+
+    def get_syllables(self, word: str, language: str) -> dict:
+        """
+        Returns syllables of the word counted in dict.
+        :param str word: Word to hyphenate.
+        :param str language: Language of the word.
+        :return: counted syllables dict.
+        :rtype: dict.
+        """
+        key = (language, word)
+        with self.__lock:
+            syllables = self.__syllables.get(key)
+            if syllables is not None:
+                self.hits += 1
+                self.__syllables.move_to_end(key)
+                return dict(syllables)
+
+            self.misses += 1
+            inserted = self.__read_from_disk(word, language)
+            if inserted is None:
+                started = time.perf_counter()
+                inserted = get_hyphenator(language).inserted(word)
+                self.seconds += time.perf_counter() - started
+                self.__write_to_disk(word, language, inserted)
+            else:
+                self.disk_hits += 1
+
+            syllables = dict(Counter(inserted.split("-")))
+            self.__syllables[key] = syllables
+            if len(self.__syllables) > self.maxsize:
+                self.__syllables.popitem(last=False)
+            return dict(syllables)
+
+    def prewarm(self, words: Iterable[Tuple[str, str]]) -> int:
+        """
+        Hyphenates words in advance and stores them in the cache.
+        :param words: Pairs of word and its language.
+        :return: number of processed words.
+        :rtype: int.
+        """
+        amount = 0
+        for word, language in words:
+            self.get_syllables(word, language)
+            amount += 1
+        self.flush()
+        return amount
+
+    def flush(self):
+        """
+        Writes hyphenated words that are not saved yet to the disk.
+        """
+        with self.__lock:
+            if not self.__pending_rows:
+                return
+            self.__get_connection().executemany(
+                "INSERT OR IGNORE INTO syllables (language, word, inserted) "
+                "VALUES (?, ?, ?)", self.__pending_rows)
+            self.__get_connection().commit()
+            self.__pending_rows = []
+
+    def clear(self):
+        """
+        Drops words kept in memory and resets counters.
+        """
+        with self.__lock:
+            self.__syllables.clear()
+            self.hits = self.misses = self.disk_hits = 0
+            self.seconds = 0.0
+
+    def statistic(self) -> dict:
+        """
+        Returns usage statistic of the cache.
+        :rtype: dict.
+        """
+        with self.__lock:
+            return {
+                "size": len(self.__syllables),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "seconds": round(self.seconds, 3),
+            }
+
+    def __get_connection(self) -> sqlite3.Connection:
+        # Connection can not be shared with forked processes.
+        if self.__connection is None or self.__connection_pid != os.getpid():
+            self.__connection = sqlite3.connect(
+                self.disk_path, timeout=30, check_same_thread=False)
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS syllables ("
+                "language TEXT, word TEXT, inserted TEXT, "
+                "PRIMARY KEY (language, word))")
+            self.__connection_pid = os.getpid()
+            self.__pending_rows = []
+        return self.__connection
+
+    def __read_from_disk(self, word: str, language: str) -> Optional[str]:
+        if not self.disk_path:
+            return None
+        row = self.__get_connection().execute(
+            "SELECT inserted FROM syllables WHERE language = ? AND word = ?",
+            (language, word)).fetchone()
+        return row[0] if row else None
+
+    def __write_to_disk(self, word: str, language: str, inserted: str):
+        if not self.disk_path:
+            return
+        self.__pending_rows.append((language, word, inserted))
+        if len(self.__pending_rows) >= self.disk_batch_size:
+            self.flush()
+
+
+@lru_cache(maxsize=None)
+def get_hyphenation_cache() -> HyphenationCache:
+    """
+    Returns hyphenation cache shared by the whole process.
+    """
+    cache = HyphenationCache(
+        maxsize=getattr(settings, 'HYPHENATION_CACHE_SIZE', 100000),
+        disk_path=getattr(settings, 'HYPHENATION_DISK_CACHE', None))
+    atexit.register(cache.flush)
+    return cache
@@ -0,0 +1,305 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from background_parser.models import ScanJob
+from background_task.models import Task
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+
+class ScanCancelled(Exception):
+    """
+    Scan job was cancelled through the API.
+    """
+
+
+def get_job_key(directory: str, extensions: List[str], mode: str) -> str:
+    """
+    Returns key which is the same for identical scan requests.
+    """
+    request = json.dumps([directory, sorted(set(extensions)), mode])
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+def get_task_name(job_id: Optional[int]) -> Optional[str]:
+    """
+    Returns verbose name of the background tasks of the job, which links
+    queued tasks to the job, see has_waiting_tasks.
+    """
+    return f"scan-job-{job_id}" if job_id is not None else None
+
+
+def has_waiting_tasks(job_id: int) -> bool:
+    """
+    Returns True if tasks of the job wait in the queue: shards which are
+    not started yet or failed tasks which will be retried. Running tasks
+    are locked, they report heartbeat themselves.
+    """
+    return Task.objects.filter(verbose_name=get_task_name(job_id),
+                               locked_by__isnull=True).exists()
+
+
+def find_or_create_job(directory: str, extensions: List[str],
+                       mode: str) -> Tuple[ScanJob, bool]:
+    """
+    Returns queued or running job of the identical request, creates new
+    job if there is no such job.
+    :param str directory: Folder to scan.
+    :param List extensions: Extensions of the files to analyze.
+    :param str mode: Word frequency mode of the scan.
+    :return: job and whether it was created.
+    :rtype: tuple
+    """
+    directory = directory.rstrip(os.sep) or os.sep
+    key = get_job_key(directory, extensions, mode)
+
+    # Job which has no heartbeat for a long time and no tasks in the queue
+    # has died with its worker and should not block new requests.
+    stale_after = getattr(settings, 'SCAN_JOB_STALE_SECONDS', 600)
+    expired = timezone.now() - timedelta(seconds=stale_after)
+    job = ScanJob.objects.filter(key=key,
+                                 status__in=ScanJob.IN_FLIGHT).first()
+    if job is not None and job.status == ScanJob.RUNNING and \
+            job.updated is not None and job.updated < expired and \
+            not has_waiting_tasks(job.id):
+        ScanJob.objects.filter(
+            id=job.id, status=ScanJob.RUNNING, updated__lt=expired
+        ).update(status=ScanJob.FAILED, finished=timezone.now(),
+                 error="Job has stopped reporting progress")
+        job = ScanJob.objects.filter(key=key,
+                                     status__in=ScanJob.IN_FLIGHT).first()
+    if job is not None:
+        return job, False
+    try:
+        with transaction.atomic():
+            return ScanJob.objects.create(
+                directory=directory, extensions=sorted(set(extensions)),
+                mode=mode, key=key), True
+    except IntegrityError:
+        # Identical request has created the job at the same time.
+        return ScanJob.objects.get(key=key,
+                                   status__in=ScanJob.IN_FLIGHT), False
+
+
+def cancel_job(job: ScanJob):
+    """
+    Asks the job to stop, queued job is cancelled at once.
+    """
+    ScanJob.objects.filter(id=job.id).update(cancel_requested=True)
+    ScanJob.objects.filter(id=job.id, status=ScanJob.QUEUED).update(
+        status=ScanJob.CANCELLED, finished=timezone.now())
+    job.refresh_from_db()
+
+
+def describe_job(job: ScanJob) -> dict:
+    """
+    Returns status and progress of the job with its throughput and
+    estimated time left in seconds.
+    :rtype: dict
+    """
+    elapsed = None
+    if job.started is not None:
+        elapsed = ((job.finished or timezone.now()) -
+                   job.started).total_seconds()
+
+    files_per_second = bytes_per_second = eta = None
+    if elapsed:
+        files_per_second = round(job.files_done / elapsed, 3)
+        bytes_per_second = round(job.bytes_done / elapsed, 1)
+        if job.status == ScanJob.RUNNING and job.bytes_done:
+            eta = round((job.bytes_total - job.bytes_done) /
+                        (job.bytes_done / elapsed), 1)
+
+    return {
+        "job": job.id,
+        "directory": job.directory,
+        "extensions": job.extensions,
+        "mode": job.mode,
+        "status": job.status,
+        "cancel_requested": job.cancel_requested,
+        "files_total": job.files_total,
+        "files_done": job.files_done,
+        "bytes_total": job.bytes_total,
+        "bytes_done": job.bytes_done,
+        "elapsed": elapsed,
+        "files_per_second": files_per_second,
+        "bytes_per_second": bytes_per_second,
+        "eta": eta,
+        "error": job.error,
+        "created": job.created,
+        "started": job.started,
+        "finished": job.finished,
+    }
+
+
+class Heartbeat:
+    """
+    Marks the running job alive from a separate thread while its task
+    runs, also in the stages which report no progress, e.g. walking and
+    planning of a large tree.
+    """
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.interval = getattr(settings, 'SCAN_JOB_HEARTBEAT_SECONDS', 60)
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True,
+                                         name=f"heartbeat-{job_id}")
+
+    def start(self):
+        self.__thread.start()
+
+    def stop(self):
+        self.__stopped.set()
+        self.__thread.join()
+
+    def __run(self):
+        try:
+            while not self.__stopped.wait(self.interval):
+                try:
+                    ScanJob.objects.filter(
+                        id=self.job_id, status=ScanJob.RUNNING
+                    ).update(updated=timezone.now())
+                except DatabaseError as error:
+                    logging.getLogger(__name__).warning(
+                        "Heartbeat of scan job %s failed: %s",
+                        self.job_id, error)
+        finally:
+            # The thread has its own connection to the database.
+            connection.close()
+
+
+class ScanProgress:
+    """
+    Tracks progress of the scan job. Progress is saved and cancellation is
+    checked not more often than once per SCAN_PROGRESS_INTERVAL seconds.
+    Without job it only counts processed files.
+    Used as context manager around the scan: it marks the job running and
+    then done, failed or cancelled. ScanCancelled is not propagated.
+    Job which is not queued anymore, e.g. cancelled before it was started
+    or already run, is not run again.
+    Shards of the scan attach to the job which is already running and add
+    their progress to it (attach=True), only the task which merges
+    the shards finishes the job (finish=False for the others).
+    While the task runs, Heartbeat marks the job alive.
+    """
+    def __init__(self, job_id: Optional[int] = None, attach: bool = False,
+                 finish: bool = True):
+        self.job_id = job_id
+        self.attach = attach
+        self.finish = finish
+        self.files_total = self.files_done = 0
+        self.bytes_total = self.bytes_done = 0
+        self.interval = getattr(settings, 'SCAN_PROGRESS_INTERVAL', 1.0)
+        self.__saved = float("-inf")
+        self.__checked = float("-inf")
+        self.__started = False
+        self.__heartbeat: Optional[Heartbeat] = None
+        # Progress already added to the job, several tasks can report
+        # progress of the same job.
+        self.__saved_files = self.__saved_bytes = 0
+
+    @property
+    def active(self) -> bool:
+        """
+        Whether the scan should run: there is no job or the job was
+        started or attached to.
+        """
+        return self.job_id is None or self.__started
+
+    def set_total(self, files: int, size: int):
+        """
+        Sets number and size of the files to analyze.
+        """
+        self.files_total, self.bytes_total = files, size
+        self.__save(force=True, files_total=files, bytes_total=size)
+
+    def add(self, files: int = 1, size: int = 0):
+        """
+        Adds analyzed files.
+        """
+        self.files_done += files
+        self.bytes_done += size
+        self.__save()
+
+    def hand_over(self):
+        """
+        Leaves the job running when the scan ends, it is finished by
+        the tasks the scan was handed over to.
+        """
+        self.finish = False
+
+    def check_cancelled(self):
+        """
+        Raises ScanCancelled if the job was cancelled.
+        """
+        if self.job_id is None:
+            return
+        if not self.__started:
+            raise ScanCancelled(f"Scan job {self.job_id} is not queued")
+        if time.monotonic() - self.__checked < self.interval:
+            return
+        self.__checked = time.monotonic()
+        if ScanJob.objects.filter(id=self.job_id,
+                                  cancel_requested=True).exists():
+            raise ScanCancelled(f"Scan job {self.job_id} was cancelled")
+
+    def __save(self, force: bool = False, **fields):
+        if self.job_id is None or not self.__started or \
+                not force and time.monotonic() - self.__saved < self.interval:
+            return
+        self.__saved = time.monotonic()
+        ScanJob.objects.filter(id=self.job_id).update(
+            files_done=F("files_done") + self.files_done - self.__saved_files,
+            bytes_done=F("bytes_done") + self.bytes_done - self.__saved_bytes,
+            updated=timezone.now(), **fields)
+        self.__saved_files, self.__saved_bytes = \
+            self.files_done, self.bytes_done
+
+    def __enter__(self) -> 'ScanProgress':
+        if self.job_id is None:
+            return self
+        if self.attach:
+            self.__started = ScanJob.objects.filter(
+                id=self.job_id, status=ScanJob.RUNNING,
+                cancel_requested=False).exists()
+        else:
+            self.__started = bool(ScanJob.objects.filter(
+                id=self.job_id, status=ScanJob.QUEUED,
+                cancel_requested=False
+            ).update(status=ScanJob.RUNNING, started=timezone.now(),
+                     updated=timezone.now()))
+        if self.__started:
+            self.__heartbeat = Heartbeat(self.job_id)
+            self.__heartbeat.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__heartbeat is not None:
+            self.__heartbeat.stop()
+            self.__heartbeat = None
+        cancelled = exc_type is not None and \
+            issubclass(exc_type, ScanCancelled)
+        if self.job_id is not None and not self.__started:
+            return cancelled
+        if cancelled:
+            status, error = ScanJob.CANCELLED, ""
+        elif not self.finish or exc_type is not None and self.attach:
+            # Failed shard of the scan or its merge is retried.
+            self.__save(force=True)
+            return False
+        elif exc_type is None:
+            status, error = ScanJob.DONE, ""
+        else:
+            status, error = ScanJob.FAILED, f"{exc_type.__name__}: " \
+                                            f"{exc_value}"
+        self.__save(force=True, status=status, error=error,
+                    finished=timezone.now())
+        return cancelled
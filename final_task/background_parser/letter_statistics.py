@@ -0,0 +1,153 @@
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+ENGLISH_ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
+RUSSIAN_ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+ALPHABET = ENGLISH_ALPHABET + RUSSIAN_ALPHABET
+
+# Lowercase 'İ' is 'i' followed by the combining dot which is counted
+# as a consonant of the word.
+DOTTED_CAPITAL_I = '\u0130'
+COMBINING_DOT = '\u0307'
+
+# Maps code point of the symbol to index of the letter in ALPHABET,
+# -1 for the symbols that are not letters. The last cell is used for
+# all the code points beyond the alphabets.
+LETTER_INDEXES = np.full(max(map(ord, ALPHABET)) + 2, -1, dtype=np.int8)
+LETTER_INDEXES[[ord(letter) for letter in ALPHABET]] = np.arange(
+    len(ALPHABET))
+
+IS_ENGLISH_LETTER = np.array([letter in ENGLISH_ALPHABET
+                              for letter in ALPHABET])
+IS_ENGLISH_VOWEL = np.array([letter in 'aeiouy' for letter in ALPHABET])
+IS_RUSSIAN_VOWEL = np.array([letter in 'аоуэыяеюиё' for letter in ALPHABET])
+
+NOT_SEEN = np.iinfo(np.int64).max
+
+
+class VectorizedLetterCounter:
+    """
+    Counts vowels and consonants of the text chunk by chunk with numpy.
+    Letters are vowels or consonants by the rules of the language of the
+    word they belong to, the language is defined by the first letter.
+    Letters are returned in the order they first occur in the text, as
+    WordToken counts them.
+    """
+    def __init__(self):
+        self.__vowels = np.zeros(len(ALPHABET), dtype=np.int64)
+        self.__consonants = np.zeros(len(ALPHABET), dtype=np.int64)
+        self.__combining_dots = 0
+        # Positions of the first vowel and consonant of every letter in
+        # the text. Letter number n has position 2n, the combining dot
+        # after it has position 2n + 1.
+        self.__first_vowels = np.full(len(ALPHABET), NOT_SEEN)
+        self.__first_consonants = np.full(len(ALPHABET), NOT_SEEN)
+        self.__first_combining_dot = NOT_SEEN
+        self.__letters = 0
+        # Language of the word cut by the end of the previous chunk.
+        self.__tail_is_english: Optional[bool] = None
+
+    def update(self, chunk: str):
+        """
+        Adds letters of the chunk to the statistic.
+        :param str chunk: Next chunk of the text.
+        """
+        if not chunk:
+            return
+        first_dot = chunk.find(DOTTED_CAPITAL_I)
+        if first_dot >= 0:
+            self.__combining_dots += chunk.count(DOTTED_CAPITAL_I)
+            chunk = chunk.replace(DOTTED_CAPITAL_I, 'i')
+
+        codes = np.frombuffer(chunk.lower().encode('utf-32-le'),
+                              dtype=np.uint32)
+        indexes = LETTER_INDEXES[np.minimum(codes, len(LETTER_INDEXES) - 1)]
+        is_letter = indexes >= 0
+
+        word_starts = is_letter.copy()
+        word_starts[1:] &= ~is_letter[:-1]
+        continues_tail = self.__tail_is_english is not None and is_letter[0]
+        if continues_tail:
+            word_starts[0] = False
+
+        # Words are numbered from 1, letters of the word started in the
+        # previous chunk get number 0.
+        word_numbers = np.cumsum(word_starts)
+        words_are_english = np.concatenate((
+            [bool(continues_tail and self.__tail_is_english)],
+            IS_ENGLISH_LETTER[indexes[word_starts]]))
+
+        letters = indexes[is_letter]
+        letters_are_english = words_are_english[word_numbers[is_letter]]
+        is_vowel = np.where(letters_are_english,
+                            IS_ENGLISH_VOWEL[letters],
+                            IS_RUSSIAN_VOWEL[letters])
+
+        vowels = np.bincount(letters[is_vowel], minlength=len(ALPHABET))
+        consonants = np.bincount(letters[~is_vowel], minlength=len(ALPHABET))
+        self.__vowels += vowels
+        self.__consonants += consonants
+
+        self.__see(self.__first_vowels, vowels, letters, is_vowel)
+        self.__see(self.__first_consonants, consonants, letters, ~is_vowel)
+        if first_dot >= 0 and self.__first_combining_dot == NOT_SEEN:
+            self.__first_combining_dot = 2 * (
+                self.__letters +
+                int(np.count_nonzero(is_letter[:first_dot]))) + 1
+        self.__letters += len(letters)
+
+        self.__tail_is_english = \
+            bool(words_are_english[word_numbers[-1]]) \
+            if is_letter[-1] else None
+
+    def __see(self, first_seen: np.ndarray, counts: np.ndarray,
+              letters: np.ndarray, selected: np.ndarray):
+        """
+        Records positions of the letters of the chunk which are seen for
+        the first time. Only the first chunks have such letters.
+        """
+        new = np.flatnonzero((counts > 0) & (first_seen == NOT_SEEN))
+        if not len(new):
+            return
+        positions = np.flatnonzero(selected)
+        selected_letters = letters[positions]
+        for letter in new:
+            first_seen[letter] = 2 * (self.__letters + int(
+                positions[np.argmax(selected_letters == letter)]))
+
+    def observe(self, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        Passes chunks through, counting letters of every one of them.
+        """
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+
+    def vowels(self) -> dict:
+        """
+        Returns counted vowels.
+        :rtype: dict.
+        """
+        return self.__to_dict(self.__vowels, self.__first_vowels)
+
+    def consonants(self) -> dict:
+        """
+        Returns counted consonants.
+        :rtype: dict.
+        """
+        combining_dots = []
+        if self.__combining_dots:
+            combining_dots.append((self.__first_combining_dot, COMBINING_DOT,
+                                   self.__combining_dots))
+        return self.__to_dict(self.__consonants, self.__first_consonants,
+                              combining_dots)
+
+    @staticmethod
+    def __to_dict(counts: np.ndarray, first_seen: np.ndarray,
+                  extra: Iterable = ()) -> dict:
+        letters = [(int(first_seen[index]), ALPHABET[index],
+                    int(counts[index]))
+                   for index in np.flatnonzero(counts)]
+        return {letter: count
+                for _, letter, count in sorted([*letters, *extra])}
@@ -0,0 +1,24 @@
+from collections import Counter
+
+from background_parser.hyphenation import get_hyphenation_cache
+from background_parser.opener import get_content
+from background_parser.parser import detect_language, iter_words
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Hyphenates words from the given files in advance and stores " \
+           "them in the hyphenation cache on disk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+')
+
+    def handle(self, *args, **options):
+        words = Counter()
+        for filename in options['files']:
+            words.update(iter_words(get_content(filename=filename)))
+
+        cache = get_hyphenation_cache()
+        amount = cache.prewarm(
+            (word, detect_language(word)) for word in words)
+        self.stdout.write(f"Hyphenated {amount} words: {cache.statistic()}")
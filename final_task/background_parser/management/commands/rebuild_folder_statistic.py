@@ -0,0 +1,18 @@
+from background_parser.services import rebuild_folders_statistic
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Recalculates statistic of the folders from stored statistic " \
+           "of the files without reading them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('extensions', nargs='+')
+
+    def handle(self, *args, **options):
+        stat = rebuild_folders_statistic(options['directory'],
+                                         options['extensions'])
+        self.stdout.write(
+            f"Rebuilt statistic of {stat.get_stat()['number_of_files']} "
+            f"files")
@@ -0,0 +1,14 @@
+from background_parser.word_index import rebuild_word_index
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Indexes words of the analyzed files again from their stored " \
+           "statistic without reading them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?')
+
+    def handle(self, *args, **options):
+        files = rebuild_word_index(options['directory'])
+        self.stdout.write(f"Indexed words of {files} files")
@@ -0,0 +1,262 @@
+import hashlib
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from background_parser.models import (DirectoryStatistic, FileManifest,
+                                      FileStatistic)
+from background_parser.writers import BulkWriter
+from django.conf import settings
+from django.db.models import Q
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def get_content_hash(filename: str) -> str:
+    """
+    Calculates hash of the content of the file.
+    :param str filename: Path of the file.
+    :return: hex digest of the content.
+    :rtype: str
+    """
+    content_hash = hashlib.blake2b(digest_size=32)
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def inside_folder(field: str, base_path: str) -> Q:
+    """
+    Returns filter of the paths which are inside the folder.
+    :param str field: Name of the field with the path.
+    :param str base_path: Path of the folder.
+    """
+    return (Q(**{field: base_path}) |
+            Q(**{f"{field}__startswith": os.path.join(base_path, "")}))
+
+
+def get_ancestors(path: str, base_path: str) -> Iterator[str]:
+    """
+    Returns paths of the folders from the parent of the path up to
+    the base folder.
+    """
+    while len(path) > len(base_path):
+        path = os.path.dirname(path)
+        yield path
+
+
+class ScanPlan:
+    """
+    Difference between the files recorded in the manifest and the files
+    which are in the folder now.
+    """
+    def __init__(self, base_path: str):
+        self.base_path = base_path
+        # path: (size, modification time, content hash)
+        self.changed_files: Dict[str, Tuple[int, float, str]] = {}
+        self.touched_files: Dict[str, Tuple[int, float, str]] = {}
+        self.removed_files: Set[str] = set()
+        self.removed_dirs: Set[str] = set()
+        self.dirty_dirs: Set[str] = set()
+        # Unchanged files which statistic can be restored without parsing.
+        self.restorable_files: Set[str] = set()
+        # Tops of the unchanged sub-trees which stored statistic is merged
+        # into their parents instead of the statistic of their files.
+        self.reused_dirs: Set[str] = set()
+        self.file_sizes: Dict[str, int] = {}
+
+    def has_changes(self) -> bool:
+        """
+        Returns True if any statistic has to be recalculated.
+        """
+        return bool(self.changed_files or self.removed_files or
+                    self.dirty_dirs)
+
+    def is_changed(self, filename: str) -> bool:
+        """
+        Returns True if the file is new or its content has changed.
+        """
+        return filename in self.changed_files
+
+    def needs_analysis(self, filename: str) -> bool:
+        """
+        Returns True if the file has to be parsed: it has changed or its
+        partial statistic is not stored.
+        """
+        return (self.is_changed(filename) or
+                filename not in self.restorable_files)
+
+    def to_dict(self, files: Set[str], dirs: Set[str]) -> Dict:
+        """
+        Returns the part of the plan about the files and folders in JSON
+        serializable form, so they can be analyzed by another task.
+        Removed files and folders are not included, they are deleted by
+        the task which has made the plan.
+        :param files: Paths of the files.
+        :param dirs: Paths of the folders.
+        :rtype: dict
+        """
+        return {
+            "base_path": self.base_path,
+            "changed_files": {path: list(value) for path, value in
+                              self.changed_files.items() if path in files},
+            "touched_files": {path: list(value) for path, value in
+                              self.touched_files.items() if path in files},
+            "restorable_files": sorted(self.restorable_files & files),
+            "dirty_dirs": sorted(self.dirty_dirs & dirs),
+            "reused_dirs": sorted(self.reused_dirs & dirs),
+            "file_sizes": {path: size for path, size in
+                           self.file_sizes.items() if path in files},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'ScanPlan':
+        """
+        Restores the plan from to_dict.
+        """
+        plan = cls(data["base_path"])
+        plan.changed_files = {path: tuple(value) for path, value in
+                              data["changed_files"].items()}
+        plan.touched_files = {path: tuple(value) for path, value in
+                              data["touched_files"].items()}
+        plan.restorable_files = set(data["restorable_files"])
+        plan.dirty_dirs = set(data["dirty_dirs"])
+        plan.reused_dirs = set(data.get("reused_dirs", []))
+        plan.file_sizes = dict(data["file_sizes"])
+        return plan
+
+    def prune_reused(self, folders: Iterable) -> List:
+        """
+        Returns folders from the walker without the content of the reused
+        sub-trees: their tops are left without files and sub-folders,
+        folders below them are dropped.
+        :param folders: Paths of folders, their sub-folders and files.
+        :rtype: list
+        """
+        pruned = []
+        for path, sub_folders, files in folders:
+            if path in self.reused_dirs:
+                pruned.append((path, [], []))
+            elif self.reused_dirs.isdisjoint(
+                    get_ancestors(path, self.base_path)):
+                pruned.append((path, sub_folders, files))
+        return pruned
+
+    def delete_removed(self):
+        """
+        Deletes statistic of the files and folders which do not exist
+        anymore.
+        """
+        FileStatistic.objects.filter(file__in=self.removed_files).delete()
+        FileManifest.objects.filter(path__in=self.removed_files).delete()
+        DirectoryStatistic.objects.filter(
+            directory_name__in=self.removed_dirs).delete()
+
+    def save_manifest(self, writer: Optional[BulkWriter] = None):
+        """
+        Records new state of the changed files into manifest.
+        :param writer: Writer to add the rows to, rows are saved
+        immediately if it is not given.
+        """
+        for path, (size, modified, content_hash) in {
+                **self.changed_files, **self.touched_files}.items():
+            defaults = {"size": size,
+                        "modified": modified,
+                        "content_hash": content_hash}
+            if writer is not None:
+                writer.add(FileManifest(path=path, **defaults))
+            else:
+                FileManifest.objects.update_or_create(path=path,
+                                                      defaults=defaults)
+
+
+def plan_scan(base_path: str, folders: Iterable, mode: str = "exact",
+              file_stats: Optional[Dict[str, Tuple[int, float]]] = None
+              ) -> ScanPlan:
+    """
+    Compares files from the walker with the manifest and finds files which
+    should be analyzed again and folders which statistic should be
+    recalculated.
+    :param str base_path: Path of the top folder.
+    :param folders: Paths of folders, their sub-folders and files.
+    :param str mode: Word frequency mode of the scan, folders saved
+    in the other mode are recalculated.
+    :param file_stats: Sizes and modification times of the files found by
+    the walker, other files are stat'ed here.
+    :rtype: ScanPlan
+    """
+    plan = ScanPlan(base_path)
+    hash_content = getattr(settings, 'SCAN_HASH_CONTENT', False)
+
+    manifest = {
+        path: (size, modified, content_hash)
+        for path, size, modified, content_hash in
+        FileManifest.objects.filter(inside_folder("path", base_path))
+        .values_list("path", "size", "modified", "content_hash")}
+    old_modes = dict(DirectoryStatistic.objects.filter(
+        inside_folder("directory_name", base_path))
+        .values_list("directory_name", "word_frequency_mode"))
+    old_dirs = set(old_modes)
+    stored_dirs = set(DirectoryStatistic.objects.filter(
+        inside_folder("directory_name", base_path),
+        partial_statistic__isnull=False).values_list("directory_name",
+                                                     flat=True))
+
+    found_files = set()
+    found_dirs = set()
+    listings = []
+    for path, sub_folders, files in folders:
+        found_dirs.add(path)
+        listings.append((path, sub_folders, files))
+        for file in files:
+            filename = os.path.join(path, file)
+            found_files.add(filename)
+
+            if file_stats is not None and filename in file_stats:
+                size, modified = file_stats[filename]
+            else:
+                file_stat = os.stat(filename)
+                size, modified = file_stat.st_size, file_stat.st_mtime
+            plan.file_sizes[filename] = size
+            old_size, old_modified, old_hash = manifest.get(
+                filename, (None, None, ""))
+            if old_size == size and old_modified == modified:
+                continue
+
+            content_hash = get_content_hash(filename) if hash_content else ""
+            if old_size == size and content_hash and \
+                    content_hash == old_hash:
+                plan.touched_files[filename] = (size, modified, content_hash)
+            else:
+                plan.changed_files[filename] = (size, modified, content_hash)
+
+    plan.restorable_files = set(FileStatistic.objects.filter(
+        inside_folder("file", base_path), partial_statistic__isnull=False)
+        .values_list("file", flat=True)) - set(plan.changed_files)
+
+    plan.removed_files = set(manifest) - found_files
+    plan.removed_dirs = old_dirs - found_dirs
+    new_dirs = found_dirs - old_dirs
+
+    other_mode_dirs = {path for path, old_mode in old_modes.items()
+                       if old_mode != mode} & found_dirs
+
+    plan.dirty_dirs.update(new_dirs | other_mode_dirs)
+    for path in (*plan.changed_files, *plan.removed_files,
+                 *plan.removed_dirs, *new_dirs, *other_mode_dirs):
+        plan.dirty_dirs.update(get_ancestors(path, base_path))
+    plan.dirty_dirs -= plan.removed_dirs
+
+    # Folders go bottom-up, so sub-folders are checked before the folder.
+    reusable = set()
+    for path, sub_folders, files in listings:
+        if path in stored_dirs and path not in plan.dirty_dirs and \
+                all(os.path.join(path, name) in reusable
+                    for name in sub_folders) and \
+                not any(plan.needs_analysis(os.path.join(path, file))
+                        for file in files):
+            reusable.add(path)
+    plan.reused_dirs = {path for path in reusable
+                        if path == base_path or
+                        os.path.dirname(path) not in reusable}
+    return plan
@@ -0,0 +1,415 @@
+import bisect
+import cProfile
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from background_parser.hyphenation import get_hyphenation_cache
+from background_parser.models import MetricsSnapshot
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+# Buckets of the histograms in seconds.
+FILE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+SCAN_BUCKETS = (0.01, 0.1, 1, 10, 60, 300, 1800, 3600)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...],
+                  extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class CounterMetric:
+    """
+    Value which only increases, by label values.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """
+        Sets the total which is counted elsewhere, e.g. by a cache.
+        """
+        with self.lock:
+            self.values[self.get_key(labels)] = value
+
+    def get_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def get_state(self) -> Dict:
+        with self.lock:
+            return {"type": self.type, "help": self.documentation,
+                    "labels": list(self.labels),
+                    "values": [[list(k), v] for k, v in self.values.items()]}
+
+    def merge_state(self, state: Dict):
+        with self.lock:
+            for key, value in state["values"]:
+                key = tuple(key)
+                self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> Iterator[str]:
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                yield f"{self.name}{format_labels(self.labels, key)} " \
+                      f"{format_value(value)}"
+
+
+class HistogramMetric(CounterMetric):
+    """
+    Distribution of observed values by buckets, by label values.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = FILE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Counts of the buckets (the last one is +Inf), sum and count.
+        self.values: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.get_key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(
+                key, ([0] * (len(self.buckets) + 1), 0, 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get_state(self) -> Dict:
+        state = super().get_state()
+        state["buckets"] = list(self.buckets)
+        return state
+
+    def merge_state(self, state: Dict):
+        if tuple(state["buckets"]) != self.buckets:
+            # Buckets were changed, the old distribution is dropped.
+            return
+        with self.lock:
+            for key, (counts, total, count) in state["values"]:
+                key = tuple(key)
+                old_counts, old_total, old_count = self.values.get(
+                    key, ([0] * len(counts), 0, 0))
+                self.values[key] = (
+                    [a + b for a, b in zip(old_counts, counts)],
+                    old_total + total, old_count + count)
+
+    def render(self) -> Iterator[str]:
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, amount in zip(self.buckets + (float("inf"),),
+                                         counts):
+                    cumulative += amount
+                    labels = format_labels(
+                        self.labels, key, f'le="{format_value(bound)}"')
+                    yield f"{self.name}_bucket{labels} {cumulative}"
+                labels = format_labels(self.labels, key)
+                yield f"{self.name}_sum{labels} {format_value(total)}"
+                yield f"{self.name}_count{labels} {count}"
+
+
+METRIC_TYPES = {
+    "counter": CounterMetric,
+    "histogram": HistogramMetric,
+}
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process. Their state can be saved and merged into
+    metrics of another process, see save_metrics.
+    """
+    def __init__(self):
+        self.metrics: Dict[str, CounterMetric] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str,
+                labels: Tuple[str, ...] = ()) -> CounterMetric:
+        return self.metrics.setdefault(
+            name, CounterMetric(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str,
+                  labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = FILE_BUCKETS) -> \
+            HistogramMetric:
+        return self.metrics.setdefault(
+            name, HistogramMetric(name, documentation, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """
+        Adds function which updates metrics counted elsewhere before
+        the metrics are rendered.
+        """
+        self.collectors.append(collector)
+
+    def collect(self):
+        for collector in self.collectors:
+            collector()
+
+    def get_state(self) -> Dict:
+        return {name: metric.get_state()
+                for name, metric in self.metrics.items()}
+
+    def merge_state(self, state: Dict):
+        for name, metric_state in state.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = METRIC_TYPES[metric_state["type"]](
+                    name, metric_state["help"],
+                    tuple(metric_state["labels"]),
+                    *([tuple(metric_state["buckets"])]
+                      if "buckets" in metric_state else []))
+                self.metrics[name] = metric
+            if metric.type == metric_state["type"] and \
+                    metric.labels == tuple(metric_state["labels"]):
+                metric.merge_state(metric_state)
+
+    def render(self) -> str:
+        """
+        Returns the metrics in Prometheus text format.
+        :rtype: str
+        """
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+FILE_STAGE_SECONDS = REGISTRY.histogram(
+    "scan_file_stage_seconds",
+    "Seconds spent on a stage of analysis of one file: extract, parse, "
+    "hyphenate, merge or save.",
+    ("stage", "extension"))
+FILES = REGISTRY.counter(
+    "scan_files_total", "Analyzed files by extraction outcome.",
+    ("extension", "outcome"))
+FILE_BYTES = REGISTRY.counter(
+    "scan_bytes_total", "Size of the analyzed files in bytes.",
+    ("extension",))
+FILE_TOKENS = REGISTRY.counter(
+    "scan_tokens_total", "Words found in the analyzed files.",
+    ("extension",))
+SCAN_STAGE_SECONDS = REGISTRY.histogram(
+    "scan_stage_seconds",
+    "Seconds spent on a stage of a scan: walk, plan, analyze.",
+    ("stage",), SCAN_BUCKETS)
+SCAN_TASK_SECONDS = REGISTRY.histogram(
+    "scan_task_seconds", "Seconds of background tasks of the scans.",
+    ("task",), SCAN_BUCKETS)
+DATABASE_FLUSH_SECONDS = REGISTRY.histogram(
+    "database_flush_seconds", "Seconds of one batch write of the rows.",
+    ("model",))
+DATABASE_ROWS = REGISTRY.counter(
+    "database_rows_total", "Rows written in batches.", ("model",))
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Lookups in the caches by result.",
+    ("cache", "result"))
+
+
+def get_cache_counters() -> Dict[str, Tuple[int, int]]:
+    """
+    Returns hits and misses of the caches used while files are parsed.
+    :rtype: dict
+    """
+    # The extraction cache imports the writers, which are measured here.
+    from background_parser.extraction_cache import get_extraction_cache
+
+    hyphenation = get_hyphenation_cache()
+    extraction = get_extraction_cache().counters
+    return {
+        "hyphenation": (hyphenation.hits, hyphenation.misses),
+        "extraction": (extraction["hits"], extraction["misses"]),
+    }
+
+
+class FileMeasurement:
+    """
+    Measures what parsing of one file costs. It is measured where the file
+    is parsed, possibly in a worker process, and recorded by record_file
+    in the process which runs the scan.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counters = get_cache_counters()
+        self.hyphenation_seconds = get_hyphenation_cache().seconds
+
+    def get_metrics(self, content, tokens: int) -> Dict:
+        """
+        Returns metrics of the parsed file.
+        :param content: opener.Content of the file which was read.
+        :param int tokens: Number of words in the file.
+        :rtype: dict
+        """
+        seconds = time.perf_counter() - self.started
+        hyphenation_seconds = \
+            get_hyphenation_cache().seconds - self.hyphenation_seconds
+        try:
+            size = os.path.getsize(content.filename)
+        except OSError:
+            size = 0
+        return {
+            "extension": os.path.splitext(content.filename)[-1],
+            "outcome": content.outcome,
+            "bytes": size,
+            "tokens": tokens,
+            "stages": {
+                "extract": content.seconds,
+                "hyphenate": hyphenation_seconds,
+                "parse": max(
+                    seconds - content.seconds - hyphenation_seconds, 0),
+            },
+            "caches": {
+                name: [a - b for a, b in zip(value, self.counters[name])]
+                for name, value in get_cache_counters().items()},
+        }
+
+
+def record_file(metrics: Optional[Dict]):
+    """
+    Records metrics of the parsed file from FileMeasurement.
+    """
+    if metrics is None:
+        return
+    extension = metrics["extension"]
+    FILES.inc(extension=extension, outcome=metrics["outcome"])
+    FILE_BYTES.inc(metrics["bytes"], extension=extension)
+    FILE_TOKENS.inc(metrics["tokens"], extension=extension)
+    for stage, seconds in metrics["stages"].items():
+        FILE_STAGE_SECONDS.observe(seconds, stage=stage, extension=extension)
+    for cache, (hits, misses) in metrics["caches"].items():
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+def get_process_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+@contextmanager
+def profile(name: str):
+    """
+    Profiles the code by cProfile and dumps the statistic into
+    SCAN_PROFILE_DIR, if it is set. Worker processes of the scan are not
+    profiled.
+    :param str name: Beginning of the name of the dump.
+    """
+    directory = getattr(settings, 'SCAN_PROFILE_DIR', None)
+    if not directory:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, "{}-{}-{}.prof".format(
+            name, time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+        profiler.dump_stats(filename)
+        logging.getLogger(__name__).info("Profile is saved to %s", filename)
+
+
+@contextmanager
+def instrument_task(task: str, name: str):
+    """
+    Measures background task of a scan, profiles it if it is enabled and
+    saves metrics of the process afterwards.
+    :param str task: Name of the task in the metrics.
+    :param str name: Name of the profile dump.
+    """
+    try:
+        with SCAN_TASK_SECONDS.time(task=task), profile(name):
+            yield
+    finally:
+        save_metrics()
+
+
+def save_metrics():
+    """
+    Saves metrics of this process to the database, so the API can serve
+    metrics of the background workers. Snapshots which were not updated
+    for METRICS_SNAPSHOT_MAX_AGE seconds are deleted.
+    """
+    try:
+        MetricsSnapshot.objects.update_or_create(
+            process=get_process_name(),
+            defaults={"metrics": REGISTRY.get_state()})
+        MetricsSnapshot.objects.filter(
+            updated__lt=timezone.now() - timedelta(seconds=getattr(
+                settings, 'METRICS_SNAPSHOT_MAX_AGE', 7 * 24 * 3600))
+        ).delete()
+    except DatabaseError as error:
+        logging.getLogger(__name__).warning("Can not save metrics: %s",
+                                            error)
+
+
+def collect_hyphenation_cache():
+    cache = get_hyphenation_cache()
+    CACHE_REQUESTS.set(cache.hits, cache="hyphenation", result="hit")
+    CACHE_REQUESTS.set(cache.misses, cache="hyphenation", result="miss")
+
+
+REGISTRY.add_collector(collect_hyphenation_cache)
+
+
+def render_metrics() -> str:
+    """
+    Returns metrics of this process merged with the saved metrics of
+    the other processes in Prometheus text format.
+    :rtype: str
+    """
+    REGISTRY.collect()
+    registry = MetricsRegistry()
+    registry.merge_state(REGISTRY.get_state())
+    for state in MetricsSnapshot.objects.exclude(
+            process=get_process_name()).values_list("metrics", flat=True):
+        registry.merge_state(state)
+    return registry.render()
@@ -7,8 +7,7 @@ class DirectoryStatistic(models.Model):
     slug = models.SlugField(primary_key=True,
                             default="default",
                             max_length=100)
-    directory_name = models.CharField(max_length=100)
-    files_and_dirs = models.JSONField()
+    directory_name = models.CharField(max_length=100, db_index=True)
     number_of_files = models.IntegerField()
     most_recent_word = models.CharField(max_length=100)
     least_recent_word = models.CharField(max_length=100)
@@ -16,16 +15,186 @@ class DirectoryStatistic(models.Model):
     vowels = models.JSONField()
     consonants = models.JSONField()
     syllables = models.JSONField(default=dict)
+    # 'exact' or 'approximate', see aggregators.WORD_FREQUENCY_MODES.
+    word_frequency_mode = models.CharField(max_length=20, default="exact")
+    # Bounds of the counts of the most and least frequent words in
+    # approximate mode.
+    word_frequency_bounds = models.JSONField(default=dict)
+    # Compressed FolderStatisticAggregator.get_state, unchanged folders
+    # are merged into their parents from it by incremental scans.
+    partial_statistic = models.BinaryField(null=True)
 
 
 class FileStatistic(models.Model):
     slug = models.SlugField(primary_key=True,
                             default="default",
                             max_length=100)
-    file = models.CharField(max_length=100)
+    file = models.CharField(max_length=100, db_index=True)
     most_recent_word = models.CharField(max_length=1000)
     least_recent_word = models.CharField(max_length=1000)
     average_word_length = models.FloatField()
     vowels = models.JSONField()
     consonants = models.JSONField()
     syllables = models.JSONField(default=dict)
+    # How the text of the file was extracted: 'ok', 'timeout', 'too-large'
+    # or 'failed'.
+    extraction_outcome = models.CharField(max_length=20, default="ok")
+    # Compressed word counters and totals of the file, see
+    # FileAnalyzer.get_partial_statistic.
+    partial_statistic = models.BinaryField(null=True)
+
+
+class FileManifest(models.Model):
+    """
+    What was known about the file when it was analyzed last time.
+    """
+    path = models.CharField(primary_key=True, max_length=1000)
+    size = models.BigIntegerField()
+    modified = models.FloatField()
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+
+class PathNode(models.Model):
+    """
+    File or folder of the analyzed trees. Every path is stored once,
+    recursive listings of folders are taken from here on demand.
+    """
+    path = models.CharField(max_length=1000, unique=True)
+    parent = models.ForeignKey("self", null=True, on_delete=models.CASCADE,
+                               related_name="children")
+    is_dir = models.BooleanField()
+
+
+class ScanJob(models.Model):
+    """
+    Scan of a folder requested through the API and its progress.
+    """
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    IN_FLIGHT = [QUEUED, RUNNING]
+
+    directory = models.CharField(max_length=1000)
+    extensions = models.JSONField(default=list)
+    mode = models.CharField(max_length=20, default="exact")
+    # Identical requests have the same key, see jobs.get_job_key.
+    key = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, default=QUEUED)
+    cancel_requested = models.BooleanField(default=False)
+    files_total = models.IntegerField(default=0)
+    files_done = models.IntegerField(default=0)
+    bytes_total = models.BigIntegerField(default=0)
+    bytes_done = models.BigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    updated = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["key"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="unique_in_flight_scan_job"),
+        ]
+
+
+class ShardedScan(models.Model):
+    """
+    Scan split into shards of sub-trees analyzed by separate tasks, see
+    sharding.py. The folders above the shards are analyzed and merged
+    with statistic of the shards when all shards are done.
+    """
+    base_path = models.CharField(max_length=1000)
+    mode = models.CharField(max_length=20, default="exact")
+    job = models.ForeignKey(ScanJob, null=True, on_delete=models.SET_NULL)
+    # Folders above the shards and roots of the shards in the order of
+    # the walker, and ScanPlan.to_dict of the folders above the shards.
+    folders = models.JSONField(default=list)
+    plan = models.JSONField(default=dict)
+    merge_queued = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class ScanShard(models.Model):
+    """
+    Sub-trees of the sharded scan analyzed by one task.
+    """
+    scan = models.ForeignKey(ShardedScan, on_delete=models.CASCADE,
+                             related_name="shards")
+    # Folders of every sub-tree from the walker by roots of the sub-trees
+    # and ScanPlan.to_dict of the files and folders of the sub-trees.
+    folders = models.JSONField(default=dict)
+    plan = models.JSONField(default=dict)
+    size = models.BigIntegerField(default=0)
+    done = models.BooleanField(default=False)
+    # Compressed FolderStatisticAggregator.get_state of the roots.
+    partial_statistic = models.BinaryField(null=True)
+
+
+class ScanGeneration(models.Model):
+    """
+    Counter which is increased every time a scan has written statistic,
+    responses of the API are cached until it changes, see generation.py.
+    The only row has id 1.
+    """
+    value = models.BigIntegerField(default=0)
+    updated = models.DateTimeField()
+
+
+class MetricsSnapshot(models.Model):
+    """
+    Metrics of a background process saved after every task, the API
+    serves them merged with its own, see metrics.py.
+    """
+    # Host name and id of the process.
+    process = models.CharField(primary_key=True, max_length=300)
+    metrics = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class IndexSegment(models.Model):
+    """
+    Postings of the words of files indexed together, see word_index.py.
+    Segments are merged when there are too many of them.
+    """
+    # Number of the files indexed in the segment.
+    files = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+
+class WordPostings(models.Model):
+    """
+    Files of the segment which contain the word and counts of the word in
+    them.
+    """
+    word = models.CharField(max_length=1000, db_index=True)
+    segment = models.ForeignKey(IndexSegment, on_delete=models.CASCADE,
+                                related_name="postings")
+    files = models.IntegerField()
+    # Compressed ids of PathNodes of the files and the counts, see
+    # word_index.encode_postings.
+    postings = models.BinaryField()
+
+
+class IndexedFile(models.Model):
+    """
+    Segment which holds the current postings of the file.
+    """
+    path = models.CharField(primary_key=True, max_length=1000)
+    node_id = models.BigIntegerField()
+    segment = models.ForeignKey(IndexSegment, on_delete=models.CASCADE,
+                                related_name="indexed_files")
+
+
+class IndexTombstone(models.Model):
+    """
+    Postings of the file in the segment which are stale: the file was
+    indexed again or removed. They are dropped when the segment is merged.
+    """
+    segment = models.ForeignKey(IndexSegment, on_delete=models.CASCADE,
+                                related_name="tombstones")
+    node_id = models.BigIntegerField()
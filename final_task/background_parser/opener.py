@@ -1,18 +1,180 @@
+import codecs
+import logging
+import mmap
 import os
+import time
+from functools import partial
+from typing import Callable, Dict, Iterator, List
 
 import textract
+from background_parser.extraction_cache import get_extraction_cache
+from background_parser.extraction_pool import (FAILED, OK, ExtractionError,
+                                               check_size, extract_isolated)
+from background_parser.extractors import (iter_docx_text, iter_epub_text,
+                                          iter_html_text, iter_odt_text)
+from django.conf import settings
 
+PLAIN_TEXT_EXTENSIONS = [".txt", ".py"]
 
-def get_content(filename: str):
+# Size of the beginning of the file which is used to guess encoding.
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+
+def get_chunk_size() -> int:
+    """
+    Returns size of the chunks in bytes the files are read by.
+    """
+    return getattr(settings, 'OPENER_CHUNK_SIZE', 1024 * 1024)
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Guesses encoding of the text by its beginning: UTF-8 if it can
+    be decoded as UTF-8, CP1251 otherwise.
+    :param bytes sample: Beginning of the text.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return "cp1251"
+    return "utf-8"
+
+
+def decode_chunks(data, encoding: str, chunk_size: int) -> Iterator[str]:
+    """
+    Decodes bytes-like object piece by piece.
+    :param data: Bytes-like object, e.g. bytes or mmap.
+    :param str encoding: Encoding of the data.
+    :param int chunk_size: Size of the decoded pieces in bytes.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    for start in range(0, len(data), chunk_size):
+        text = decoder.decode(data[start:start + chunk_size])
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def read_text_file(filename: str) -> Iterator[str]:
+    """
+    Reads plain text file by chunks through memory map.
+    :param str filename: name of the file to open.
+    """
+    with open(filename, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            encoding = detect_encoding(data[:ENCODING_SAMPLE_SIZE])
+            yield from decode_chunks(data, encoding, get_chunk_size())
+
+
+def read_html_file(filename: str) -> Iterator[str]:
+    """
+    Reads visible text of HTML page.
+    :param str filename: name of the file to open.
+    """
+    return iter_html_text(read_text_file(filename))
+
+
+def extract_with_textract(filename: str) -> bytes:
+    """
+    Extracts text by textract in isolated worker process, because textract
+    runs external programs which can hang or take a lot of memory.
+    """
+    return extract_isolated(filename, textract.process)
+
+
+def read_with_textract(filename: str) -> Iterator[str]:
+    """
+    Extracts text by textract. Extracted text is cached.
+    :param str filename: name of the file to open.
+    """
+    text = get_extraction_cache().get_text(filename, extract_with_textract)
+    return decode_chunks(text, "utf-8", get_chunk_size())
+
+
+def read_document(reader: Callable[[str], Iterator[str]],
+                  filename: str) -> Iterator[str]:
+    """
+    Reads the document by in-process extractor if it is not too large.
+    """
+    check_size(filename)
+    return reader(filename)
+
+
+class Content:
+    """
+    Chunks of the text of the file. A file which can not be read gives
+    no more text instead of stopping the whole scan, outcome of
+    the extraction is known after the chunks are read: 'ok', 'timeout',
+    'too-large' or 'failed'. Time spent on reading and extraction is
+    counted in `seconds`.
+    """
+    def __init__(self, filename: str,
+                 reader: Callable[[str], Iterator[str]]):
+        self.filename = filename
+        self.outcome = OK
+        self.seconds = 0.0
+        self.__reader = reader
+
+    def __iter__(self) -> Iterator[str]:
+        chunks = self.__read()
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            self.seconds += time.perf_counter() - started
+            if chunk is None:
+                return
+            yield chunk
+
+    def __read(self) -> Iterator[str]:
+        try:
+            yield from self.__reader(self.filename)
+        except ExtractionError as error:
+            self.__fail(error.outcome, error)
+        except Exception as error:
+            self.__fail(FAILED, error)
+
+    def __fail(self, outcome: str, error: Exception):
+        self.outcome = outcome
+        logging.getLogger(__name__).warning(
+            "Can not extract text of %s (%s): %s",
+            self.filename, outcome, error)
+
+
+# Functions which read text of the files by extensions of the files.
+READERS: Dict[str, Callable[[str], Iterator[str]]] = {
+    **dict.fromkeys(PLAIN_TEXT_EXTENSIONS, read_text_file),
+    ".html": read_html_file,
+    ".htm": read_html_file,
+    ".docx": iter_docx_text,
+    ".odt": iter_odt_text,
+    ".epub": iter_epub_text,
+    **dict.fromkeys([".csv", ".doc", ".eml", ".json", ".pdf", ".xlsx",
+                     ".xls", ".rtf"], read_with_textract),
+}
+
+
+def get_supported_extensions() -> List[str]:
+    """
+    Returns extensions of the files which text can be read.
+    """
+    return list(READERS)
+
+
+def get_content(filename: str) -> Content:
     """
     Chooses which open function to use on the criteria of extension.
+    Files with unknown extensions are given to textract.
     :param str filename: name of the file to open.
+    :return: iterable of the chunks of the text.
     """
     extension = os.path.splitext(filename)[-1]
-    if extension in [".txt", ".py"]:
-        return open(filename).read()
-    else:
-        try:
-            return textract.process(filename).decode("utf-8")
-        except Exception:
-            return ""
+    reader = READERS.get(extension, read_with_textract)
+    if reader not in (read_text_file, read_with_textract):
+        reader = partial(read_document, reader)
+    return Content(filename, reader)
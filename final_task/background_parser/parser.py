@@ -1,15 +1,38 @@
 import re
 import string
 from collections import Counter
+from functools import lru_cache
 from itertools import chain
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
-import pyphen
+from background_parser.hyphenation import get_hyphenation_cache
+from background_parser.letter_statistics import VectorizedLetterCounter
+from django.conf import settings
 
+WORD_PATTERN = re.compile('[a-zа-яё]+')
+ENGLISH_LETTERS = frozenset(string.ascii_lowercase)
+LETTERS = frozenset(string.ascii_lowercase +
+                    'абвгдеёжзийклмнопрстуфхцчшщъыьэюя')
 
-def tokenize(file_content):
+# 'İ' is the only symbol whose lowercase form is longer than one symbol
+# ('i' + combining dot), chunks with it are left to the reference engine.
+DOTTED_CAPITAL_I = '\u0130'
+
+
+def iter_chunks(file_content) -> Iterator[str]:
     """
-    Filters all the letters from the text and forms them into a words.
+    Returns content of the file as iterator of text chunks.
+    :param file_content: Either a whole text or an iterable of text chunks.
+    """
+    if isinstance(file_content, str):
+        return iter((file_content,))
+    return iter(file_content)
+
+
+def reference_words(file_content) -> Iterator[str]:
+    """
+    Filters all the letters from the text symbol by symbol and forms
+    them into a words. Slow, kept as reference for the chunked engine.
     :param file_content: Content of the file to analyze.
     """
     pattern = re.compile('[a-z]|[а-яё]')
@@ -20,25 +43,97 @@ def tokenize(file_content):
                 word_buffer += symbol.lower()
             else:
                 if word_buffer:
-                    yield WordToken(value=word_buffer.lower(),
-                                    counted_letters=len(word_buffer))
+                    yield word_buffer.lower()
                     word_buffer = ''
     if word_buffer != '':
-        yield WordToken(value=word_buffer.lower(),
-                        counted_letters=len(word_buffer))
+        yield word_buffer.lower()
+
+
+def chunked_words(file_content) -> Iterator[str]:
+    """
+    Lowercases the text chunk by chunk and extracts words with one regex
+    pass per chunk. Words split by a chunk boundary are glued back.
+    :param file_content: Content of the file to analyze.
+    """
+    tail = ''
+    for chunk in iter_chunks(file_content):
+        if not chunk:
+            continue
+
+        if DOTTED_CAPITAL_I in chunk:
+            words = list(reference_words(chunk))
+            first, last = chunk[0].lower()[0], chunk[-1].lower()[0]
+        else:
+            chunk = chunk.lower()
+            words = WORD_PATTERN.findall(chunk)
+            first, last = chunk[0], chunk[-1]
+
+        if tail:
+            if first in LETTERS:
+                words[0] = tail + words[0]
+            else:
+                yield tail
+            tail = ''
+
+        if last in LETTERS:
+            tail = words.pop()
+
+        yield from words
+
+    if tail:
+        yield tail
+
+
+TOKENIZERS = {
+    'chunked': chunked_words,
+    'reference': reference_words,
+}
+
+
+def iter_words(file_content, engine: Optional[str] = None) -> Iterator[str]:
+    """
+    Returns lowercased words of the text using chosen tokenizer engine.
+    :param file_content: Content of the file to analyze.
+    :param str engine: Name of the engine, PARSER_TOKENIZER setting
+    is used by default.
+    """
+    engine = engine or getattr(settings, 'PARSER_TOKENIZER', 'chunked')
+    return TOKENIZERS[engine](file_content)
+
+
+def tokenize(file_content, engine: Optional[str] = None):
+    """
+    Filters all the letters from the text and forms them into a words.
+    :param file_content: Content of the file to analyze.
+    :param str engine: Name of the tokenizer engine.
+    """
+    for word in iter_words(file_content, engine):
+        yield WordToken(value=word, counted_letters=len(word))
+
+
+def detect_language(word: str) -> str:
+    """
+    Defines language of the word by its first letter.
+    :return: 'en' or 'ru'.
+    :rtype: str.
+    """
+    return 'en' if word[:1] in ENGLISH_LETTERS else 'ru'
 
 
 class WordToken:
     """
     Class that saves and calculates statistic for word.
     """
-    def __init__(self, value, counted_letters):
+    def __init__(self, value, counted_letters, count_letters=True):
         self.value = value
         self.counted_letters = counted_letters
         self.vowels = Counter()
         self.consonants = Counter()
         self.language = ''
-        self.vowel_or_consonant()
+        if count_letters:
+            self.vowel_or_consonant()
+        else:
+            self.language = detect_language(self.value)
         self.syllables = self.count_syllables()
 
     def vowel_or_consonant(self):
@@ -47,16 +142,14 @@ class WordToken:
         """
         eng_vowels = 'aeiouy'
         rus_vowels = 'аоуэыяеюиё'
-        pattern = re.compile('[a-z]')
-        if pattern.match(self.value):
-            self.language = 'en'
+        self.language = detect_language(self.value)
+        if self.language == 'en':
             for char in self.value:
                 if char in eng_vowels:
                     self.vowels.update(char)
                 else:
                     self.consonants.update(char)
         else:
-            self.language = 'ru'
             for char in self.value:
                 if char in rus_vowels:
                     self.vowels.update(char)
@@ -69,16 +162,29 @@ class WordToken:
         :return: counted syllables dict.
         :rtype: dict.
         """
-        syllables = pyphen.Pyphen(lang=self.language).inserted(self.value)
-        return dict(Counter(syllables.split("-")))
+        return get_hyphenation_cache().get_syllables(self.value,
+                                                     self.language)
+
+
+def update_weighted(counter: Counter, values: dict, weight: int):
+    """
+    Adds values multiplied by weight to the counter.
+    """
+    for key, value in values.items():
+        counter[key] += value * weight
 
 
 class FileParser:
     """
     Aggregates statistics from every word in text and forms statistic for file.
     """
-    def __init__(self, text_from_file):
+    def __init__(self, text_from_file, counting_mode: Optional[str] = None,
+                 letter_engine: Optional[str] = None):
         self.text = text_from_file
+        self.counting_mode = counting_mode or getattr(
+            settings, 'PARSER_COUNTING_MODE', 'distinct')
+        self.letter_engine = letter_engine or getattr(
+            settings, 'PARSER_LETTER_ENGINE', 'python')
         self.full_file_stat, self.counter_of_all_words = \
             self.get_all_file_statistic()
 
@@ -99,7 +205,40 @@ class FileParser:
         }
         en_words = Counter()
         ru_words = Counter()
-        for token in tokenize(self.text):
+
+        text = self.text
+        letter_counter = None
+        if self.letter_engine == 'numpy':
+            letter_counter = VectorizedLetterCounter()
+            text = letter_counter.observe(iter_chunks(self.text))
+
+        if self.counting_mode == 'per_token':
+            self.count_every_token(text, file_stat_dict, en_words, ru_words)
+        else:
+            self.count_distinct_words(text, file_stat_dict, en_words,
+                                      ru_words)
+
+        if letter_counter is not None:
+            file_stat_dict["vowels"] = Counter(letter_counter.vowels())
+            file_stat_dict["consonants"] = Counter(
+                letter_counter.consonants())
+
+        total_number_of_words = sum(en_words.values()) + sum(ru_words.values())
+        file_stat_dict["average_word_length"] = (
+                file_stat_dict['average_word_length'] /
+                total_number_of_words) if total_number_of_words else 0
+
+        return file_stat_dict, [ru_words, en_words]
+
+    def count_every_token(self, text, file_stat_dict: dict,
+                          en_words: Counter, ru_words: Counter):
+        """
+        Builds WordToken for every word in the text and adds it to
+        the file statistic.
+        """
+        for word in iter_words(text):
+            token = WordToken(value=word, counted_letters=len(word),
+                              count_letters=self.letter_engine == 'python')
             file_stat_dict["average_word_length"] += token.counted_letters
             file_stat_dict["vowels"].update(token.vowels)
             file_stat_dict['consonants'].update(token.consonants)
@@ -109,12 +248,27 @@ class FileParser:
             if token.language == 'ru':
                 ru_words.update([token.value])
 
-        total_number_of_words = sum(en_words.values()) + sum(ru_words.values())
-        file_stat_dict["average_word_length"] = (
-                file_stat_dict['average_word_length'] /
-                total_number_of_words) if total_number_of_words else 0
-
-        return file_stat_dict, [ru_words, en_words]
+    def count_distinct_words(self, text, file_stat_dict: dict,
+                             en_words: Counter, ru_words: Counter):
+        """
+        Counts every distinct word in the text first, then builds WordToken
+        only once per distinct word and adds its statistic weighted
+        by the word frequency.
+        """
+        for word, frequency in Counter(iter_words(text)).items():
+            token = WordToken(value=word, counted_letters=len(word),
+                              count_letters=self.letter_engine == 'python')
+            file_stat_dict["average_word_length"] += \
+                token.counted_letters * frequency
+            update_weighted(file_stat_dict["vowels"], token.vowels, frequency)
+            update_weighted(file_stat_dict['consonants'], token.consonants,
+                            frequency)
+            update_weighted(file_stat_dict['syllables'], token.syllables,
+                            frequency)
+            if token.language == 'en':
+                en_words[word] = frequency
+            if token.language == 'ru':
+                ru_words[word] = frequency
 
     def get_most_and_least_common_words(self):
         """
@@ -217,8 +371,8 @@ class WordStatistic:
         :return: dict of syllables statistics.
         :rtype: dict
         """
-        syllables = pyphen.Pyphen(lang=self.language).inserted(self.word)
-        return dict(Counter(syllables.split("-")))
+        return get_hyphenation_cache().get_syllables(self.word,
+                                                     self.language)
 
     def return_all_statistic_for_word(self) -> dict:
         """
@@ -226,10 +380,34 @@ class WordStatistic:
         :return: dict of all words statistic.
         :rtype: dict
         """
+        vowels, consonants = self.get_vowels_and_consonants()
         return {
             'word': self.word,
             'number_of_letters': self.get_word_length(),
-            'vowels': self.get_vowels_and_consonants()[0],
-            'consonants': self.get_vowels_and_consonants()[1],
+            'vowels': vowels,
+            'consonants': consonants,
             'syllables': self.get_syllables_stat()
         }
+
+
+@lru_cache(maxsize=None)
+def get_word_statistic_cache() -> Callable[[str], dict]:
+    """
+    Returns memoized calculation of statistic of lowercased word, it is
+    created once per process with WORD_STATISTIC_CACHE_SIZE entries.
+    """
+    @lru_cache(maxsize=getattr(settings, 'WORD_STATISTIC_CACHE_SIZE',
+                               100000))
+    def calculate(word: str) -> dict:
+        return WordStatistic(word).return_all_statistic_for_word()
+    return calculate
+
+
+def get_word_statistic(word: str) -> dict:
+    """
+    Returns statistic of the word, every word is calculated once.
+    The result is shared between calls and must not be changed.
+    :param str word: Valid word, see WordStatistic.validate_word.
+    :rtype: dict
+    """
+    return get_word_statistic_cache()(word.lower())
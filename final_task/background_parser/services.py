@@ -1,80 +1,481 @@
+import json
 import logging
 import os
-from typing import Dict, List
+import zlib
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set
 
 from background_parser.aggregators import (FilesStatisticAggregator,
                                            FolderStatisticAggregator)
-from background_parser.file_analyzer import FileAnalyzer
-from background_parser.models import DirectoryStatistic, FileStatistic
+from background_parser.extraction_cache import get_extraction_cache
+from background_parser.extraction_pool import (get_fork_context,
+                                               prepare_semaphores)
+from background_parser.file_analyzer import FileAnalyzer, calculate_file_stat
+from background_parser.generation import bump_generation
+from background_parser.hyphenation import get_hyphenation_cache
+from background_parser.jobs import ScanProgress, get_task_name
+from background_parser.manifest import (ScanPlan, get_ancestors, inside_folder,
+                                        plan_scan)
+from background_parser.metrics import (SCAN_STAGE_SECONDS, instrument_task,
+                                       record_file)
+from background_parser.models import (DirectoryStatistic, FileStatistic,
+                                      ScanShard, ShardedScan)
+from background_parser.sharding import get_subtree_roots, split_scan
+from background_parser.tree_index import sync_tree_index
+from background_parser.vocabulary import Vocabulary
 from background_parser.walker import get_walker
+from background_parser.word_index import (compact_word_index, index_files,
+                                          unindex_files)
+from background_parser.writers import BulkWriter
 from background_task import background
+from django.conf import settings
+from django.db import connections, transaction
 
+# Number of files which partial statistic is loaded by one query.
+RESTORE_BATCH_SIZE = 500
 
-def check_difference_in_structure(folder: str, extensions: List[str]):
+
+def get_scan_executor() -> Optional[Executor]:
     """
-    Returns True if there is a change in directory structure.
-    :param str folder: Folder path.
-    :param str extensions: File path.
-    :return: True if there is any change in directory structure.
-    :rtype: bool
+    Returns process pool to calculate statistic of files in parallel,
+    None if files should be calculated one by one in this process.
     """
-    old_files = set([f['file'] for f in list(
-        FileStatistic.objects.values("file"))])
-    old_dirs = set([f['directory_name'] for f in list(
-        DirectoryStatistic.objects.values("directory_name"))])
+    workers = getattr(settings, 'SCAN_WORKERS', 1)
+    if workers <= 1:
+        return None
+
+    # Workers are forked whatever the default start method is. Database
+    # connections must not be shared with them, limits of extraction must.
+    connections.close_all()
+    try:
+        context = get_fork_context()
+        prepare_semaphores()
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    except (OSError, NotImplementedError, ValueError):
+        logging.getLogger(__name__).warning(
+            "Process pool is not available, files are analyzed serially")
+        return None
 
-    new_files = set()
-    new_dirs = set()
 
-    for path, folders, files in get_walker(folder, extensions):
-        new_files.update([os.path.join(path, f) for f in files])
-        new_dirs.update([os.path.join(path, d) for d in folders])
-    new_dirs.update(".")
-    return new_files != old_files or new_dirs != old_dirs
+def restore_files(filenames: List[str]) -> Dict[str, FileAnalyzer]:
+    """
+    Restores analyzers of the files from their stored partial statistic.
+    :param List filenames: Paths of the files.
+    :return: restored analyzers by paths of the files.
+    :rtype: dict
+    """
+    restored = {}
+    for start in range(0, len(filenames), RESTORE_BATCH_SIZE):
+        restored.update({
+            filename: FileAnalyzer.from_partial_statistic(filename,
+                                                          bytes(data))
+            for filename, data in FileStatistic.objects.filter(
+                file__in=filenames[start:start + RESTORE_BATCH_SIZE],
+                partial_statistic__isnull=False
+            ).values_list("file", "partial_statistic")})
+    return restored
+
+
+def restore_folder(path: str, mode: str = "exact",
+                   vocabulary: Optional[Vocabulary] = None
+                   ) -> FolderStatisticAggregator:
+    """
+    Restores statistic of the unchanged folder stored by the previous scan.
+    :param str path: Path of the folder.
+    :param str mode: Word frequency mode, see WORD_FREQUENCY_MODES.
+    :param vocabulary: Vocabulary of the scan the folder is merged in.
+    :rtype: FolderStatisticAggregator
+    """
+    data = DirectoryStatistic.objects.values_list(
+        "partial_statistic", flat=True).get(directory_name=path)
+    return FolderStatisticAggregator.from_partial_statistic(
+        bytes(data), mode, vocabulary)
+
+
+def calculate_folders(folders: List, plan: Optional[ScanPlan] = None,
+                      executor: Optional[Executor] = None,
+                      progress: Optional[ScanProgress] = None) -> Iterator:
+    """
+    Calculates statistic of files of every folder from the walker.
+    Files are sent to the executor in the order of the walker and results
+    are taken back in the same order, so folders are still yielded
+    bottom-up and merged deterministically. Statistic of unchanged files
+    is restored from the database instead.
+    :param folders: Paths of folders, their sub-folders and files.
+    :param plan: Changes found since the previous scan.
+    :param executor: Executor to calculate files in, None to calculate
+    them in this process.
+    :param progress: Progress of the scan job, it is checked for
+    cancellation between files.
+    :return: path, folders, files and calculated FileAnalyzers of the folder.
+    :rtype: iterator
+    """
+    progress = progress or ScanProgress()
+    to_calculate = [
+        FileAnalyzer(filename)
+        for filename in (os.path.join(path, f)
+                         for path, _, files in folders for f in files)
+        if plan is None or plan.needs_analysis(filename)]
+    sizes = plan.file_sizes if plan is not None else {}
+
+    if executor is None:
+        calculated = map(calculate_file_stat, to_calculate)
+    else:
+        calculated = executor.map(
+            calculate_file_stat, to_calculate,
+            chunksize=getattr(settings, 'SCAN_CHUNK_SIZE', 16))
+
+    for path, sub_folders, files in folders:
+        filenames = [os.path.join(path, f) for f in files]
+        restored = restore_files([
+            filename for filename in filenames
+            if plan is not None and not plan.needs_analysis(filename)])
+        analyzers = []
+        for filename in filenames:
+            if filename in restored:
+                analyzers.append(restored[filename])
+                continue
+            progress.check_cancelled()
+            analyzer = next(calculated)
+            record_file(analyzer.metrics)
+            analyzers.append(analyzer)
+            progress.add(1, sizes.get(filename, 0))
+        yield path, sub_folders, files, analyzers
 
 
 @background(schedule=1)
 def analyze_folder_and_save_results(
         base_path: str,
-        file_extensions: List[str]):
+        file_extensions: List[str],
+        mode: str = "exact",
+        job_id: Optional[int] = None):
     """
     Analyzes directory with all subdirectories in all criteria.
     Also saves statistics to data base.
     :param List file_extensions:
     :param str base_path:
+    :param str mode: 'exact' to count every word of the folders,
+    'approximate' to keep sketches of constant size.
+    :param job_id: ScanJob to report progress to, it can be cancelled
+    between files.
     :return: folder statistic
     :rtype: FolderStatisticAggregator
     """
-    stats: Dict[str, FolderStatisticAggregator] = {}
+    with instrument_task("analyze_folder", f"scan-{job_id}"), \
+            ScanProgress(job_id) as progress:
+        return scan_folder(base_path, file_extensions, mode, progress)
+
+
+def scan_folder(base_path: str, file_extensions: List[str], mode: str,
+                progress: ScanProgress):
+    """
+    Scans the folder and saves statistic of changed files and folders,
+    see analyze_folder_and_save_results.
+    :param progress: Progress of the scan job.
+    :raises ScanCancelled: if the job of the scan was cancelled.
+    """
     logger = logging.getLogger(__name__)
+    base_path = base_path.rstrip(os.sep) or os.sep
 
-    if not check_difference_in_structure(base_path, file_extensions):
+    folders = []
+    walker = get_walker(base_path, file_extensions)
+    with SCAN_STAGE_SECONDS.time(stage="walk"):
+        for folder in walker:
+            progress.check_cancelled()
+            folders.append(folder)
+    with SCAN_STAGE_SECONDS.time(stage="plan"):
+        plan = plan_scan(base_path, folders, mode, walker.file_stats)
+    if not plan.has_changes():
+        plan.save_manifest()
         logger.info("Nothing has changed in the structure")
         return
 
-    base_folder_stat = None
+    plan.delete_removed()
+    unindex_files(plan.removed_files)
+    sync_tree_index(base_path, folders)
+    folders = plan.prune_reused(folders)
+    to_analyze = [filename for filename in get_filenames(folders)
+                  if plan.needs_analysis(filename)]
+    progress.set_total(len(to_analyze), sum(
+        plan.file_sizes.get(filename, 0) for filename in to_analyze))
 
-    for path, folders, files in get_walker(base_path, file_extensions):
+    split = split_scan(base_path, folders, plan,
+                       getattr(settings, 'SCAN_SHARDS', 1))
+    if split is not None:
+        scan = start_sharded_scan(base_path, mode, folders, plan, *split,
+                                  job_id=progress.job_id)
+        progress.hand_over()
+        bump_generation()
+        logger.info("Scan is split into %s shards", scan.shards.count())
+        return
+    executor = get_scan_executor()
+
+    try:
+        with SCAN_STAGE_SECONDS.time(stage="analyze"), \
+                BulkWriter() as writer:
+            base_folder_stat = merge_folders_statistic(
+                base_path,
+                calculate_folders(folders, plan, executor, progress),
+                plan,
+                writer,
+                mode)
+            plan.save_manifest(writer)
+        index_files(to_analyze)
+        compact_word_index()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        bump_generation()
 
-        # We are iterating bottom-up, it means that if the
-        # folder has sub-folders, their statistic is already
-        # collected and stored under this folder's key.
-        folder_stat = stats.pop(path) if folders else \
-            FolderStatisticAggregator()
+    flush_caches()
+    logger.info("Finished background task!")
+    return base_folder_stat.get_stat()
 
-        # calculate stats for files
-        files_stat = FilesStatisticAggregator(
-            files=[FileAnalyzer(os.path.join(path, f)) for f in files]
-        ).calculate_and_aggregate_statistic()
 
-        # adding files statistic
-        folder_stat.add_files_statistic(files_stat)
-        folder_stat.add_files_and_folders_info(
-            [os.path.join(path, f) for f in files],
-            [os.path.join(path, f) for f in folders]
-        )
+def flush_caches():
+    """
+    Saves hyphenated words to disk and logs usage of the caches.
+    """
+    logger = logging.getLogger(__name__)
+    get_hyphenation_cache().flush()
+    logger.info("Hyphenation cache: %s", get_hyphenation_cache().statistic())
+    logger.info("Extraction cache: %s", get_extraction_cache().statistic())
+
+
+def start_sharded_scan(base_path: str, mode: str, folders: List,
+                       plan: ScanPlan, shard_roots: List[List[str]],
+                       upper: Set[str],
+                       job_id: Optional[int] = None) -> ShardedScan:
+    """
+    Stores the shards of the scan and enqueues a task for every shard.
+    :param str base_path: Path of the top folder.
+    :param str mode: Word frequency mode, see WORD_FREQUENCY_MODES.
+    :param List folders: Paths of folders, their sub-folders and files from
+    the walker.
+    :param plan: Changes found since the previous scan.
+    :param shard_roots: Roots of the sub-trees of every shard, see
+    split_scan.
+    :param upper: Folders above the sub-trees.
+    :param job_id: ScanJob the shards report progress to.
+    :rtype: ShardedScan
+    """
+    roots = {root for shard in shard_roots for root in shard}
+    subtree_roots = get_subtree_roots(folders, roots, upper)
+    subtrees: Dict[str, List] = {root: [] for root in roots}
+    # Roots of the sub-trees stay in the order of the walker without
+    # their content, their statistic is taken from the shards.
+    upper_folders = []
+    for path, sub_folders, files in folders:
+        root = subtree_roots[path]
+        if root is None:
+            upper_folders.append([path, sub_folders, files])
+            continue
+        subtrees[root].append([path, sub_folders, files])
+        if path == root:
+            upper_folders.append([path, [], []])
 
-        folder_stat.save_stat(path)
+    with transaction.atomic():
+        scan = ShardedScan.objects.create(
+            base_path=base_path, mode=mode, job_id=job_id,
+            folders=upper_folders,
+            plan=plan.to_dict(get_filenames(upper_folders), upper))
+        shards = []
+        for shard in shard_roots:
+            shard_folders = [entry for root in shard
+                             for entry in subtrees[root]]
+            filenames = get_filenames(shard_folders)
+            shards.append(ScanShard.objects.create(
+                scan=scan,
+                folders={root: subtrees[root] for root in shard},
+                plan=plan.to_dict(filenames,
+                                  {path for path, _, _ in shard_folders}),
+                size=sum(plan.file_sizes.get(filename, 0)
+                         for filename in filenames
+                         if plan.needs_analysis(filename))))
+
+    for shard in shards:
+        analyze_shard(shard.id, verbose_name=get_task_name(job_id))
+    return scan
+
+
+def get_filenames(folders: Iterable) -> Set[str]:
+    """
+    Returns paths of the files of the folders from the walker.
+    """
+    return {os.path.join(path, f) for path, _, files in folders
+            for f in files}
+
+
+@background(schedule=1)
+def analyze_shard(shard_id: int):
+    """
+    Analyzes sub-trees of the shard and stores their statistic, enqueues
+    the merge when all shards of the scan are done. Failed shard is retried
+    by background_task, other shards are not analyzed again.
+    :param int shard_id: ScanShard to analyze.
+    """
+    shard = ScanShard.objects.select_related("scan").filter(
+        id=shard_id).first()
+    if shard is None or shard.done:
+        return
+    scan = shard.scan
+
+    with instrument_task("analyze_shard", f"shard-{shard_id}"), \
+            ScanProgress(scan.job_id, attach=True, finish=False) as progress:
+        if progress.active:
+            plan = ScanPlan.from_dict(shard.plan)
+            executor = get_scan_executor()
+            statistic = {}
+            # Words of all the sub-trees of the shard share the ids.
+            vocabulary = Vocabulary()
+            try:
+                with BulkWriter() as writer:
+                    for root, folders in shard.folders.items():
+                        statistic[root] = merge_folders_statistic(
+                            root,
+                            calculate_folders([tuple(f) for f in folders],
+                                              plan, executor, progress),
+                            plan,
+                            writer,
+                            scan.mode,
+                            vocabulary=vocabulary).get_state()
+                    plan.save_manifest(writer)
+                index_files([
+                    filename for filename in get_filenames(
+                        f for folders in shard.folders.values()
+                        for f in folders)
+                    if plan.needs_analysis(filename)])
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+                bump_generation()
+            flush_caches()
+
+            ScanShard.objects.filter(id=shard.id).update(
+                done=True, partial_statistic=zlib.compress(
+                    json.dumps(statistic, ensure_ascii=False).encode("utf-8")))
+            # Only the last finished shard enqueues the merge.
+            if not scan.shards.filter(done=False).exists() and \
+                    ShardedScan.objects.filter(
+                        id=scan.id, merge_queued=False
+                    ).update(merge_queued=True):
+                merge_shards(scan.id,
+                             verbose_name=get_task_name(scan.job_id))
+            return
+
+    # The job was cancelled or has failed.
+    scan.delete()
+
+
+@background(schedule=1)
+def merge_shards(scan_id: int):
+    """
+    Analyzes files of the folders above the shards and merges them with
+    statistic of the shards in the order of the walker, so the statistic
+    is the same as of the scan which is not split. Finishes the job of
+    the scan.
+    :param int scan_id: ShardedScan to merge.
+    :return: folder statistic
+    """
+    scan = ShardedScan.objects.filter(id=scan_id).first()
+    if scan is None:
+        return
+
+    with instrument_task("merge_shards", f"merge-{scan_id}"), \
+            ScanProgress(scan.job_id, attach=True) as progress:
+        if progress.active:
+            precomputed = {}
+            vocabulary = Vocabulary()
+            for data in scan.shards.values_list("partial_statistic",
+                                                flat=True):
+                for root, state in json.loads(
+                        zlib.decompress(bytes(data)).decode("utf-8")).items():
+                    precomputed[root] = FolderStatisticAggregator.from_state(
+                        state, scan.mode, vocabulary)
+
+            plan = ScanPlan.from_dict(scan.plan)
+            with BulkWriter() as writer:
+                base_folder_stat = merge_folders_statistic(
+                    scan.base_path,
+                    calculate_folders([tuple(f) for f in scan.folders],
+                                      plan, progress=progress),
+                    plan,
+                    writer,
+                    scan.mode,
+                    precomputed,
+                    vocabulary)
+                plan.save_manifest(writer)
+            index_files([filename for filename in get_filenames(scan.folders)
+                         if plan.needs_analysis(filename)])
+            compact_word_index()
+            bump_generation()
+            flush_caches()
+            scan.delete()
+            logging.getLogger(__name__).info("Finished background task!")
+            return base_folder_stat.get_stat()
+
+    scan.delete()
+
+
+def merge_folders_statistic(
+        base_path: str,
+        calculated_folders: Iterable,
+        plan: Optional[ScanPlan] = None,
+        writer: Optional[BulkWriter] = None,
+        mode: str = "exact",
+        precomputed: Optional[Dict[str, FolderStatisticAggregator]] = None,
+        vocabulary: Optional[Vocabulary] = None
+) -> FolderStatisticAggregator:
+    """
+    Merges statistic of the folders bottom-up and saves it to database.
+    :param str base_path: Path of the top folder.
+    :param calculated_folders: Folders with calculated files
+    from calculate_folders.
+    :param plan: Changes found since the previous scan, only folders
+    affected by them are saved, reused folders are restored from their
+    stored statistic.
+    :param writer: Writer to add rows of the statistic to.
+    :param str mode: Word frequency mode, see WORD_FREQUENCY_MODES.
+    :param precomputed: Statistic of the folders merged and saved by shards
+    of the scan, their content is not merged again.
+    :param vocabulary: Vocabulary the words of the folders are interned
+    in, a new one by default. It lives as long as the scan, so the ids of
+    the words stay small.
+    :return: statistic of the top folder.
+    :rtype: FolderStatisticAggregator
+    """
+    stats: Dict[str, FolderStatisticAggregator] = {}
+    base_folder_stat = None
+    precomputed = precomputed or {}
+    if vocabulary is None:
+        vocabulary = Vocabulary()
+
+    for path, folders, files, analyzers in calculated_folders:
+        if path in precomputed:
+            folder_stat = precomputed[path]
+        elif plan is not None and path in plan.reused_dirs:
+            folder_stat = restore_folder(path, mode, vocabulary)
+        else:
+            # We are iterating bottom-up, it means that if the
+            # folder has sub-folders, their statistic is already
+            # collected and stored under this folder's key.
+            folder_stat = stats.pop(path) if path in stats else \
+                FolderStatisticAggregator(mode, vocabulary)
+
+            # calculate stats for files
+            files_stat = FilesStatisticAggregator(
+                files=analyzers,
+                writer=writer,
+                mode=mode,
+                vocabulary=vocabulary
+            ).calculate_and_aggregate_statistic()
+
+            # adding files statistic
+            folder_stat.add_files_statistic(files_stat)
+            folder_stat.add_number_of_files(len(files))
+
+            if plan is None or path in plan.dirty_dirs:
+                folder_stat.save_stat(path, writer)
         if path == base_path:
             base_folder_stat = folder_stat
 
@@ -88,10 +489,67 @@ def analyze_folder_and_save_results(
             # statistic, FolderStatisticAggregator should be created
             # first.
 
-            stats[parent] = FolderStatisticAggregator()
+            stats[parent] = FolderStatisticAggregator(mode, vocabulary)
 
         # добавляем нашу статистику в статистику родителя
         stats[parent].add_children_folder_stat(folder_stat)
 
-    logger.info("Finished background task!")
-    return base_folder_stat.get_stat()
+    return base_folder_stat
+
+
+def rebuild_folders_statistic(base_path: str, file_extensions: List[str],
+                              mode: str = "exact"):
+    """
+    Recalculates statistic of the folders from stored partial statistic
+    of the files without reading any file.
+    :param str base_path: Path of the top folder.
+    :param List file_extensions: Extensions of the files to take into
+    account.
+    :param str mode: Word frequency mode, see WORD_FREQUENCY_MODES.
+    :return: statistic of the top folder.
+    :rtype: FolderStatisticAggregator
+    """
+    base_path = base_path.rstrip(os.sep) or os.sep
+    files_by_folder: Dict[str, List[str]] = {}
+    for filename in FileStatistic.objects.filter(
+            inside_folder("file", base_path),
+            partial_statistic__isnull=False).values_list("file", flat=True):
+        if os.path.splitext(filename)[-1] in file_extensions:
+            path, file = os.path.split(filename)
+            files_by_folder.setdefault(path, []).append(file)
+
+    dirs = {base_path, *DirectoryStatistic.objects.filter(
+        inside_folder("directory_name", base_path)).values_list(
+        "directory_name", flat=True)}
+    for path in list(files_by_folder) + list(dirs):
+        dirs.update(get_ancestors(path, base_path))
+
+    sub_folders: Dict[str, List[str]] = {}
+    for path in dirs - {base_path}:
+        parent, name = os.path.split(path)
+        sub_folders.setdefault(parent, []).append(name)
+
+    # Deeper folders go first, so every folder is merged before its parent.
+    tree = [
+        (path, sorted(sub_folders.get(path, [])),
+         sorted(files_by_folder.get(path, [])))
+        for path in sorted(dirs, key=lambda p: (-p.count(os.sep), p))]
+
+    with BulkWriter() as writer:
+        base_folder_stat = merge_folders_statistic(
+            base_path, restore_folders(tree), writer=writer, mode=mode)
+    bump_generation()
+    return base_folder_stat
+
+
+def restore_folders(tree: List) -> Iterator:
+    """
+    Restores analyzers of the files of every folder of the tree.
+    :param tree: Paths of folders, their sub-folders and files.
+    :return: path, folders, files and restored FileAnalyzers of the folder.
+    :rtype: iterator
+    """
+    for path, folders, files in tree:
+        filenames = [os.path.join(path, f) for f in files]
+        restored = restore_files(filenames)
+        yield path, folders, files, [restored[f] for f in filenames]
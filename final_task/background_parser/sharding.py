@@ -0,0 +1,100 @@
+import heapq
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from background_parser.manifest import ScanPlan
+
+
+def get_subtree_sizes(base_path: str, folders: Iterable,
+                      plan: ScanPlan) -> Dict[str, int]:
+    """
+    Returns size of the files which have to be analyzed in every folder
+    together with its sub-folders.
+    :param str base_path: Path of the top folder.
+    :param folders: Paths of folders, their sub-folders and files, bottom-up.
+    :param plan: Changes found since the previous scan.
+    :rtype: dict
+    """
+    sizes: Dict[str, int] = {}
+    for path, _, files in folders:
+        size = sizes.get(path, 0) + sum(
+            plan.file_sizes.get(filename, 0)
+            for filename in (os.path.join(path, f) for f in files)
+            if plan.needs_analysis(filename))
+        sizes[path] = size
+        if path != base_path:
+            parent = os.path.dirname(path)
+            sizes[parent] = sizes.get(parent, 0) + size
+    return sizes
+
+
+def split_scan(base_path: str, folders: List, plan: ScanPlan,
+               shards: int) -> Optional[Tuple[List[List[str]], Set[str]]]:
+    """
+    Splits the folder into sub-trees of roughly equal size of the files to
+    analyze. Folders which sub-trees are larger than a shard are split
+    further, such folders stay above the shards: their own files are
+    analyzed when statistic of the shards is merged.
+    :param str base_path: Path of the top folder.
+    :param List folders: Paths of folders, their sub-folders and files from
+    the walker.
+    :param plan: Changes found since the previous scan.
+    :param int shards: Maximum number of shards.
+    :return: roots of the sub-trees of every shard and folders above
+    the shards, None if the scan can not be split.
+    :rtype: tuple
+    """
+    if shards < 2:
+        return None
+    sizes = get_subtree_sizes(base_path, folders, plan)
+    total = sizes.get(base_path, 0)
+    if not total:
+        return None
+
+    children: Dict[str, List[str]] = {}
+    for path, _, _ in folders:
+        if path != base_path:
+            children.setdefault(os.path.dirname(path), []).append(path)
+
+    limit = total / shards
+    roots: List[str] = []
+    upper: Set[str] = set()
+    stack = [base_path]
+    while stack:
+        path = stack.pop()
+        # Sub-trees without files to analyze are cheap to merge.
+        if sizes[path] and (sizes[path] <= limit or not children.get(path)):
+            roots.append(path)
+        else:
+            upper.add(path)
+            stack.extend(children.get(path, []))
+    if len(roots) < 2:
+        return None
+
+    # The largest sub-trees go first, each into the least loaded shard.
+    loads = [(0, shard) for shard in range(min(shards, len(roots)))]
+    shard_roots: List[List[str]] = [[] for _ in loads]
+    for root in sorted(roots, key=lambda p: (-sizes[p], p)):
+        load, shard = heapq.heappop(loads)
+        shard_roots[shard].append(root)
+        heapq.heappush(loads, (load + sizes[root], shard))
+    return shard_roots, upper
+
+
+def get_subtree_roots(folders: Iterable, roots: Set[str],
+                      upper: Set[str]) -> Dict[str, Optional[str]]:
+    """
+    Returns root of the sub-tree every folder belongs to, None for
+    the folders above the sub-trees.
+    :param folders: Paths of folders, their sub-folders and files.
+    :param roots: Roots of the sub-trees.
+    :param upper: Folders above the sub-trees.
+    :rtype: dict
+    """
+    subtree_roots: Dict[str, Optional[str]] = {}
+    for path, _, _ in folders:
+        root = path
+        while root not in roots and root not in upper:
+            root = os.path.dirname(root)
+        subtree_roots[path] = root if root in roots else None
+    return subtree_roots
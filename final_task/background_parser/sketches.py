@@ -0,0 +1,236 @@
+import hashlib
+import heapq
+import math
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
+
+import numpy as np
+from django.conf import settings
+
+
+def hash_words(words: Iterable[str]) -> np.ndarray:
+    """
+    Returns two independent 64-bit hashes of every word. Unlike hash()
+    they are the same in every process.
+    :rtype: np.ndarray
+    """
+    return np.array([
+        np.frombuffer(hashlib.blake2b(word.encode("utf-8"),
+                                      digest_size=16).digest(),
+                      dtype=np.uint64)
+        for word in words], dtype=np.uint64).reshape(-1, 2)
+
+
+class CountMinSketch:
+    """
+    Count-Min sketch of word frequencies. Estimates are never lower than
+    the true counts and exceed them by at most `error_rate * total` with
+    probability `1 - failure_probability`.
+    """
+    def __init__(self, width: int, depth: int):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    @property
+    def error_rate(self) -> float:
+        return math.e / self.width
+
+    @property
+    def failure_probability(self) -> float:
+        return math.exp(-self.depth)
+
+    def columns(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Returns column of every word in every row of the table.
+        :param hashes: Hashes of the words from hash_words.
+        """
+        rows = np.arange(self.depth, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            mixed = hashes[:, :1] + rows * hashes[:, 1:]
+        return (mixed % np.uint64(self.width)).astype(np.int64)
+
+    def add(self, columns: np.ndarray, counts: np.ndarray):
+        """
+        Adds counts of the words.
+        :param columns: Columns of the words from columns().
+        :param counts: Counts of the words.
+        """
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[:, row], counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, columns: np.ndarray) -> np.ndarray:
+        """
+        Returns estimated counts of the words.
+        :param columns: Columns of the words from columns().
+        """
+        return self.table[np.arange(self.depth), columns].min(axis=1)
+
+    def merge(self, other: 'CountMinSketch'):
+        self.table += other.table
+        self.total += other.total
+
+    def error(self) -> int:
+        """
+        Returns bound of overestimation of the counts.
+        """
+        return math.ceil(self.error_rate * self.total)
+
+
+class WordFrequencySketch:
+    """
+    Approximate word frequencies of constant size. The most frequent words
+    are tracked by Space-Saving summary: every monitored word has
+    an overestimated count and its maximum error, unmonitored words occur
+    at most `floor` times. Candidates for the least frequent word are kept
+    in a small pool ranked by their Count-Min estimates.
+    Provides the same interface as WordCounts, counts are upper bounds.
+    """
+    def __init__(self, capacity: int = None, width: int = None,
+                 depth: int = None, rare_capacity: int = None):
+        self.capacity = capacity or getattr(
+            settings, 'SKETCH_CAPACITY', 1000)
+        self.rare_capacity = rare_capacity or getattr(
+            settings, 'SKETCH_RARE_CAPACITY', 100)
+        self.count_min = CountMinSketch(
+            width or getattr(settings, 'SKETCH_WIDTH', 2048),
+            depth or getattr(settings, 'SKETCH_DEPTH', 4))
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.floor = 0
+        # Candidates for the least frequent word with their columns in
+        # the Count-Min table.
+        self.rare: Dict[str, np.ndarray] = {}
+
+    def update(self, words: Union['WordFrequencySketch', Mapping[str, int]]):
+        """
+        Adds counts of the words from Counter or other sketch.
+        """
+        if isinstance(words, WordFrequencySketch):
+            self.count_min.merge(words.count_min)
+            self.__merge_heavy_hitters(words.counts, words.errors,
+                                       words.floor)
+            self.__update_rare(words.rare)
+            return
+        if not words:
+            return
+
+        keys = list(words.keys())
+        counts = np.fromiter(words.values(), dtype=np.int64,
+                             count=len(keys))
+        columns = self.count_min.columns(hash_words(keys))
+        self.count_min.add(columns, counts)
+        self.__merge_heavy_hitters(words, {}, 0)
+
+        rarest = np.argsort(counts, kind="stable")[:self.rare_capacity]
+        self.__update_rare({keys[i]: columns[i] for i in rarest})
+
+    def __merge_heavy_hitters(self, counts: Mapping[str, int],
+                              errors: Mapping[str, int], floor: int):
+        merged_counts = {}
+        merged_errors = {}
+        for word in self.counts.keys() | counts.keys():
+            merged_counts[word] = (self.counts.get(word, self.floor) +
+                                   counts.get(word, floor))
+            merged_errors[word] = (self.errors.get(word, self.floor) +
+                                   errors.get(word, floor))
+
+        new_floor = self.floor + floor
+        if len(merged_counts) > self.capacity:
+            kept = heapq.nlargest(self.capacity, merged_counts,
+                                  key=merged_counts.__getitem__)
+            dropped = merged_counts.keys() - set(kept)
+            new_floor = max(new_floor,
+                            max(merged_counts[word] for word in dropped))
+            merged_counts = {word: merged_counts[word] for word in kept}
+            merged_errors = {word: merged_errors[word] for word in kept}
+
+        self.counts, self.errors, self.floor = \
+            merged_counts, merged_errors, new_floor
+
+    def __update_rare(self, candidates: Dict[str, np.ndarray]):
+        rare = {**self.rare, **candidates}
+        if len(rare) > self.rare_capacity:
+            words = list(rare)
+            estimates = self.count_min.estimate(np.array(list(rare.values())))
+            rare = {words[i]: rare[words[i]] for i in
+                    np.argsort(estimates, kind="stable")
+                    [:self.rare_capacity]}
+        self.rare = rare
+
+    def total(self) -> int:
+        return self.count_min.total
+
+    def bounds(self, word: str) -> Tuple[int, int]:
+        """
+        Returns lower and upper bound of the count of the word.
+        Count-Min upper bound holds with probability
+        `1 - count_min.failure_probability`.
+        """
+        upper = int(self.count_min.estimate(
+            self.count_min.columns(hash_words([word])))[0])
+        lower = 0
+        if word in self.counts:
+            upper = min(upper, self.counts[word])
+            lower = self.counts[word] - self.errors[word]
+        return max(lower, 0), upper
+
+    def most_common(self, k: int) -> List[Tuple[str, int]]:
+        """
+        Returns k most frequent words with their estimated counts.
+        """
+        return heapq.nlargest(k, self.counts.items(), key=lambda x: x[1])
+
+    def least_common(self, k: int) -> List[Tuple[str, int]]:
+        """
+        Returns k least frequent candidate words with their estimated
+        counts.
+        """
+        if not self.rare:
+            return []
+        words = list(self.rare)
+        estimates = self.count_min.estimate(
+            np.array(list(self.rare.values())))
+        order = np.argsort(estimates, kind="stable")[:k]
+        return [(words[i], int(estimates[i])) for i in order]
+
+    def get_state(self) -> dict:
+        """
+        Returns the sketch in JSON serializable form.
+        """
+        return {
+            "capacity": self.capacity,
+            "rare_capacity": self.rare_capacity,
+            "width": self.count_min.width,
+            "depth": self.count_min.depth,
+            "total": self.count_min.total,
+            "table": self.count_min.table.tolist(),
+            "counts": self.counts,
+            "errors": self.errors,
+            "floor": self.floor,
+            "rare": list(self.rare),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'WordFrequencySketch':
+        """
+        Restores the sketch from get_state.
+        """
+        sketch = cls(state["capacity"], state["width"], state["depth"],
+                     state["rare_capacity"])
+        sketch.count_min.total = state["total"]
+        sketch.count_min.table = np.array(state["table"], dtype=np.int64)
+        sketch.counts = dict(state["counts"])
+        sketch.errors = dict(state["errors"])
+        sketch.floor = state["floor"]
+        if state["rare"]:
+            columns = sketch.count_min.columns(hash_words(state["rare"]))
+            sketch.rare = dict(zip(state["rare"], columns))
+        return sketch
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __bool__(self):
+        return self.count_min.total > 0
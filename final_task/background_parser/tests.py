@@ -0,0 +1,463 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
+
+from background_parser import services, vocabulary
+from background_parser.aggregators import (ContentStatistic,
+                                           FolderStatisticAggregator)
+from background_parser.extraction_cache import ExtractionCache
+from background_parser.extraction_pool import TIMEOUT, ExtractionError
+from background_parser.jobs import (ScanProgress, find_or_create_job,
+                                    get_task_name)
+from background_parser.manifest import ScanPlan, plan_scan
+from background_parser.models import (DirectoryStatistic, FileManifest,
+                                      FileStatistic, ScanJob)
+from background_parser.parser import FileParser, iter_words, reference_words
+from background_parser.vocabulary import Vocabulary, WordCounts
+from background_parser.walker import get_walker
+from background_task.models import Task
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.utils import timezone
+
+
+def make_file_statistic(ru_words: Counter, en_words: Counter) -> dict:
+    return {
+        "vowels": Counter(),
+        "consonants": Counter(),
+        "syllables": Counter(),
+        "ru_word_freq": ru_words,
+        "en_word_freq": en_words,
+        "average_word_length": 1.0,
+    }
+
+
+def merge_counters(current: Counter, incoming: Counter) -> Counter:
+    """
+    Merges counters as ContentStatistic did before WordCounts: incoming
+    words go first, which decides ties between equally frequent words.
+    """
+    return incoming + current
+
+
+MIXED_TEXT = (
+    "Hello, мир! Северо-западный ветер blew over the well-known\n"
+    "ЁЛКИ and ёжики; İstanbul, İİ and DİYARBAKIR are dotted. "
+    "Mixed words: abcабв, мирworld, e-mail, 42nd, x1y2, "
+    "Сон... сон, СОН - snow-white\tend"
+)
+
+
+def split_randomly(text: str, rng: random.Random) -> list:
+    """
+    Splits text into chunks of random length, empty chunks included.
+    """
+    chunks = []
+    position = 0
+    while position < len(text):
+        length = rng.randint(0, 7)
+        chunks.append(text[position:position + length])
+        position += length
+    return chunks
+
+
+class TokenizerTest(SimpleTestCase):
+    def test_chunked_words_equal_reference_words(self):
+        expected = list(reference_words(MIXED_TEXT))
+        self.assertEqual(list(iter_words(MIXED_TEXT, "chunked")), expected)
+        rng = random.Random(0)
+        for _ in range(200):
+            chunks = split_randomly(MIXED_TEXT, rng)
+            self.assertEqual(list(iter_words(chunks, "chunked")), expected)
+
+    def test_dotted_capital_i(self):
+        for text in ("İ", "aİb", "İİ мир", "DİYARBAKIR"):
+            expected = list(reference_words(text))
+            for size in range(1, len(text) + 1):
+                chunks = [text[start:start + size]
+                          for start in range(0, len(text), size)]
+                self.assertEqual(list(iter_words(chunks, "chunked")),
+                                 expected)
+
+    def test_hyphen_splits_words(self):
+        self.assertEqual(list(iter_words(["северо-", "западный e-", "mail"],
+                                         "chunked")),
+                         ["северо", "западный", "e", "mail"])
+        self.assertEqual(list(iter_words(["северо", "-западный"],
+                                         "chunked")),
+                         ["северо", "западный"])
+
+
+class FileParserTest(SimpleTestCase):
+    def parse(self, counting_mode: str, letter_engine: str) -> FileParser:
+        chunks = split_randomly(MIXED_TEXT * 3, random.Random(1))
+        return FileParser(chunks, counting_mode=counting_mode,
+                          letter_engine=letter_engine)
+
+    def assert_same_statistic(self, parser: FileParser, other: FileParser):
+        statistic = parser.return_full_file_statistics()
+        other_statistic = other.return_full_file_statistics()
+        self.assertEqual(statistic.keys(), other_statistic.keys())
+        for key in ("vowels", "consonants", "syllables"):
+            # Keys go in the order of the first occurrence in the text.
+            self.assertEqual(list(statistic[key].items()),
+                             list(other_statistic[key].items()), key)
+        for key in ("most_recent_word", "least_recent_word"):
+            self.assertEqual(statistic[key], other_statistic[key], key)
+        self.assertAlmostEqual(statistic["average_word_length"],
+                               other_statistic["average_word_length"])
+        self.assertEqual(parser.return_all_words_counter(),
+                         other.return_all_words_counter())
+
+    def test_letter_engines_are_equal(self):
+        for counting_mode in ("distinct", "per_token"):
+            self.assert_same_statistic(self.parse(counting_mode, "python"),
+                                       self.parse(counting_mode, "numpy"))
+
+    def test_counting_modes_are_equal(self):
+        for letter_engine in ("python", "numpy"):
+            self.assert_same_statistic(
+                self.parse("per_token", letter_engine),
+                self.parse("distinct", letter_engine))
+
+
+class WordCountsTest(SimpleTestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def make_counter(self, words: int) -> Counter:
+        # Few distinct counts, so many words are tied.
+        return Counter({f"w{self.random.randint(0, 3000)}":
+                        self.random.randint(1, 4) for _ in range(words)})
+
+    def assert_same_order(self, word_counts, counter: Counter):
+        self.assertEqual(word_counts.most_common(1), counter.most_common(1))
+        self.assertEqual(word_counts.most_common(5), counter.most_common(5))
+        self.assertEqual(word_counts.least_common(1),
+                         counter.most_common()[-1:])
+        self.assertEqual(list(word_counts.to_dict().items()),
+                         list(counter.items()))
+
+    def merge_tree(self):
+        """
+        Merges random files into folders and folders into their parents
+        with ContentStatistic and with Counters, returns both.
+        """
+        shared = Vocabulary()
+        folders = []
+        for _ in range(10):
+            statistic = ContentStatistic(vocabulary=shared)
+            counters = {"ru_word_freq": Counter(), "en_word_freq": Counter()}
+            for _ in range(self.random.randint(0, 3)):
+                file_stat = make_file_statistic(
+                    self.make_counter(self.random.randint(0, 1500)),
+                    self.make_counter(self.random.randint(0, 50)))
+                statistic.merge_statistic(file_stat)
+                for key, counter in counters.items():
+                    counters[key] = merge_counters(counter, file_stat[key])
+            for child, child_counters in folders[-2:]:
+                statistic.merge_statistic(child.get_statistic())
+                for key, counter in counters.items():
+                    counters[key] = merge_counters(counter,
+                                                   child_counters[key])
+            folders.append((statistic, counters))
+        return folders
+
+    def test_ties_are_broken_as_by_counters(self):
+        for statistic, counters in self.merge_tree():
+            for key, counter in counters.items():
+                self.assert_same_order(statistic.get_statistic()[key],
+                                       counter)
+
+    def test_ties_are_broken_as_by_counters_in_dense_arrays(self):
+        with mock.patch.object(vocabulary, "DENSE_MIN_WORDS", 10):
+            folders = self.merge_tree()
+        self.assertTrue(any(statistic.get_statistic()[key].is_dense()
+                            for statistic, counters in folders
+                            for key in counters))
+        for statistic, counters in folders:
+            for key, counter in counters.items():
+                self.assert_same_order(statistic.get_statistic()[key],
+                                       counter)
+
+    def test_tied_words_of_one_counter(self):
+        word_counts = WordCounts()
+        counter = Counter()
+        for words in ({"b": 1, "a": 1, "c": 2}, {"d": 2, "a": 1},
+                      {"e": 1}):
+            word_counts.update(Counter(words))
+            counter = merge_counters(counter, Counter(words))
+        self.assert_same_order(word_counts, counter)
+
+    def test_merge_of_different_vocabularies(self):
+        child = WordCounts()
+        child.update(Counter({"x": 1, "y": 2}))
+        parent = WordCounts()
+        parent.update(Counter({"y": 1, "z": 3}))
+        parent.update(child)
+        self.assert_same_order(
+            parent, merge_counters(Counter({"y": 1, "z": 3}),
+                                   Counter({"x": 1, "y": 2})))
+
+    def test_small_folders_stay_sparse(self):
+        shared = Vocabulary()
+        shared.intern(f"w{number}" for number in range(100000))
+        word_counts = WordCounts(shared)
+        word_counts.update(Counter({f"new{number}": 1
+                                    for number in range(50)}))
+        self.assertFalse(word_counts.is_dense())
+        self.assertEqual(len(word_counts), 50)
+
+
+class StateTest(SimpleTestCase):
+    def make_folder(self, shared: Vocabulary) -> FolderStatisticAggregator:
+        folder = FolderStatisticAggregator(vocabulary=shared)
+        folder.add_files_statistic(make_file_statistic(
+            Counter({"мир": 2, "дом": 2, "кот": 1}),
+            Counter({"word": 1, "tie": 1})))
+        folder.add_files_statistic(make_file_statistic(
+            Counter({"кот": 1}), Counter({"other": 3})))
+        folder.add_number_of_files(2)
+        return folder
+
+    def test_state_round_trip(self):
+        folder = self.make_folder(Vocabulary())
+        state = json.loads(json.dumps(folder.get_state()))
+        for shared in (Vocabulary(), None):
+            restored = FolderStatisticAggregator.from_state(
+                state, vocabulary=shared)
+            self.assertEqual(restored.get_state(), folder.get_state())
+            for key in ("ru_word_freq", "en_word_freq"):
+                restored_counts = restored.get_stat()[key]
+                counts = folder.get_stat()[key]
+                self.assertEqual(restored_counts.most_common(1),
+                                 counts.most_common(1))
+                self.assertEqual(restored_counts.least_common(1),
+                                 counts.least_common(1))
+
+    def test_restored_folder_merges_into_parent(self):
+        shared = Vocabulary()
+        child = self.make_folder(Vocabulary())
+        parent = FolderStatisticAggregator(vocabulary=shared)
+        parent.add_children_folder_stat(FolderStatisticAggregator.from_state(
+            child.get_state(), vocabulary=shared))
+        self.assertEqual(parent.get_stat()["number_of_files"], 2)
+        self.assertEqual(parent.get_stat()["ru_word_freq"].to_dict(),
+                         child.get_stat()["ru_word_freq"].to_dict())
+
+
+class IncrementalScanTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.write("tree/five.txt", "Hello мир")
+        self.write("tree/a/one.txt", "мир дом кот мир")
+        self.write("tree/a/b/two.txt", "hello world hello")
+        self.write("tree/c/three.txt", "кот и пёс, tie")
+        self.write("tree/c/d/four.txt", "tie words tie кот")
+        self.scan()
+
+    @staticmethod
+    def write(filename: str, text: str, mode: str = "w"):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, mode) as file:
+            file.write(text)
+
+    @staticmethod
+    def scan():
+        services.scan_folder("./tree", [".txt"], "exact", ScanProgress())
+
+    @staticmethod
+    def plan() -> ScanPlan:
+        return plan_scan("./tree", list(get_walker("./tree", [".txt"])))
+
+    def change_tree(self):
+        self.write("tree/a/b/two.txt", " и новые слова", mode="a")
+        self.write("tree/a/new.txt", "brand new file")
+
+    @staticmethod
+    def dump() -> dict:
+        return {
+            "dirs": {row.directory_name: (
+                row.number_of_files, row.most_recent_word,
+                row.least_recent_word, row.average_word_length, row.vowels,
+                row.consonants, row.syllables)
+                for row in DirectoryStatistic.objects.all()},
+            "files": {row.file: (
+                row.most_recent_word, row.least_recent_word,
+                row.average_word_length, row.vowels, row.consonants,
+                row.syllables)
+                for row in FileStatistic.objects.all()},
+        }
+
+    def test_changes_make_ancestors_dirty(self):
+        self.change_tree()
+        plan = self.plan()
+        self.assertEqual(set(plan.changed_files),
+                         {"./tree/a/b/two.txt", "./tree/a/new.txt"})
+        self.assertEqual(plan.dirty_dirs,
+                         {"./tree", "./tree/a", "./tree/a/b"})
+        self.assertEqual(plan.reused_dirs, {"./tree/c"})
+
+    def test_removed_file_makes_ancestors_dirty(self):
+        os.remove("tree/c/d/four.txt")
+        plan = self.plan()
+        self.assertEqual(plan.removed_files, {"./tree/c/d/four.txt"})
+        self.assertEqual(plan.dirty_dirs,
+                         {"./tree", "./tree/c", "./tree/c/d"})
+        self.assertEqual(plan.reused_dirs, {"./tree/a"})
+
+    def test_plan_round_trip(self):
+        self.change_tree()
+        plan = self.plan()
+        files = {"./tree/a/new.txt", "./tree/c/three.txt"}
+        dirs = {"./tree/a", "./tree/c"}
+        restored = ScanPlan.from_dict(json.loads(json.dumps(
+            plan.to_dict(files, dirs))))
+        self.assertEqual(restored.base_path, plan.base_path)
+        self.assertEqual(restored.changed_files,
+                         {"./tree/a/new.txt":
+                          plan.changed_files["./tree/a/new.txt"]})
+        self.assertEqual(restored.restorable_files, {"./tree/c/three.txt"})
+        self.assertEqual(restored.dirty_dirs, {"./tree/a"})
+        self.assertEqual(restored.reused_dirs, {"./tree/c"})
+        self.assertEqual(restored.file_sizes, {
+            filename: plan.file_sizes[filename] for filename in files})
+        self.assertEqual(restored.to_dict(files, dirs),
+                         plan.to_dict(files, dirs))
+
+    def test_incremental_scan_equals_fresh_scan(self):
+        self.change_tree()
+        with mock.patch.object(services, "restore_files",
+                               wraps=services.restore_files) as restore:
+            self.scan()
+        restored = {filename for call in restore.call_args_list
+                    for filename in call.args[0]}
+        self.assertEqual(restored, {"./tree/five.txt", "./tree/a/one.txt"})
+        incremental = self.dump()
+
+        for model in (DirectoryStatistic, FileStatistic, FileManifest):
+            model.objects.all().delete()
+        self.scan()
+        self.assertEqual(self.dump(), incremental)
+
+
+class StaleJobTest(TestCase):
+    def setUp(self):
+        self.job, _ = find_or_create_job("./tree", [".txt"], "exact")
+        ScanJob.objects.filter(id=self.job.id).update(
+            status=ScanJob.RUNNING,
+            updated=timezone.now() - timedelta(seconds=3600))
+
+    def find_job(self):
+        return find_or_create_job("./tree", [".txt"], "exact")
+
+    def test_job_without_heartbeat_is_failed(self):
+        job, created = self.find_job()
+        self.assertTrue(created)
+        self.assertNotEqual(job.id, self.job.id)
+        self.assertEqual(ScanJob.objects.get(id=self.job.id).status,
+                         ScanJob.FAILED)
+
+    def test_job_with_queued_tasks_is_alive(self):
+        services.analyze_shard(1, verbose_name=get_task_name(self.job.id))
+        self.assertEqual(self.find_job(), (self.job, False))
+        self.assertEqual(ScanJob.objects.get(id=self.job.id).status,
+                         ScanJob.RUNNING)
+
+    def test_running_task_does_not_keep_job_alive(self):
+        services.analyze_shard(1, verbose_name=get_task_name(self.job.id))
+        Task.objects.update(locked_by="1", locked_at=timezone.now())
+        job, created = self.find_job()
+        self.assertTrue(created)
+
+
+class HeartbeatTest(TransactionTestCase):
+    @override_settings(SCAN_JOB_HEARTBEAT_SECONDS=0.05)
+    def test_heartbeat_marks_running_job_alive(self):
+        job, _ = find_or_create_job("./tree", [".txt"], "exact")
+        expired = timezone.now() - timedelta(seconds=3600)
+        with ScanProgress(job.id):
+            ScanJob.objects.filter(id=job.id).update(updated=expired)
+            time.sleep(0.5)
+            self.assertGreater(ScanJob.objects.get(id=job.id).updated,
+                               expired + timedelta(seconds=3000))
+        self.assertEqual(ScanJob.objects.get(id=job.id).status,
+                         ScanJob.DONE)
+
+
+class ExtractionCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.filename = os.path.join(self.directory, "document.doc")
+        with open(self.filename, "wb") as file:
+            file.write(b"document")
+        self.calls = 0
+
+    def get_cache(self, **options) -> ExtractionCache:
+        cache = ExtractionCache(os.path.join(self.directory, "cache"),
+                                1024 ** 2, **options)
+        self.addCleanup(cache.close)
+        return cache
+
+    def fail(self, filename: str) -> bytes:
+        self.calls += 1
+        raise ExtractionError(TIMEOUT, f"{filename} has timed out")
+
+    def test_failure_is_remembered(self):
+        for cache in (self.get_cache(), self.get_cache()):
+            with self.assertRaises(ExtractionError) as error:
+                cache.get_text(self.filename, self.fail)
+            self.assertEqual(error.exception.outcome, TIMEOUT)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(cache.counters["failures"], 1)
+
+    def test_failure_expires(self):
+        cache = self.get_cache(failure_ttl=0)
+        for _ in range(2):
+            with self.assertRaises(ExtractionError):
+                cache.get_text(self.filename, self.fail)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(cache.get_text(self.filename, lambda f: b"text"),
+                         b"text")
+
+    def test_waiting_thread_fails_fast(self):
+        cache = self.get_cache()
+        extracting = threading.Event()
+        proceed = threading.Event()
+
+        def fail_slowly(filename: str) -> bytes:
+            extracting.set()
+            proceed.wait()
+            return self.fail(filename)
+
+        errors = []
+
+        def get_text(extract):
+            try:
+                cache.get_text(self.filename, extract)
+            except ExtractionError as error:
+                errors.append(error.outcome)
+
+        owner = threading.Thread(target=get_text, args=(fail_slowly,))
+        owner.start()
+        extracting.wait()
+        waiter = threading.Thread(target=get_text, args=(self.fail,))
+        waiter.start()
+        time.sleep(0.3)
+        proceed.set()
+        owner.join()
+        waiter.join()
+        self.assertEqual(errors, [TIMEOUT, TIMEOUT])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(cache.counters["waits"], 1)
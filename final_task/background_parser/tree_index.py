@@ -0,0 +1,97 @@
+import os
+from itertools import groupby
+from typing import Dict, Iterable, List
+
+from background_parser.manifest import inside_folder
+from background_parser.models import PathNode
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+
+
+def sync_tree_index(base_path: str, folders: Iterable):
+    """
+    Makes the index of the folder match the tree from the walker: adds
+    new files and folders and deletes removed ones.
+    :param str base_path: Path of the top folder.
+    :param folders: Paths of folders, their sub-folders and files.
+    """
+    found: Dict[str, bool] = {}
+    for path, _, files in folders:
+        found[path] = True
+        for file in files:
+            found[os.path.join(path, file)] = False
+
+    ids: Dict[str, int] = {}
+    removed: List[int] = []
+    for path, node_id, is_dir in PathNode.objects.filter(
+            inside_folder("path", base_path)).values_list(
+            "path", "id", "is_dir"):
+        if found.get(path) == is_dir:
+            ids[path] = node_id
+        else:
+            removed.append(node_id)
+
+    # The folder could be indexed before as a part of its parent.
+    parent = os.path.dirname(base_path)
+    if parent != base_path:
+        ids.update(PathNode.objects.filter(path=parent).values_list(
+            "path", "id"))
+
+    batch_size = getattr(settings, 'DB_WRITE_BATCH_SIZE', 500)
+    new_paths = sorted((path for path in found if path not in ids),
+                       key=lambda p: (p.count(os.sep), p))
+
+    with transaction.atomic():
+        for start in range(0, len(removed), batch_size):
+            PathNode.objects.filter(
+                id__in=removed[start:start + batch_size]).delete()
+
+        # Parents are inserted before their children, level by level,
+        # so ids of the parents are known.
+        for _, level in groupby(new_paths, key=lambda p: p.count(os.sep)):
+            level = list(level)
+            PathNode.objects.bulk_create([
+                PathNode(path=path, is_dir=found[path],
+                         parent_id=ids.get(os.path.dirname(path)))
+                for path in level], batch_size=batch_size)
+            for start in range(0, len(level), batch_size):
+                ids.update(PathNode.objects.filter(
+                    path__in=level[start:start + batch_size]
+                ).values_list("path", "id"))
+
+        # Folders which were indexed as top folders before and now have
+        # a parent in the index.
+        for node in PathNode.objects.filter(inside_folder("path", base_path),
+                                            parent__isnull=True):
+            if os.path.dirname(node.path) in ids:
+                node.parent_id = ids[os.path.dirname(node.path)]
+                node.save(update_fields=["parent"])
+
+
+def get_listing(directory: str, recursive: bool = True) -> QuerySet:
+    """
+    Returns files and folders inside the folder ordered by their paths.
+    :param str directory: Path of the folder.
+    :param bool recursive: Whether to list sub-folders with their content
+    or only direct children of the folder.
+    :rtype: QuerySet
+    """
+    if recursive:
+        nodes = PathNode.objects.filter(
+            path__startswith=os.path.join(directory, ""))
+    else:
+        nodes = PathNode.objects.filter(parent__path=directory)
+    return nodes.order_by("path")
+
+
+def get_files_and_dirs(directory: str) -> Dict[str, List[str]]:
+    """
+    Returns paths of all files and folders inside the folder.
+    :param str directory: Path of the folder.
+    :rtype: dict
+    """
+    files_and_dirs = {"files": [], "dirs": []}
+    for path, is_dir in get_listing(directory).values_list("path", "is_dir"):
+        files_and_dirs["dirs" if is_dir else "files"].append(path)
+    return files_and_dirs
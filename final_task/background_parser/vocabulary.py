@@ -0,0 +1,249 @@
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Interns words: gives every distinct word an integer id.
+    """
+    def __init__(self):
+        self.__ids: Dict[str, int] = {}
+        self.__words: List[str] = []
+
+    def intern(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Returns ids of the words, new words get new ids.
+        :param words: Words to intern.
+        :rtype: np.ndarray
+        """
+        ids = self.__ids
+        known = self.__words
+        result = []
+        for word in words:
+            word_id = ids.setdefault(word, len(known))
+            if word_id == len(known):
+                known.append(word)
+            result.append(word_id)
+        return np.array(result, dtype=np.int64)
+
+    def words(self, ids: Iterable[int]) -> List[str]:
+        """
+        Returns words by their ids.
+        """
+        return [self.__words[word_id] for word_id in ids]
+
+    def __len__(self):
+        return len(self.__words)
+
+
+# Counts of a folder are kept in arrays indexed by ids of the words only
+# when it has at least DENSE_MIN_WORDS words and they are at least
+# DENSE_SHARE of the vocabulary, smaller folders keep sorted ids.
+DENSE_SHARE = 0.25
+DENSE_MIN_WORDS = 1024
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class WordCounts:
+    """
+    Counts of the words kept in arrays of ids of the words from
+    the vocabulary of the scan. Counts of small folders are kept sparse,
+    as sorted ids with counts, large folders switch to arrays indexed by
+    the ids.
+    It also keeps the order of the words Counter would have after the same
+    updates (`incoming + current`, as ContentStatistic merges counters),
+    the order is used to break ties between equally frequent words.
+    """
+    def __init__(self, vocabulary: Optional[Vocabulary] = None):
+        """
+        :param vocabulary: Vocabulary of the scan shared by all its
+        folders, a new one by default.
+        """
+        self.vocabulary = vocabulary if vocabulary is not None \
+            else Vocabulary()
+        # Sorted ids of the words, None when the arrays are indexed by ids.
+        self.__ids: Optional[np.ndarray] = EMPTY
+        self.__counts = EMPTY
+        # Words with smaller keys go first in the order, valid for
+        # the words with non zero count.
+        self.__keys = EMPTY
+        # Incoming words get keys below it, so they go before all
+        # the words which are counted already.
+        self.__first_key = 0
+
+    def update(self, words: Union['WordCounts', Mapping[str, int]]):
+        """
+        Adds counts of the words from Counter or other WordCounts.
+        """
+        if isinstance(words, WordCounts):
+            ids, counts, keys = words.__items()
+            if words.vocabulary is not self.vocabulary:
+                ids = self.vocabulary.intern(
+                    words.vocabulary.words(ids.tolist()))
+            self.__add(ids, counts, keys)
+        elif words:
+            ids = self.vocabulary.intern(words.keys())
+            counts = np.fromiter(words.values(), dtype=np.int64,
+                                 count=len(ids))
+            # Counter addition drops words which are not counted.
+            counted = counts > 0
+            self.__add(ids[counted], counts[counted],
+                       np.arange(len(ids))[counted])
+
+    def __add(self, ids: np.ndarray, counts: np.ndarray, keys: np.ndarray):
+        if not len(ids):
+            return
+        # Incoming words go first, the rest keep their keys after them.
+        lowest = int(keys.min())
+        self.__first_key -= int(keys.max()) - lowest + 1
+        keys = keys - lowest + self.__first_key
+
+        if self.__ids is None:
+            self.__grow(int(ids.max()) + 1)
+            self.__counts[ids] += counts
+            self.__keys[ids] = keys
+            return
+
+        order = np.argsort(ids)
+        ids, counts, keys = ids[order], counts[order], keys[order]
+        if not len(self.__ids):
+            self.__ids, self.__counts, self.__keys = ids, counts, keys
+        else:
+            # Most words of the folder are counted already, only new ones
+            # are inserted into the sorted ids.
+            positions = np.searchsorted(self.__ids, ids)
+            new = positions == len(self.__ids)
+            new[~new] = self.__ids[positions[~new]] != ids[~new]
+            if new.any():
+                self.__ids = np.insert(self.__ids, positions[new], ids[new])
+                self.__counts = np.insert(self.__counts, positions[new], 0)
+                self.__keys = np.insert(self.__keys, positions[new], 0)
+                positions = np.searchsorted(self.__ids, ids)
+            self.__counts[positions] += counts
+            self.__keys[positions] = keys
+
+        if len(self.__ids) >= DENSE_MIN_WORDS and \
+                len(self.__ids) >= DENSE_SHARE * len(self.vocabulary):
+            self.__densify()
+
+    def __densify(self):
+        ids = self.__ids
+        self.__ids = None
+        counts, keys = self.__counts, self.__keys
+        self.__counts = EMPTY
+        self.__keys = EMPTY
+        self.__grow(len(self.vocabulary))
+        self.__counts[ids] = counts
+        self.__keys[ids] = keys
+
+    def __grow(self, size: int):
+        if size <= len(self.__counts):
+            return
+        # Ids never exceed the vocabulary.
+        size = max(size, min(2 * len(self.__counts), len(self.vocabulary)))
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self.__counts)] = self.__counts
+        keys = np.zeros(size, dtype=np.int64)
+        keys[:len(self.__keys)] = self.__keys
+        self.__counts, self.__keys = counts, keys
+
+    def __items(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns ids, counts and keys of the counted words.
+        """
+        if self.__ids is None:
+            ids = np.flatnonzero(self.__counts)
+            return ids, self.__counts[ids], self.__keys[ids]
+        return self.__ids, self.__counts, self.__keys
+
+    def is_dense(self) -> bool:
+        """
+        Returns True if the counts are kept in arrays indexed by ids.
+        """
+        return self.__ids is None
+
+    def total(self) -> int:
+        """
+        Returns number of all counted words.
+        """
+        return int(self.__counts.sum())
+
+    def most_common(self, k: int) -> List[Tuple[str, int]]:
+        """
+        Returns k most frequent words with their counts. Equally frequent
+        words go in the order they have in Counter.
+        """
+        ids, counts, keys = self.__items()
+        chosen = select(counts, keys, k, largest=True)
+        chosen = chosen[np.lexsort((keys[chosen], -counts[chosen]))]
+        return self.__to_items(ids[chosen], counts[chosen])
+
+    def least_common(self, k: int) -> List[Tuple[str, int]]:
+        """
+        Returns k least frequent words with their counts. Equally frequent
+        words go in the reversed order they have in Counter.
+        """
+        ids, counts, keys = self.__items()
+        chosen = select(counts, keys, k, largest=False)
+        chosen = chosen[np.lexsort((-keys[chosen], counts[chosen]))]
+        return self.__to_items(ids[chosen], counts[chosen])
+
+    def __to_items(self, ids: np.ndarray,
+                   counts: np.ndarray) -> List[Tuple[str, int]]:
+        return list(zip(self.vocabulary.words(ids.tolist()),
+                        counts.tolist()))
+
+    def to_dict(self) -> Dict[str, int]:
+        """
+        Returns counts of the words in the order they have in Counter.
+        """
+        ids, counts, keys = self.__items()
+        order = np.argsort(keys)
+        return dict(self.__to_items(ids[order], counts[order]))
+
+    def get_state(self) -> Dict[str, int]:
+        """
+        Returns counts of the words in JSON serializable form.
+        """
+        return self.to_dict()
+
+    @classmethod
+    def from_state(cls, state: Dict[str, int],
+                   vocabulary: Optional[Vocabulary] = None) -> 'WordCounts':
+        """
+        Restores counts of the words from get_state.
+        :param vocabulary: Vocabulary of the scan, a new one by default.
+        """
+        word_counts = cls(vocabulary)
+        word_counts.update(state)
+        return word_counts
+
+    def __len__(self):
+        return int(np.count_nonzero(self.__counts))
+
+    def __bool__(self):
+        return bool(self.__counts.any())
+
+
+def select(counts: np.ndarray, keys: np.ndarray, k: int,
+           largest: bool) -> np.ndarray:
+    """
+    Returns positions of k largest or smallest counts, ties are broken by
+    the keys as in WordCounts. Partial selection instead of sorting all
+    the counts.
+    :rtype: np.ndarray
+    """
+    positions = np.arange(len(counts))
+    if k >= len(counts):
+        return positions
+    if largest:
+        kth = np.partition(counts, len(counts) - k)[len(counts) - k]
+        chosen, ties = positions[counts > kth], positions[counts == kth]
+        ties = ties[np.argsort(keys[ties])]
+    else:
+        kth = np.partition(counts, k - 1)[k - 1]
+        chosen, ties = positions[counts < kth], positions[counts == kth]
+        ties = ties[np.argsort(-keys[ties])]
+    return np.concatenate((chosen, ties[:k - len(chosen)]))
@@ -1,21 +1,218 @@
+import logging
 import os
-from typing import Iterator
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
+from django.conf import settings
 
-def get_walker(path: str, file_extensions: list[str]) -> Iterator:
+# Folders which are never worth analyzing: version control, dependencies,
+# virtual environments, caches and the volume of the database.
+DEFAULT_EXCLUDE = (".git", ".hg", ".svn", "node_modules", "venv", ".venv",
+                   "__pycache__", ".tox", "data/db")
+
+# Files and sub-folders found in one folder: names of walked sub-folders
+# with their device and inode when links are followed, names of the files
+# with their size and modification time.
+Listing = Tuple[List[Tuple[str, Optional[Tuple[int, int]]]],
+                List[Tuple[str, int, float]]]
+
+
+class Walker:
+    """
+    Walks the folder by os.scandir and yields its folders bottom-up, in the
+    same order as os.walk(topdown=False): path of the folder, names of its
+    walked sub-folders and names of its files with the extensions.
+    Only the walked sub-folders are yielded, so every sub-folder of
+    a folder is yielded before the folder. Size and modification time of
+    the files are taken from the directory entries and kept in `file_stats`.
+    """
+    def __init__(self, path: str, file_extensions: Iterable[str],
+                 exclude: Optional[Iterable[str]] = None,
+                 include: Optional[Iterable[str]] = None,
+                 max_depth: Optional[int] = None,
+                 follow_symlinks: Optional[bool] = None,
+                 max_file_size: Optional[int] = None,
+                 threads: Optional[int] = None):
+        """
+        :param str path: Top folder.
+        :param file_extensions: Extensions of the files to yield.
+        :param exclude: Glob patterns of the files and folders to skip,
+        SCAN_EXCLUDE setting by default. Patterns with '/' are matched with
+        the end of the path relative to the top folder, other patterns
+        with the name.
+        :param include: Glob patterns of the names of the files to yield,
+        SCAN_INCLUDE setting by default, None to yield all the files
+        with the extensions.
+        :param max_depth: Depth of the deepest walked folders, the top
+        folder has depth 0, SCAN_MAX_DEPTH setting by default.
+        :param follow_symlinks: Whether to walk symbolic links to folders,
+        SCAN_FOLLOW_SYMLINKS setting by default. Every folder is walked
+        once, so links which form loops are not followed.
+        :param max_file_size: Larger files are skipped,
+        SCAN_MAX_FILE_SIZE setting by default.
+        :param threads: Number of folders listed at once, which helps on
+        network file systems, SCAN_WALKER_THREADS setting by default.
+        """
+        def get(value, name, default):
+            return getattr(settings, name, default) if value is None \
+                else value
+
+        self.path = path
+        # Beginning of the paths of the entries, cut to match them with
+        # the globs.
+        self.prefix = os.path.join(path, "")
+        self.extensions = tuple(file_extensions)
+        exclude = get(exclude, 'SCAN_EXCLUDE', DEFAULT_EXCLUDE)
+        include = get(include, 'SCAN_INCLUDE', None)
+        self.exclude_names = compile_globs(
+            p for p in exclude if "/" not in p)
+        self.exclude_paths = compile_globs(
+            p for pattern in exclude if "/" in pattern
+            for p in (pattern, "*/" + pattern))
+        self.include = None if include is None else compile_globs(include)
+        self.max_depth = get(max_depth, 'SCAN_MAX_DEPTH', None)
+        self.follow_symlinks = get(follow_symlinks, 'SCAN_FOLLOW_SYMLINKS',
+                                   False)
+        self.max_file_size = get(max_file_size, 'SCAN_MAX_FILE_SIZE', None)
+        self.threads = get(threads, 'SCAN_WALKER_THREADS', 1)
+        # path of the file: (size, modification time)
+        self.file_stats: Dict[str, Tuple[int, float]] = {}
+
+    def __iter__(self) -> Iterator[Tuple[str, List[str], List[str]]]:
+        try:
+            top = os.stat(self.path)
+        except OSError as error:
+            logging.getLogger(__name__).warning(
+                "Can not walk %s: %s", self.path, error)
+            return
+        listings = self.__list_tree(top)
+
+        # Post-order traversal: a folder follows all its sub-folders.
+        stack = [(self.path, False)]
+        while stack:
+            path, visited = stack.pop()
+            folders, files = listings[path]
+            if visited:
+                yield (path, [name for name, _ in folders],
+                       [name for name, _, _ in files])
+                continue
+            stack.append((path, True))
+            stack.extend((os.path.join(path, name), False)
+                         for name, _ in reversed(folders))
+
+    def __list_tree(self, top: os.stat_result) -> Dict[str, Listing]:
+        """
+        Lists all the walked folders level by level, folders of a level are
+        listed in parallel when there are several threads.
+        """
+        listings: Dict[str, Listing] = {}
+        visited: Set[Optional[Tuple[int, int]]] = {(top.st_dev, top.st_ino)}
+        level = [self.path]
+        executor = ThreadPoolExecutor(self.threads) \
+            if self.threads > 1 else None
+        try:
+            depth = 0
+            while level:
+                walk_deeper = self.max_depth is None or \
+                    depth < self.max_depth
+                if executor is None:
+                    results = [self.__list(path, walk_deeper)
+                               for path in level]
+                else:
+                    results = executor.map(
+                        partial(self.__list, walk_deeper=walk_deeper), level)
+
+                next_level = []
+                for path, (found, files) in zip(level, results):
+                    # The same folder can be reached by several links.
+                    folders = []
+                    for name, identity in found:
+                        if identity is None or identity not in visited:
+                            visited.add(identity)
+                            folders.append((name, identity))
+                    listings[path] = (folders, files)
+                    next_level.extend(os.path.join(path, name)
+                                      for name, _ in folders)
+                    for name, size, modified in files:
+                        self.file_stats[os.path.join(path, name)] = \
+                            (size, modified)
+                level = next_level
+                depth += 1
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return listings
+
+    def __list(self, path: str, walk_deeper: bool) -> Listing:
+        """
+        Returns sub-folders to walk and files to yield of the folder.
+        """
+        folders = []
+        files = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if self.__is_excluded(entry.path, entry.name):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if not walk_deeper:
+                                continue
+                            if self.follow_symlinks:
+                                # Identity of the folder the entry leads to.
+                                stat = entry.stat()
+                                folders.append(
+                                    (entry.name, (stat.st_dev, stat.st_ino)))
+                            elif not entry.is_symlink():
+                                # Without links every folder is met once.
+                                folders.append((entry.name, None))
+                        elif self.__is_wanted(entry.name) and \
+                                entry.is_file():
+                            stat = entry.stat()
+                            if self.max_file_size is None or \
+                                    stat.st_size <= self.max_file_size:
+                                files.append((entry.name, stat.st_size,
+                                              stat.st_mtime))
+                    except OSError:
+                        # Broken link or entry removed meanwhile.
+                        continue
+        except OSError as error:
+            logging.getLogger(__name__).warning(
+                "Can not list %s: %s", path, error)
+        return folders, files
+
+    def __is_wanted(self, name: str) -> bool:
+        # endswith filters most of the names without splitext.
+        return name.endswith(self.extensions) and \
+            os.path.splitext(name)[-1] in self.extensions and \
+            (self.include is None or bool(self.include.match(name)))
+
+    def __is_excluded(self, path: str, name: str) -> bool:
+        if self.exclude_names is not None and \
+                self.exclude_names.match(name):
+            return True
+        return self.exclude_paths is not None and bool(
+            self.exclude_paths.match(path[len(self.prefix):]
+                                     .replace(os.sep, "/")))
+
+
+def compile_globs(patterns: Iterable[str]) -> Optional[re.Pattern]:
+    """
+    Returns regular expression which matches any of the glob patterns,
+    None if there are no patterns.
+    """
+    patterns = [translate(pattern) for pattern in patterns]
+    return re.compile("|".join(patterns)) if patterns else None
+
+
+def get_walker(path: str, file_extensions: list[str], **options) -> Walker:
     """
-    Returns generator of paths of files and folder from top folder.
+    Returns walker of paths of files and folders from the top folder,
+    options are given to Walker.
     :return: paths of files and folders.
-    :rtype: iterator
+    :rtype: Walker
     """
-    return (
-        (
-            p,
-            folders,
-            [
-                file for file in files if
-                os.path.splitext(file)[-1]
-                in file_extensions
-            ]
-         )
-        for p, folders, files in os.walk(path, topdown=False))
+    return Walker(path, file_extensions, **options)
@@ -0,0 +1,355 @@
+import json
+import logging
+import zlib
+from itertools import chain, groupby
+from operator import itemgetter
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from background_parser.manifest import inside_folder
+from background_parser.metrics import SCAN_STAGE_SECONDS
+from background_parser.models import (FileStatistic, IndexedFile, IndexSegment,
+                                      IndexTombstone, PathNode, WordPostings)
+from django.conf import settings
+from django.db import transaction
+
+# Ids of the files and counts of the word in them are stored as
+# little-endian unsigned integers, ids as differences with the previous id.
+POSTING_DTYPE = np.dtype("<u8")
+
+
+class IndexChanged(Exception):
+    """
+    Segments being merged were merged or deleted by another process.
+    """
+
+
+def encode_postings(ids: np.ndarray, counts: np.ndarray) -> bytes:
+    """
+    Returns compressed postings of a word. Sorted ids have small
+    differences, which are mostly zero bytes and are compressed well.
+    :param ids: Sorted ids of PathNodes of the files.
+    :param counts: Counts of the word in the files.
+    :rtype: bytes
+    """
+    deltas = np.diff(ids, prepend=0)
+    return zlib.compress(
+        np.concatenate([deltas, counts]).astype(POSTING_DTYPE).tobytes())
+
+
+def decode_postings(data: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns ids of the files and counts of the word from encode_postings.
+    :rtype: tuple
+    """
+    values = np.frombuffer(zlib.decompress(data), dtype=POSTING_DTYPE)
+    half = len(values) // 2
+    return (np.cumsum(values[:half], dtype=np.int64),
+            values[half:].astype(np.int64))
+
+
+def get_tombstones(segment_ids: Iterable[int]) -> Dict[int, np.ndarray]:
+    """
+    Returns ids of the files which postings in the segments are stale.
+    """
+    deleted: Dict[int, List[int]] = {}
+    for segment_id, node_id in IndexTombstone.objects.filter(
+            segment_id__in=list(segment_ids)).values_list("segment_id",
+                                                          "node_id"):
+        deleted.setdefault(segment_id, []).append(node_id)
+    return {segment_id: np.array(ids, dtype=np.int64)
+            for segment_id, ids in deleted.items()}
+
+
+def read_postings(rows: Iterable[Tuple[int, bytes]],
+                  deleted: Dict[int, np.ndarray]
+                  ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes postings of the segments without the stale ones.
+    :param rows: Ids of the segments and their postings.
+    :param deleted: Stale ids of the files by segments, see get_tombstones.
+    :return: ids of the files and counts, not sorted.
+    :rtype: tuple
+    """
+    all_ids = []
+    all_counts = []
+    for segment_id, data in rows:
+        ids, counts = decode_postings(bytes(data))
+        if segment_id in deleted:
+            live = ~np.isin(ids, deleted[segment_id])
+            ids, counts = ids[live], counts[live]
+        all_ids.append(ids)
+        all_counts.append(counts)
+    if not all_ids:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    return np.concatenate(all_ids), np.concatenate(all_counts)
+
+
+def tombstone(rows: List[Tuple[str, int, int]]):
+    """
+    Marks postings of the indexed files as stale.
+    :param rows: Paths, ids of the PathNodes and segments of the files
+    from IndexedFile.
+    """
+    IndexTombstone.objects.bulk_create(
+        [IndexTombstone(segment_id=segment_id, node_id=node_id)
+         for _, node_id, segment_id in rows],
+        batch_size=getattr(settings, 'DB_WRITE_BATCH_SIZE', 500))
+
+
+def get_indexed(filenames: List[str]) -> List[Tuple[str, int, int]]:
+    batch_size = getattr(settings, 'DB_WRITE_BATCH_SIZE', 500)
+    return [row for start in range(0, len(filenames), batch_size)
+            for row in IndexedFile.objects.filter(
+                path__in=filenames[start:start + batch_size]).values_list(
+                "path", "node_id", "segment_id")]
+
+
+def index_files(filenames: Collection[str]):
+    """
+    Adds words of the files to the index from their stored partial
+    statistic. Earlier postings of the files are marked as stale, files
+    without statistic are removed from the index. Every
+    WORD_INDEX_SEGMENT_FILES files are written into a new segment.
+    :param filenames: Paths of the analyzed files.
+    """
+    filenames = sorted(filenames)
+    segment_files = getattr(settings, 'WORD_INDEX_SEGMENT_FILES', 10000)
+    with SCAN_STAGE_SECONDS.time(stage="index"):
+        for start in range(0, len(filenames), segment_files):
+            index_segment(filenames[start:start + segment_files])
+
+
+def index_segment(filenames: List[str]):
+    """
+    Writes words of the files into a new segment, see index_files.
+    """
+    batch_size = getattr(settings, 'DB_WRITE_BATCH_SIZE', 500)
+    # word: ([ids of the files], [counts])
+    postings: Dict[str, Tuple[List[int], List[int]]] = {}
+    indexed: Dict[str, int] = {}
+    for start in range(0, len(filenames), batch_size):
+        batch = filenames[start:start + batch_size]
+        nodes = dict(PathNode.objects.filter(
+            path__in=batch, is_dir=False).values_list("path", "id"))
+        for filename, data in FileStatistic.objects.filter(
+                file__in=batch, partial_statistic__isnull=False
+        ).values_list("file", "partial_statistic"):
+            node_id = nodes.get(filename)
+            if node_id is None or filename in indexed:
+                continue
+            indexed[filename] = node_id
+            partial = json.loads(zlib.decompress(bytes(data)).decode("utf-8"))
+            for word, count in chain(partial["ru_word_freq"].items(),
+                                     partial["en_word_freq"].items()):
+                ids, counts = postings.setdefault(word, ([], []))
+                ids.append(node_id)
+                counts.append(count)
+
+    with transaction.atomic():
+        # Segments of the earlier postings are locked, so they are not
+        # merged before the tombstones are written.
+        old = get_indexed(filenames)
+        list(IndexSegment.objects.select_for_update().filter(
+            id__in={segment_id for _, _, segment_id in old}).order_by("id"))
+        tombstone(old)
+        IndexedFile.objects.filter(
+            path__in=[path for path, _, _ in old]).delete()
+        if not indexed:
+            return
+
+        segment = IndexSegment.objects.create(files=len(indexed))
+        rows = []
+        for word, (ids, counts) in postings.items():
+            ids = np.array(ids, dtype=np.int64)
+            order = np.argsort(ids)
+            rows.append(WordPostings(
+                word=word, segment=segment, files=len(ids),
+                postings=encode_postings(ids[order],
+                                         np.array(counts)[order])))
+        WordPostings.objects.bulk_create(rows, batch_size=batch_size)
+        IndexedFile.objects.bulk_create(
+            [IndexedFile(path=path, node_id=node_id, segment=segment)
+             for path, node_id in indexed.items()], batch_size=batch_size)
+
+
+def unindex_files(filenames: Collection[str]):
+    """
+    Removes the files from the index, their postings are marked as stale.
+    :param filenames: Paths of the removed files.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return
+    with transaction.atomic():
+        old = get_indexed(filenames)
+        list(IndexSegment.objects.select_for_update().filter(
+            id__in={segment_id for _, _, segment_id in old}).order_by("id"))
+        tombstone(old)
+        IndexedFile.objects.filter(
+            path__in=[path for path, _, _ in old]).delete()
+
+
+def compact_word_index(full: bool = False) -> int:
+    """
+    Merges segments of the index dropping stale postings, so a word is
+    looked up in few rows. Segments with more than
+    WORD_INDEX_MAX_STALE_SHARE of stale postings are rewritten, and the
+    smallest segments are merged when there are more than
+    WORD_INDEX_MAX_SEGMENTS of them.
+    :param bool full: Merge all the segments into one.
+    :return: number of merged segments.
+    :rtype: int
+    """
+    max_segments = getattr(settings, 'WORD_INDEX_MAX_SEGMENTS', 16)
+    max_stale = getattr(settings, 'WORD_INDEX_MAX_STALE_SHARE', 0.2)
+
+    segments = list(IndexSegment.objects.order_by("files", "id").values_list(
+        "id", "files"))
+    stale: Dict[int, int] = {}
+    for segment_id in IndexTombstone.objects.values_list("segment_id",
+                                                         flat=True):
+        stale[segment_id] = stale.get(segment_id, 0) + 1
+
+    if full:
+        to_merge = [segment_id for segment_id, _ in segments]
+        if len(to_merge) == 1 and to_merge[0] not in stale:
+            to_merge = []
+    else:
+        to_merge = [segment_id for segment_id, files in segments
+                    if stale.get(segment_id, 0) > files * max_stale]
+        if len(segments) > max_segments:
+            smallest = [segment_id for segment_id, _ in
+                        segments[:len(segments) - max_segments + 1]]
+            to_merge.extend(s for s in smallest if s not in to_merge)
+    if not to_merge:
+        return 0
+
+    try:
+        with SCAN_STAGE_SECONDS.time(stage="compact"):
+            merge_segments(to_merge)
+    except IndexChanged:
+        logging.getLogger(__name__).info(
+            "Segments of the word index were merged by another process")
+        return 0
+    return len(to_merge)
+
+
+def merge_segments(segment_ids: List[int]):
+    """
+    Writes live postings of the segments into a new segment and deletes
+    them. Words are merged one by one in alphabetical order, so only
+    postings of one word are kept in memory.
+    :raises IndexChanged: if some of the segments do not exist anymore.
+    """
+    batch_size = getattr(settings, 'DB_WRITE_BATCH_SIZE', 500)
+    with transaction.atomic():
+        locked = IndexSegment.objects.select_for_update().filter(
+            id__in=segment_ids).order_by("id").values_list("id", flat=True)
+        if len(locked) != len(segment_ids):
+            raise IndexChanged()
+
+        deleted = get_tombstones(segment_ids)
+        segment = IndexSegment.objects.create(files=0)
+        rows = WordPostings.objects.filter(
+            segment_id__in=segment_ids).order_by("word").values_list(
+            "word", "segment_id", "postings").iterator()
+        batch = []
+        for word, group in groupby(rows, key=itemgetter(0)):
+            ids, counts = read_postings(
+                ((segment_id, data) for _, segment_id, data in group),
+                deleted)
+            if not len(ids):
+                continue
+            order = np.argsort(ids)
+            batch.append(WordPostings(
+                word=word, segment=segment, files=len(ids),
+                postings=encode_postings(ids[order], counts[order])))
+            if len(batch) >= batch_size:
+                WordPostings.objects.bulk_create(batch)
+                batch = []
+        WordPostings.objects.bulk_create(batch)
+
+        segment.files = IndexedFile.objects.filter(
+            segment_id__in=segment_ids).update(segment=segment)
+        segment.save(update_fields=["files"])
+        IndexSegment.objects.filter(id__in=segment_ids).delete()
+
+
+def rebuild_word_index(base_path: Optional[str] = None) -> int:
+    """
+    Indexes all the files with stored statistic again.
+    :param base_path: Index only the files inside the folder, the index
+    of other files is kept.
+    :return: number of indexed files.
+    :rtype: int
+    """
+    files = FileStatistic.objects.filter(partial_statistic__isnull=False)
+    indexed = IndexedFile.objects.all()
+    if base_path is not None:
+        files = files.filter(inside_folder("file", base_path))
+        indexed = indexed.filter(inside_folder("path", base_path))
+    filenames = set(files.values_list("file", flat=True))
+    unindex_files(set(indexed.values_list("path", flat=True)) - filenames)
+    index_files(filenames)
+    compact_word_index(full=True)
+    return len(filenames)
+
+
+def get_page(ids: np.ndarray, counts: np.ndarray, offset: int,
+             limit: int) -> np.ndarray:
+    """
+    Returns positions of the files of the page ranked by the counts and
+    then by the ids. Only the files up to the end of the page are sorted.
+    :rtype: numpy.ndarray
+    """
+    if not len(ids):
+        return ids
+    # Higher count goes first, then lower id.
+    keys = ids - counts * (int(ids.max()) + 1)
+    end = offset + limit
+    if end < len(keys):
+        top = np.argpartition(keys, end - 1)[:end]
+        return top[np.argsort(keys[top])][offset:]
+    return np.argsort(keys)[offset:end]
+
+
+def search_files(word: Optional[str] = None, prefix: Optional[str] = None,
+                 offset: int = 0, limit: int = 100) -> Tuple[int, List]:
+    """
+    Finds files which contain the word or words starting with the prefix.
+    Files are ranked by the count of the words in them, files with the same
+    count are ordered by ids of their PathNodes, so the order does not
+    change between the pages and when the files are indexed again.
+    :param word: Word to find.
+    :param prefix: Beginning of the words to find, counts of all the words
+    with it are summed.
+    :param int offset: Number of the best files to skip.
+    :param int limit: Maximal number of the files to return.
+    :return: number of the found files and the files with their counts.
+    :rtype: tuple
+    """
+    postings = WordPostings.objects.all()
+    if word is not None:
+        postings = postings.filter(word=word)
+    else:
+        postings = postings.filter(word__startswith=prefix)
+    rows = list(postings.values_list("segment_id", "postings"))
+    ids, counts = read_postings(
+        rows, get_tombstones({segment_id for segment_id, _ in rows}))
+
+    if prefix is not None:
+        # Counts of the words with the prefix in the same file are summed,
+        # a word has only one live posting of the file.
+        ids, inverse = np.unique(ids, return_inverse=True)
+        counts = np.bincount(inverse, weights=counts,
+                             minlength=len(ids)).astype(np.int64)
+    order = get_page(ids, counts, offset, limit)
+
+    paths = dict(PathNode.objects.filter(
+        id__in=ids[order].tolist()).values_list("id", "path"))
+    return len(ids), [
+        {"file": paths[node_id], "count": count}
+        for node_id, count in zip(ids[order].tolist(),
+                                  counts[order].tolist())
+        if node_id in paths]
@@ -0,0 +1,119 @@
+import logging
+import time
+from typing import Dict, List, Optional, Type
+
+from background_parser.metrics import DATABASE_FLUSH_SECONDS, DATABASE_ROWS
+from django.conf import settings
+from django.db import connection, models, transaction
+
+
+def upsert(model: Type[models.Model], rows: List[models.Model]):
+    """
+    Inserts rows of the model, rows with existing primary keys are updated.
+    Uses INSERT ... ON CONFLICT on PostgreSQL, on other databases existing
+    rows are deleted and inserted again in the same transaction.
+    :param model: Model of the rows.
+    :param List rows: Model instances to write.
+    """
+    if connection.vendor == "postgresql":
+        _upsert_postgresql(model, rows)
+        return
+
+    with transaction.atomic():
+        model.objects.filter(pk__in=[row.pk for row in rows]).delete()
+        model.objects.bulk_create(rows)
+
+
+def _upsert_postgresql(model: Type[models.Model], rows: List[models.Model]):
+    from psycopg2.extras import execute_values
+
+    fields = model._meta.concrete_fields
+    primary_key = model._meta.pk.column
+    columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+    updates = ", ".join(
+        f"{connection.ops.quote_name(f.column)} = "
+        f"EXCLUDED.{connection.ops.quote_name(f.column)}"
+        for f in fields if not f.primary_key)
+    sql = (f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} "
+           f"({columns}) VALUES %s "
+           f"ON CONFLICT ({connection.ops.quote_name(primary_key)}) "
+           f"DO UPDATE SET {updates}")
+    values = [
+        tuple(f.get_db_prep_save(getattr(row, f.attname), connection)
+              for f in fields)
+        for row in rows]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        execute_values(cursor.cursor, sql, values, page_size=len(values))
+
+
+class BulkWriter:
+    """
+    Collects rows of the statistic and writes them to the database in
+    batches instead of one update_or_create per row. The last row with
+    the same primary key wins, as it would with update_or_create.
+    """
+    def __init__(self, batch_size: Optional[int] = None):
+        self.batch_size = batch_size or getattr(
+            settings, 'DB_WRITE_BATCH_SIZE', 500)
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_seconds = 0.0
+        self.__rows: Dict[Type[models.Model], Dict] = {}
+
+    def add(self, row: models.Model):
+        """
+        Adds row to the batch, writes the batch if it is full.
+        :param row: Model instance to write.
+        """
+        rows = self.__rows.setdefault(type(row), {})
+        rows.pop(row.pk, None)
+        rows[row.pk] = row
+        if len(rows) >= self.batch_size:
+            self.flush_model(type(row))
+
+    def flush_model(self, model: Type[models.Model]):
+        """
+        Writes collected rows of the model.
+        """
+        rows = list(self.__rows.pop(model, {}).values())
+        if not rows:
+            return
+        started = time.perf_counter()
+        upsert(model, rows)
+        seconds = time.perf_counter() - started
+        self.flush_seconds += seconds
+        self.flushes += 1
+        self.rows_written += len(rows)
+        DATABASE_FLUSH_SECONDS.observe(seconds, model=model.__name__)
+        DATABASE_ROWS.inc(len(rows), model=model.__name__)
+
+    def flush(self):
+        """
+        Writes all collected rows.
+        """
+        for model in list(self.__rows):
+            self.flush_model(model)
+
+    def statistic(self) -> dict:
+        """
+        Returns number of flushes and written rows and time spent
+        on writing.
+        :rtype: dict
+        """
+        return {
+            "flushes": self.flushes,
+            "rows": self.rows_written,
+            "seconds": round(self.flush_seconds, 3),
+            "average_flush_seconds": round(
+                self.flush_seconds / self.flushes, 4) if self.flushes else 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+            logging.getLogger(__name__).info(
+                "Database writes: %s", self.statistic())
@@ -0,0 +1,249 @@
+import hashlib
+import itertools
+import os
+import random
+import zipfile
+from html import escape
+from typing import Dict, List, Optional
+
+RUSSIAN_LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+ENGLISH_LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+# Probabilities of the lengths of the generated words, close to the lengths
+# of the words of ordinary Russian and English texts.
+WORD_LENGTHS = {1: 2, 2: 12, 3: 14, 4: 13, 5: 12, 6: 11, 7: 10, 8: 8,
+                9: 6, 10: 5, 11: 3, 12: 2, 13: 1, 14: 1}
+
+FORMATS = {".txt": 4, ".py": 1, ".docx": 1, ".html": 2, ".epub": 1}
+
+WORD_NAMESPACE = ("http://schemas.openxmlformats.org/"
+                  "wordprocessingml/2006/main")
+
+
+class CorpusGenerator:
+    """
+    Generates a tree of folders with Russian and English texts in several
+    formats. The same seed gives the same files, so the benchmarks of
+    different versions of the project read the same corpus.
+    """
+    def __init__(self, seed: int = 0, files: int = 200, depth: int = 3,
+                 branching: int = 3, vocabulary: int = 20000,
+                 words_per_file: int = 2000,
+                 russian_share: float = 0.5,
+                 word_lengths: Optional[Dict[int, float]] = None,
+                 formats: Optional[Dict[str, float]] = None):
+        """
+        :param int seed: Seed of the random generator.
+        :param int files: Number of the files.
+        :param int depth: Depth of the tree of the folders.
+        :param int branching: Number of sub-folders of every folder.
+        :param int vocabulary: Number of distinct words of every language.
+        :param int words_per_file: Average number of words in the file.
+        :param float russian_share: Share of Russian words in the texts.
+        :param dict word_lengths: Weights of the lengths of the words.
+        :param dict formats: Weights of the extensions of the files.
+        """
+        self.seed = seed
+        self.files = files
+        self.depth = depth
+        self.branching = branching
+        self.vocabulary = vocabulary
+        self.words_per_file = words_per_file
+        self.russian_share = russian_share
+        self.word_lengths = word_lengths or WORD_LENGTHS
+        self.formats = formats or FORMATS
+
+    def get_config(self) -> dict:
+        return {
+            "seed": self.seed,
+            "files": self.files,
+            "depth": self.depth,
+            "branching": self.branching,
+            "vocabulary": self.vocabulary,
+            "words_per_file": self.words_per_file,
+            "russian_share": self.russian_share,
+            "word_lengths": {str(k): v for k, v in self.word_lengths.items()},
+            "formats": self.formats,
+        }
+
+    def generate(self, path: str) -> List[str]:
+        """
+        Writes the corpus into the folder.
+        :param str path: Folder to write the corpus to, it is created if
+        it does not exist.
+        :return: paths of the written files.
+        :rtype: list
+        """
+        rng = random.Random(self.seed)
+        words = {
+            "ru": self.__make_vocabulary(rng, RUSSIAN_LETTERS),
+            "en": self.__make_vocabulary(rng, ENGLISH_LETTERS),
+        }
+        # Frequencies of the words follow Zipf's law as in real texts.
+        weights = list(itertools.accumulate(
+            1 / rank for rank in range(1, self.vocabulary + 1)))
+        folders = self.__make_folders(path)
+        extensions = list(self.formats)
+
+        filenames = []
+        for number in range(self.files):
+            folder = rng.choice(folders)
+            extension = rng.choices(
+                extensions, [self.formats[e] for e in extensions])[0]
+            paragraphs = self.__make_paragraphs(rng, words, weights)
+            filename = os.path.join(folder, f"file_{number}{extension}")
+            WRITERS[extension](filename, paragraphs)
+            filenames.append(filename)
+        return filenames
+
+    def __make_vocabulary(self, rng: random.Random,
+                          letters: str) -> List[str]:
+        lengths = list(self.word_lengths)
+        length_weights = [self.word_lengths[n] for n in lengths]
+        vocabulary = set()
+        # Number of distinct short words is limited, longer words are
+        # added when they are exhausted.
+        for attempt in range(self.vocabulary * 20):
+            if len(vocabulary) == self.vocabulary:
+                break
+            length = rng.choices(lengths, length_weights)[0]
+            vocabulary.add("".join(rng.choices(letters, k=length)))
+        return sorted(vocabulary, key=lambda w: (len(w), w))
+
+    def __make_folders(self, path: str) -> List[str]:
+        folders = [path]
+        level = [path]
+        for depth in range(self.depth):
+            level = [os.path.join(parent, f"folder_{depth}_{number}")
+                     for parent in level for number in range(self.branching)]
+            folders.extend(level)
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+        return folders
+
+    def __make_paragraphs(self, rng: random.Random, words: Dict[str, List],
+                          weights: List[float]) -> List[str]:
+        amount = rng.randint(self.words_per_file // 2,
+                             self.words_per_file * 3 // 2)
+        paragraphs = []
+        while amount > 0:
+            size = min(amount, rng.randint(20, 120))
+            amount -= size
+            language = "ru" if rng.random() < self.russian_share else "en"
+            sentence = rng.choices(words[language], cum_weights=weights,
+                                   k=size)
+            # Some words start sentences and some are followed by commas.
+            sentence[0] = sentence[0].capitalize()
+            paragraphs.append(" ".join(
+                word + ("," if rng.random() < 0.1 else "")
+                for word in sentence) + ".")
+        return paragraphs
+
+
+def write_text(filename: str, paragraphs: List[str]):
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write("\n\n".join(paragraphs))
+
+
+def write_python(filename: str, paragraphs: List[str]):
+    with open(filename, "w", encoding="utf-8") as file:
+        for number, paragraph in enumerate(paragraphs):
+            file.write(f"def function_{number}(value):\n"
+                       f"    \"\"\"\n    {paragraph}\n    \"\"\"\n"
+                       f"    return value * {number}\n\n\n")
+
+
+def write_html(filename: str, paragraphs: List[str]):
+    with open(filename, "w", encoding="utf-8") as file:
+        file.write(get_html(paragraphs))
+
+
+def get_html(paragraphs: List[str]) -> str:
+    body = "".join(f"<p>{escape(paragraph)}</p>\n"
+                   for paragraph in paragraphs)
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+            '<head><title>Title</title>'
+            '<style>p { margin: 0; }</style></head>\n'
+            f'<body>\n{body}</body>\n</html>\n')
+
+
+def write_docx(filename: str, paragraphs: List[str]):
+    body = "".join(
+        f'<w:p><w:r><w:t xml:space="preserve">{escape(paragraph)}'
+        f'</w:t></w:r></w:p>'
+        for paragraph in paragraphs)
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as document:
+        document.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'content-types"><Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.'
+            'wordprocessingml.document.main+xml"/></Types>')
+        document.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<w:document xmlns:w="{WORD_NAMESPACE}"><w:body>{body}'
+            '</w:body></w:document>')
+
+
+def write_epub(filename: str, paragraphs: List[str]):
+    # Every chapter holds up to ten paragraphs.
+    chapters = [paragraphs[i:i + 10] for i in range(0, len(paragraphs), 10)]
+    manifest = "".join(
+        f'<item id="c{n}" href="chapter_{n}.xhtml" '
+        f'media-type="application/xhtml+xml"/>'
+        for n in range(len(chapters)))
+    spine = "".join(f'<itemref idref="c{n}"/>' for n in range(len(chapters)))
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as book:
+        book.writestr("mimetype", "application/epub+zip",
+                      compress_type=zipfile.ZIP_STORED)
+        book.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0"?><container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+            'media-type="application/oebps-package+xml"/></rootfiles>'
+            '</container>')
+        book.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0"?><package version="2.0" '
+            'xmlns="http://www.idpf.org/2007/opf">'
+            f'<manifest>{manifest}</manifest><spine>{spine}</spine>'
+            '</package>')
+        for number, chapter in enumerate(chapters):
+            book.writestr(f"OEBPS/chapter_{number}.xhtml", get_html(chapter))
+
+
+# Functions which write the paragraphs into the file by its extension.
+WRITERS = {
+    ".txt": write_text,
+    ".py": write_python,
+    ".html": write_html,
+    ".docx": write_docx,
+    ".epub": write_epub,
+}
+
+
+def get_corpus_digest(path: str) -> str:
+    """
+    Returns hash of the names and the contents of the files of the corpus,
+    results of the benchmarks are comparable only for the same corpus.
+    Text of the zip based formats is hashed as zip members have times.
+    :rtype: str
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for folder, sub_folders, files in sorted(os.walk(path)):
+        sub_folders.sort()
+        for name in sorted(files):
+            filename = os.path.join(folder, name)
+            digest.update(os.path.relpath(filename, path).encode("utf-8"))
+            if zipfile.is_zipfile(filename):
+                with zipfile.ZipFile(filename) as archive:
+                    for member in sorted(archive.namelist()):
+                        digest.update(archive.read(member))
+            else:
+                with open(filename, "rb") as file:
+                    digest.update(file.read())
+    return digest.hexdigest()
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+# Speed is better when it is higher, everything else is time.
+HIGHER_IS_BETTER_SUFFIX = "_per_second"
+
+
+def setup_django(database: str):
+    """
+    Configures Django to use the benchmark settings with a new database.
+    :param str database: Path of the SQLite database.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+    os.environ["BENCHMARK_DATABASE"] = database
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def run_benchmarks(generator, names: List[str], repeats: int) -> Dict:
+    """
+    Generates the corpus and runs the benchmarks on it.
+    :param generator: CorpusGenerator of the corpus.
+    :param List names: Names of the benchmarks to run.
+    :param int repeats: Number of runs of every measurement.
+    :return: configuration of the run and results of the benchmarks.
+    :rtype: dict
+    """
+    from benchmarks.corpus import get_corpus_digest
+    from benchmarks.suites import BENCHMARKS, Corpus
+    from django.conf import settings
+
+    with tempfile.TemporaryDirectory(prefix="corpus") as path:
+        corpus = Corpus(path, generator.generate(path))
+        results = {}
+        for name in names:
+            print(f"Running {name}...", file=sys.stderr)
+            for key, value in BENCHMARKS[name](corpus, repeats).items():
+                results[f"{name}.{key}"] = round(value, 6)
+
+        return {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "processors": os.cpu_count(),
+                "scan_workers": getattr(settings, 'SCAN_WORKERS', 1),
+            },
+            "corpus": {
+                **generator.get_config(),
+                "digest": get_corpus_digest(path),
+                "size": sum(os.path.getsize(f) for f in corpus.filenames),
+            },
+            "repeats": repeats,
+            "results": results,
+        }
+
+
+def compare_results(results: Dict[str, float], baseline: Dict[str, float],
+                    tolerance: float) -> List[str]:
+    """
+    Prints results next to the baseline and returns names of the results
+    which are worse than the baseline by more than the tolerance.
+    :param float tolerance: Allowed relative slowdown, 0.2 is 20%.
+    :rtype: list
+    """
+    regressions = []
+    print(f"{'benchmark':<50} {'baseline':>12} {'current':>12} "
+          f"{'change':>8}")
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"{name:<50} {'-':>12} {value:>12.4g}")
+            continue
+        base = baseline[name]
+        if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+            slowdown = base / value - 1 if value else float("inf")
+        else:
+            slowdown = value / base - 1 if base else 0.0
+        mark = ""
+        if slowdown > tolerance:
+            regressions.append(name)
+            mark = " REGRESSION"
+        print(f"{name:<50} {base:>12.4g} {value:>12.4g} "
+              f"{-slowdown:>+8.1%}{mark}")
+    return regressions
+
+
+def parse_arguments(argv: Optional[List[str]]) -> argparse.Namespace:
+    from benchmarks.suites import BENCHMARKS
+
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Runs benchmarks of the parser on generated corpus "
+                    "and compares them with the baseline.")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)}, "
+                             f"all by default")
+    parser.add_argument("--output", help="file to write results to")
+    parser.add_argument("--baseline",
+                        help="results to compare with, exits with 1 if "
+                             "a result is worse than in them")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write results to the baseline file instead "
+                             "of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown (default 0.25)")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="runs of every measurement, the best one is "
+                             "taken (default 3)")
+    corpus = parser.add_argument_group("corpus")
+    corpus.add_argument("--seed", type=int, default=0)
+    corpus.add_argument("--files", type=int, default=200)
+    corpus.add_argument("--depth", type=int, default=3)
+    corpus.add_argument("--branching", type=int, default=3)
+    corpus.add_argument("--vocabulary", type=int, default=20000,
+                        help="distinct words of every language")
+    corpus.add_argument("--words-per-file", type=int, default=2000)
+    corpus.add_argument("--russian-share", type=float, default=0.5)
+    corpus.add_argument("--formats", type=json.loads,
+                        help='weights of the extensions of the files, '
+                             'e.g. {".txt": 1, ".docx": 1}')
+    arguments = parser.parse_args(argv)
+    unknown = set(arguments.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    return arguments
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    with tempfile.TemporaryDirectory(prefix="benchmark") as directory:
+        setup_django(os.path.join(directory, "db.sqlite3"))
+        arguments = parse_arguments(argv)
+
+        from benchmarks.corpus import CorpusGenerator
+        from benchmarks.suites import BENCHMARKS
+
+        generator = CorpusGenerator(
+            seed=arguments.seed, files=arguments.files,
+            depth=arguments.depth, branching=arguments.branching,
+            vocabulary=arguments.vocabulary,
+            words_per_file=arguments.words_per_file,
+            russian_share=arguments.russian_share,
+            formats=arguments.formats)
+        report = run_benchmarks(generator, arguments.names or list(BENCHMARKS),
+                                arguments.repeats)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(output + "\n")
+
+    if arguments.baseline and arguments.save_baseline:
+        with open(arguments.baseline, "w") as file:
+            file.write(output + "\n")
+        return 0
+    if not arguments.baseline:
+        if not arguments.output:
+            print(output)
+        return 0
+
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)
+    if baseline["corpus"]["digest"] != report["corpus"]["digest"]:
+        print("The baseline was measured on another corpus, run with "
+              "the same corpus options or save a new baseline",
+              file=sys.stderr)
+        return 2
+    regressions = compare_results(report["results"], baseline["results"],
+                                  arguments.tolerance)
+    if regressions:
+        print(f"{len(regressions)} results are worse than the baseline by "
+              f"more than {arguments.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+from final_task.settings import *  # noqa: F401,F403
+
+# Benchmarks write into their own SQLite database, tables of the project
+# apps are created from the models without migrations.
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DATABASE', os.path.join(
+            tempfile.gettempdir(), 'final_task_benchmark.sqlite3')),
+    }
+}
+MIGRATION_MODULES = {
+    'api_for_files_and_dirs': None,
+    'background_parser': None,
+}
+
+# Extracted texts are not cached between runs.
+EXTRACTION_CACHE_DIR = None
@@ -0,0 +1,244 @@
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from background_parser.file_analyzer import FileAnalyzer
+from background_parser.hyphenation import get_hyphenation_cache
+from background_parser.manifest import ScanPlan
+from background_parser.models import FileStatistic
+from background_parser.opener import get_content
+from background_parser.parser import (TOKENIZERS, FileParser, iter_words,
+                                      tokenize)
+from background_parser.services import (analyze_folder_and_save_results,
+                                        merge_folders_statistic)
+from background_parser.walker import get_walker
+from background_parser.writers import BulkWriter
+from django.core.management import call_command
+
+MEGABYTE = 1024 ** 2
+
+
+def measure(function: Callable, repeats: int,
+            setup: Optional[Callable] = None) -> float:
+    """
+    Runs the function several times and returns the best time, which is
+    the least disturbed by other processes.
+    :param function: Function to measure.
+    :param int repeats: Number of runs.
+    :param setup: Function which is run before every run and is not
+    measured.
+    :return: seconds of the fastest run.
+    :rtype: float
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def clear_caches():
+    get_hyphenation_cache().clear()
+
+
+class Corpus:
+    """
+    Generated files the benchmarks are run on.
+    """
+    def __init__(self, path: str, filenames: List[str]):
+        self.path = path
+        self.filenames = filenames
+        self.extensions = sorted({os.path.splitext(f)[-1]
+                                  for f in filenames})
+        self.__analyzers: Optional[Dict[str, FileAnalyzer]] = None
+
+    def get_files(self, extension: str) -> List[str]:
+        return [f for f in self.filenames if f.endswith(extension)]
+
+    def get_text(self) -> str:
+        """
+        Returns joined text of the plain text files.
+        """
+        texts = []
+        for filename in self.get_files(".txt"):
+            with open(filename, encoding="utf-8") as file:
+                texts.append(file.read())
+        return "\n".join(texts)
+
+    def get_analyzers(self) -> Dict[str, FileAnalyzer]:
+        """
+        Returns calculated analyzers of all the files, they are calculated
+        once and are not saved again.
+        """
+        if self.__analyzers is None:
+            self.__analyzers = {}
+            for filename in self.filenames:
+                analyzer = FileAnalyzer(filename, changed=False)
+                analyzer.calculate_stat()
+                self.__analyzers[filename] = analyzer
+        return self.__analyzers
+
+
+def benchmark_tokenize(corpus: Corpus, repeats: int) -> Dict[str, float]:
+    """
+    Number of words extracted from the text and of WordTokens made of them
+    per second by every tokenizer, the hyphenation cache is cold.
+    """
+    text = corpus.get_text()
+    words = sum(1 for _ in iter_words(text))
+    results = {}
+    for engine in TOKENIZERS:
+        seconds = measure(lambda: sum(1 for _ in iter_words(text, engine)),
+                          repeats)
+        results[f"{engine}.words_per_second"] = words / seconds
+        seconds = measure(lambda: sum(1 for _ in tokenize(text, engine)),
+                          repeats, setup=clear_caches)
+        results[f"{engine}.tokens_per_second"] = words / seconds
+    return results
+
+
+def benchmark_file_parser(corpus: Corpus,
+                          repeats: int) -> Dict[str, float]:
+    """
+    Seconds FileParser spends on a megabyte of text in every counting mode
+    with every letter engine, the hyphenation cache is cold.
+    """
+    text = corpus.get_text()
+    megabytes = len(text.encode("utf-8")) / MEGABYTE
+    results = {}
+    for counting_mode in ("distinct", "per_token"):
+        for letter_engine in ("python", "numpy"):
+            seconds = measure(
+                lambda: FileParser(text, counting_mode, letter_engine),
+                repeats, setup=clear_caches)
+            results[f"{counting_mode}.{letter_engine}.seconds_per_mb"] = \
+                seconds / megabytes
+    return results
+
+
+def benchmark_opener(corpus: Corpus, repeats: int) -> Dict[str, float]:
+    """
+    Speed of reading of the text of the files of every format.
+    """
+    results = {}
+    for extension in corpus.extensions:
+        filenames = corpus.get_files(extension)
+        megabytes = sum(os.path.getsize(f) for f in filenames) / MEGABYTE
+
+        def read():
+            for filename in filenames:
+                for _ in get_content(filename):
+                    pass
+
+        seconds = measure(read, repeats)
+        name = extension.lstrip(".")
+        results[f"{name}.mb_per_second"] = megabytes / seconds
+        results[f"{name}.seconds_per_file"] = seconds / len(filenames)
+    return results
+
+
+def benchmark_aggregators(corpus: Corpus,
+                          repeats: int) -> Dict[str, float]:
+    """
+    Seconds spent on merging calculated statistic of the files into
+    statistic of the folders in every word frequency mode.
+    """
+    analyzers = corpus.get_analyzers()
+    folders = []
+    for path, sub_folders, files in get_walker(corpus.path,
+                                               corpus.extensions):
+        filenames = [os.path.join(path, file) for file in files]
+        folders.append((path, sub_folders, files,
+                        [analyzers[f] for f in filenames]))
+
+    results = {}
+    for mode in ("exact", "approximate"):
+        # Empty plan does not save the folders.
+        seconds = measure(
+            lambda: merge_folders_statistic(corpus.path, folders,
+                                            ScanPlan(corpus.path), mode=mode),
+            repeats)
+        results[f"{mode}.seconds"] = seconds
+        results[f"{mode}.files_per_second"] = len(analyzers) / seconds
+    return results
+
+
+def benchmark_database(corpus: Corpus, repeats: int,
+                       rows: int = 5000) -> Dict[str, float]:
+    """
+    Rows of statistic of the files written per second by BulkWriter into
+    the empty table and over existing rows.
+    """
+    analyzers = list(corpus.get_analyzers().values())
+    partials = [analyzer.get_partial_statistic() for analyzer in analyzers]
+    statistic = []
+    for number in range(rows):
+        analyzer = analyzers[number % len(analyzers)]
+        stat = analyzer.statistic
+        statistic.append(FileStatistic(
+            slug=f"benchmark-{number}",
+            file=f"{analyzer.filename}-{number}",
+            most_recent_word=stat["most_recent_word"],
+            least_recent_word=stat["least_recent_word"],
+            average_word_length=stat["average_word_length"],
+            vowels=stat["vowels"],
+            consonants=stat["consonants"],
+            syllables=stat["syllables"],
+            partial_statistic=partials[number % len(analyzers)]))
+
+    def write():
+        with BulkWriter() as writer:
+            for row in statistic:
+                writer.add(row)
+
+    def delete():
+        FileStatistic.objects.all().delete()
+
+    inserted = measure(write, repeats, setup=delete)
+    updated = measure(write, repeats)
+    delete()
+    return {
+        "insert.rows_per_second": rows / inserted,
+        "upsert.rows_per_second": rows / updated,
+    }
+
+
+def benchmark_end_to_end(corpus: Corpus, repeats: int) -> Dict[str, float]:
+    """
+    Seconds of the whole analyze_folder_and_save_results run on the empty
+    database and of the rescan of the unchanged folder in every word
+    frequency mode.
+    """
+    megabytes = sum(os.path.getsize(f) for f in corpus.filenames) / MEGABYTE
+
+    def reset():
+        call_command("flush", interactive=False, verbosity=0)
+        clear_caches()
+
+    results = {}
+    for mode in ("exact", "approximate"):
+        seconds = measure(
+            lambda: analyze_folder_and_save_results.now(
+                corpus.path, corpus.extensions, mode),
+            repeats, setup=reset)
+        results[f"{mode}.seconds"] = seconds
+        results[f"{mode}.mb_per_second"] = megabytes / seconds
+        results[f"{mode}.rescan_seconds"] = measure(
+            lambda: analyze_folder_and_save_results.now(
+                corpus.path, corpus.extensions, mode), repeats)
+    reset()
+    return results
+
+
+# Benchmarks by their names, names of their results are prefixed by them.
+BENCHMARKS: Dict[str, Callable[[Corpus, int], Dict[str, float]]] = {
+    "tokenize": benchmark_tokenize,
+    "file_parser": benchmark_file_parser,
+    "opener": benchmark_opener,
+    "aggregators": benchmark_aggregators,
+    "database": benchmark_database,
+    "end_to_end": benchmark_end_to_end,
+}
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -86,6 +88,8 @@ DATABASES = {
         'PASSWORD': 'mysecretpassword',
         'HOST': 'db',
         'PORT': 5432,
+        # Connections of the threads of async views are reused.
+        'CONN_MAX_AGE': 60,
     }
 }
 
@@ -145,3 +149,144 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ]
 }
+
+
+# Background parser
+
+# Engine used by background_parser.parser.tokenize: 'chunked' extracts words
+# with one regex pass per chunk, 'reference' is the original per-symbol loop.
+PARSER_TOKENIZER = 'chunked'
+
+# How FileParser counts statistic: 'distinct' analyzes every distinct word
+# once and weights it by frequency, 'per_token' analyzes every occurrence.
+PARSER_COUNTING_MODE = 'distinct'
+
+# Maximum number of words kept in the in-memory hyphenation cache and
+# optional path of sqlite database to keep hyphenated words between restarts.
+HYPHENATION_CACHE_SIZE = 100000
+HYPHENATION_DISK_CACHE = None
+
+# Engine used to count vowels and consonants: 'python' counts letters of
+# every word, 'numpy' counts them over the whole text with numpy.
+PARSER_LETTER_ENGINE = 'python'
+
+# Size of the chunks in bytes the files are read and decoded by.
+OPENER_CHUNK_SIZE = 1024 * 1024
+
+# Number of worker processes which analyze files of a scan in parallel
+# (1 analyzes them one by one in the background task process) and number
+# of files sent to a worker at once.
+SCAN_WORKERS = os.cpu_count() or 1
+SCAN_CHUNK_SIZE = 16
+
+# Compare hashes of the content of files whose modification time has
+# changed but size has not, before analyzing them again.
+SCAN_HASH_CONTENT = False
+
+# Number of rows of the statistic written to the database by one query.
+DB_WRITE_BATCH_SIZE = 500
+
+# Sizes of the sketches which keep word frequencies of folders in approximate
+# mode: number of tracked frequent words, number of tracked candidates for
+# the least frequent word and width and depth of the Count-Min table.
+SKETCH_CAPACITY = 1000
+SKETCH_RARE_CAPACITY = 100
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+
+# Directory of the cache of text extracted from documents by textract
+# (None disables the cache) and maximum total size of the cached texts.
+EXTRACTION_CACHE_DIR = os.path.join(tempfile.gettempdir(),
+                                    'final_task_extraction_cache')
+EXTRACTION_CACHE_SIZE = 1024 ** 3
+
+# Limits of extraction of text by textract per extension, 'default' is used
+# for extensions without limits of their own: timeout in seconds, maximum
+# size of the file and memory of the extraction process in bytes and number
+# of files extracted at once by all scan workers.
+EXTRACTION_LIMITS = {
+    'default': {'timeout': 60, 'max_size': 50 * 1024 ** 2,
+                'memory': 1024 ** 3, 'concurrency': 2},
+    '.pdf': {'timeout': 120, 'max_size': 200 * 1024 ** 2,
+             'memory': 2 * 1024 ** 3, 'concurrency': 1},
+}
+
+# Number of files an extraction process handles before it is replaced.
+EXTRACTION_WORKER_MAX_JOBS = 100
+
+# How often in seconds a scan job saves its progress and checks whether it
+# was cancelled, how often the task of a running job marks it alive, and
+# after how many seconds without that heartbeat and without queued tasks
+# a running job is considered dead and does not block identical requests.
+SCAN_PROGRESS_INTERVAL = 1.0
+SCAN_JOB_HEARTBEAT_SECONDS = 60
+SCAN_JOB_STALE_SECONDS = 600
+
+# Maximum number of shards a scan is split into, every shard is analyzed
+# by its own task, so the shards run in parallel on several background
+# workers. 1 analyzes the whole scan in one task.
+SCAN_SHARDS = 1
+
+# Default and maximum number of rows on a page of the file and directory
+# endpoints, and number of rows serialized at once by streamed listings.
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_BATCH_SIZE = 500
+
+# How long in seconds the API trusts the scan generation it has read before
+# reading it again, and maximum total size in bytes of the responses cached
+# until the next scan by every API process.
+SCAN_GENERATION_TTL = 1.0
+RESPONSE_CACHE_SIZE = 64 * 1024 ** 2
+
+# Number of words which statistic is kept in memory by every API process,
+# and maximum number of words in one request to /api/words.
+WORD_STATISTIC_CACHE_SIZE = 100000
+WORD_BATCH_MAX_SIZE = 10000
+
+# Number of threads which run database queries of async views (and so
+# the maximum number of their connections) and threads which calculate
+# statistic of words, per API process.
+API_DATABASE_THREADS = 16
+API_CPU_THREADS = 4
+
+# Directory where every scan task dumps its cProfile statistic (None
+# disables profiling), and after how many seconds metrics of a background
+# process which has not saved them are dropped from /api/metrics.
+SCAN_PROFILE_DIR = None
+METRICS_SNAPSHOT_MAX_AGE = 7 * 24 * 3600
+
+# What the scans walk: glob patterns of the files and folders to skip
+# (patterns with '/' are matched with the end of the path relative to
+# the scanned folder, others with the name), glob patterns of the names of
+# the files to analyze (None analyzes every file with the extensions),
+# depth of the deepest walked folders (None for no limit, the scanned
+# folder has depth 0), whether symbolic links to folders are walked,
+# maximum size of the analyzed files in bytes (None for no limit) and
+# number of folders listed at once, more than 1 helps on network file
+# systems.
+SCAN_EXCLUDE = ['.git', '.hg', '.svn', 'node_modules', 'venv', '.venv',
+                '__pycache__', '.tox', 'data/db']
+SCAN_INCLUDE = None
+SCAN_MAX_DEPTH = None
+SCAN_FOLLOW_SYMLINKS = False
+SCAN_MAX_FILE_SIZE = None
+SCAN_WALKER_THREADS = 1
+
+# Inverted index of the words of the analyzed files behind /api/search:
+# number of files written into one segment of the index, number of
+# segments after which the smallest ones are merged, share of stale
+# postings after which a segment is rewritten, and the shortest prefix
+# which can be searched.
+WORD_INDEX_SEGMENT_FILES = 10000
+WORD_INDEX_MAX_SEGMENTS = 16
+WORD_INDEX_MAX_STALE_SHARE = 0.2
+SEARCH_MIN_PREFIX_LENGTH = 2
+
+# Seconds a process waits for another one which extracts the same document
+# into the extraction cache, older claims are taken over.
+EXTRACTION_CACHE_MAX_WAIT = 300
+
+# Seconds failed or timed out extraction of a document is remembered in
+# the extraction cache, the document is not extracted again meanwhile.
+EXTRACTION_CACHE_FAILURE_TTL = 600